@@ -3,15 +3,14 @@ import json
 from typing import Dict, List
 
 from dotenv import load_dotenv, find_dotenv
-from fastapi import FastAPI, Request, Response, Form, HTTPException
+from fastapi import Depends, FastAPI, Request, Response, Form, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
-from rag_system.rag_pipelines import select_rag_pipeline
-from rag_system.responds import get_respond_fastapi
-from rag_system.ingest import load_data_into_store
+from rag_system.responds import get_respond_fastapi_async
+from rag_system.server import RagState, get_rag_state, lifespan, router
 
 app = FastAPI(
     title="AI Q&A system for seven wonders using API",
@@ -33,7 +32,8 @@ app.add_middleware(
 load_dotenv(find_dotenv())
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.include_router(router)
 # Configure templates
 templates = Jinja2Templates(directory="templates")
 
@@ -45,15 +45,14 @@ def index() -> Dict[str, str]:
 
 
 @app.post("/get_answer")
-async def answer(question: str = Form(...)) -> Dict[str, str | List[str]]:
+async def answer(question: str = Form(...),
+                 state: RagState = Depends(get_rag_state))\
+        -> Dict[str, str | List[str]]:
     """Load output result of the inference of the rag algorithm."""
-    doc_store = load_data_into_store()
-    rag_pipeline = select_rag_pipeline(doc_store)
-    print(question)
     if not question:
         raise HTTPException(status_code=404)
-    curr_answer, relevant_documents = get_respond_fastapi(question,
-                                                          rag_pipeline)
+    curr_answer, relevant_documents = await get_respond_fastapi_async(
+        question, state.rag_pipeline)
     k = len(relevant_documents)
 
     return {"answer": curr_answer,
@@ -62,14 +61,13 @@ async def answer(question: str = Form(...)) -> Dict[str, str | List[str]]:
 
 
 @app.post("/get_answer_gui")
-async def answer_gui(request: Request, question: str = Form(...)) -> Response:
+async def answer_gui(request: Request, question: str = Form(...),
+                     state: RagState = Depends(get_rag_state)) -> Response:
     """Load output result of the inference of the rag algorithm."""
-    doc_store = load_data_into_store()
-    rag_pipeline = select_rag_pipeline(doc_store)
     if not question:
         raise HTTPException(status_code=404)
-    curr_answer, relevant_documents = get_respond_fastapi(question,
-                                                          rag_pipeline)
+    curr_answer, relevant_documents = await get_respond_fastapi_async(
+        question, state.rag_pipeline)
     response_data = jsonable_encoder(json.dumps(
         {"answer": curr_answer,
          "relevant_documents": relevant_documents
@@ -0,0 +1,138 @@
+"""Contain an inverted file (IVF) approximate nearest-neighbour index."""
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag_system.matrix_retriever import normalize_rows, top_k_indices
+
+logger = logging.getLogger('__main__')
+
+INDEX_FILE = 'ivf.npz'
+
+
+class IVFIndex:
+    """Partition documents into k-means cells and search the nearest cells.
+
+    The index stores the (normalized) centroids and the cell of every
+    document id; the vectors themselves stay in the embedding matrix the
+    index is bound to. New documents are inserted by assigning them to
+    their nearest centroid, without retraining; inserted counts them so
+    that the owner can retrain once the cells drift.
+    """
+
+    def __init__(self, centroids: np.ndarray, cells: Dict[str, int],
+                 nprobe: int = 8, inserted: int = 0):
+        self.centroids = centroids
+        self.cells = cells
+        self.nprobe = nprobe
+        self.inserted = inserted
+        self.matrix: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int = 100, nprobe: int = 8,
+              iterations: int = 10, seed: int = 0,
+              ids: Optional[List[str]] = None) -> 'IVFIndex':
+        """Cluster the vectors with spherical k-means into nlist cells.
+
+        With ids the vectors are assigned to the cells as the documents
+        the index was trained on.
+        """
+        rng = np.random.default_rng(seed)
+        vectors = normalize_rows(vectors)
+        nlist = max(1, min(nlist, len(vectors)))
+        # Train on a sample, k-means converges long before seeing everything
+        sample = vectors[rng.choice(len(vectors),
+                                    min(len(vectors), 256 * nlist),
+                                    replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = sample[rng.choice(len(sample), empty.sum())]
+            centroids = normalize_rows(sums)
+        index = cls(centroids, {}, nprobe)
+        if ids:
+            index.cells = dict(zip(ids, index.assign(vectors).tolist()))
+        return index
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Return the nearest cell of every vector."""
+        cells = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), 65536):
+            chunk = normalize_rows(vectors[i:i + 65536])
+            cells[i:i + 65536] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return cells
+
+    def add(self, ids: List[str], vectors: np.ndarray) -> None:
+        """Insert documents into their nearest cells."""
+        if ids:
+            self.cells.update(zip(ids, self.assign(vectors).tolist()))
+            self.inserted += len(ids)
+
+    def remove(self, ids: List[str]) -> None:
+        """Remove documents from the index."""
+        for doc_id in ids:
+            self.cells.pop(doc_id, None)
+
+    def bind(self, ids: List[str], matrix: np.ndarray) -> int:
+        """Search the rows of matrix, row i holding document ids[i].
+
+        Documents the index does not know yet are inserted; the number of
+        inserted documents is returned.
+        """
+        missing = [row for row, doc_id in enumerate(ids)
+                   if doc_id not in self.cells]
+        self.add([ids[row] for row in missing], matrix[missing])
+        cells = np.fromiter((self.cells[doc_id] for doc_id in ids),
+                            dtype=np.int32, count=len(ids))
+        order = np.argsort(cells, kind='stable')
+        bounds = np.searchsorted(cells[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]]
+                      for c in range(self.nlist)]
+        self.matrix = matrix
+        return len(missing)
+
+    def search(self, queries: np.ndarray, top_k: int)\
+            -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return rows and scores of the top_k rows of every query."""
+        queries = normalize_rows(np.atleast_2d(queries))
+        nprobe = min(self.nprobe, self.nlist)
+        probes = np.argpartition(-(queries @ self.centroids.T),
+                                 nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, cells in zip(queries, probes):
+            rows = np.concatenate([self.lists[c] for c in cells])
+            scores = (self.matrix[rows].astype(np.float32) @ query)[None]
+            indices, top_scores = top_k_indices(scores, top_k)
+            results.append((rows[indices[0]], top_scores[0]))
+        return results
+
+    def save(self, path: str) -> None:
+        """Persist the centroids and the cells of all documents."""
+        os.makedirs(path, exist_ok=True)
+        tmp_file = os.path.join(path, INDEX_FILE + '.tmp.npz')
+        np.savez(tmp_file, centroids=self.centroids,
+                 ids=np.array(list(self.cells.keys()), dtype=str),
+                 cells=np.array(list(self.cells.values()), dtype=np.int32),
+                 inserted=self.inserted)
+        os.replace(tmp_file, os.path.join(path, INDEX_FILE))
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = 8) -> Optional['IVFIndex']:
+        """Load the index saved at path or return None if there is none."""
+        index_file = os.path.join(path, INDEX_FILE)
+        if not os.path.exists(index_file):
+            return None
+        with np.load(index_file) as data:
+            cells = dict(zip(data['ids'].tolist(), data['cells'].tolist()))
+            inserted = int(data['inserted']) if 'inserted' in data else 0
+            return cls(data['centroids'], cells, nprobe, inserted)
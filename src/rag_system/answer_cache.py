@@ -0,0 +1,161 @@
+"""Contain an exact-match cache of the answers of the rag pipeline."""
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import box
+import yaml
+
+from rag_system.prompts import PROMPT_TEMPLATE
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+# Settings that change the answer of the same question: corpus, models,
+# retrieval, fusion, reranking and generation
+FINGERPRINT_KEYS = ('TYPE_RETRIEVAL', 'TYPE_DOCSTORE', 'DATA_SET',
+                    'DOC_ID_KEYS', 'EMBEDDINGS', 'EMBEDDINGS_REVISION',
+                    'DENSE_RETRIEVER', 'MATRIX_DTYPE', 'ANN_INDEX',
+                    'ANN_NLIST', 'ANN_NPROBE', 'QUANTIZATION',
+                    'QUANT_RESCORE_FACTOR', 'SPARSE_RETRIEVER', 'BM25_K1',
+                    'BM25_B', 'HYBRID_BRANCH_TOP_K', 'HYBRID_FUSION',
+                    'HYBRID_WEIGHTS', 'HYBRID_RERANKER', 'RERANKER_MODEL',
+                    'HYBRID_RERANK_CANDIDATES', 'HYBRID_TOP_K',
+                    'RERANK_CACHE', 'RERANK_MAX_LENGTH',
+                    'RERANK_PRUNE_GAP', 'LLM_TYPE', 'LLM_MODEL')
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question and collapse its whitespace."""
+    return " ".join(question.lower().split())
+
+
+def pipeline_fingerprint(corpus_version: str = "") -> str:
+    """Hash the pipeline settings, prompt template and corpus version."""
+    settings = {key: cfg.get(key) for key in FINGERPRINT_KEYS}
+    settings['prompt'] = PROMPT_TEMPLATE
+    settings['corpus'] = corpus_version
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()[:16]
+
+
+class AnswerCache:
+    """Keep answers in an in-process lru with ttl, optionally on disk.
+
+    Keys are the normalized question plus the pipeline fingerprint, so a
+    new corpus version (recorded by the ingestion) or another model or
+    prompt never serves a stale answer. The sqlite backend at path keeps
+    answers across restarts.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600,
+                 path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.fingerprint = pipeline_fingerprint()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0,
+                         'expired': 0, 'evictions': 0}
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT "
+                            "PRIMARY KEY, fingerprint TEXT, value TEXT, "
+                            "expires REAL)")
+
+    def set_corpus_version(self, corpus_version: str) -> None:
+        """Switch to the fingerprint of a (re-)ingested corpus."""
+        fingerprint = pipeline_fingerprint(corpus_version)
+        with self.lock:
+            if fingerprint == self.fingerprint:
+                return
+            self.fingerprint = fingerprint
+            self.entries.clear()
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM answers WHERE fingerprint "
+                                    "!= ? OR expires < ?",
+                                    (fingerprint, time.time()))
+        logger.info(f"Answer cache switched to fingerprint {fingerprint}")
+
+    def key(self, question: str) -> str:
+        """Return the cache key of a question under the fingerprint."""
+        payload = self.fingerprint + normalize_question(question)
+        return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+    def get(self, question: str) -> Optional[Tuple[str, List[str]]]:
+        """Return the cached answer and documents or None."""
+        key = self.key(question)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                self.counters['expired'] += 1
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1]
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires FROM answers WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None and row[1] >= now:
+                    value = tuple(json.loads(row[0]))
+                    self._remember(key, row[1], value)
+                    self.counters['disk_hits'] += 1
+                    return value
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, question: str, value: Tuple[str, List[str]]) -> None:
+        """Store the answer and documents of a question."""
+        key = self.key(question)
+        expires = time.time() + self.ttl
+        with self.lock:
+            self._remember(key, expires, tuple(value))
+            if self.db is not None:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                        (key, self.fingerprint, json.dumps(value), expires))
+
+    def _remember(self, key: str, expires: float, value: Tuple) -> None:
+        """Insert into the lru, evicting the least recently used entries."""
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters, the hit rate and the number of entries."""
+        with self.lock:
+            hits = self.counters['hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses']
+            return {**self.counters, 'entries': len(self.entries),
+                    'hit_rate': hits / lookups if lookups else 0.0}
+
+
+_answer_cache: Optional[AnswerCache] = None
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """Return the answer cache of the process or None when disabled."""
+    global _answer_cache
+    if cfg.ANSWER_CACHE and _answer_cache is None:
+        _answer_cache = AnswerCache(cfg.ANSWER_CACHE_SIZE,
+                                    cfg.ANSWER_CACHE_TTL_SEC,
+                                    cfg.ANSWER_CACHE_PATH or None)
+    return _answer_cache
@@ -0,0 +1,97 @@
+"""Contain the precomputed answers of the known question catalogue."""
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import box
+import yaml
+
+from rag_system.answer_cache import normalize_question, pipeline_fingerprint
+from rag_system.faithfulness_cache import get_faithfulness_scorer
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+def catalogue_path(fingerprint: str,
+                   directory: str = cfg.WARMUP_CATALOGUE_DIR) -> str:
+    """Return the catalogue file of a pipeline fingerprint."""
+    return os.path.join(directory, f"catalogue_{fingerprint}.json")
+
+
+def save_catalogue(path: str, fingerprint: str,
+                   records: List[Dict[str, Any]]) -> None:
+    """Write the answered questions of the catalogue atomically."""
+    entries = {normalize_question(record['question']):
+               {key: record.get(key) for key in
+                ('question', 'answer', 'retrieved_docs', 'faithfulness')}
+               for record in records if 'answer' in record}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf8') as file_in:
+        json.dump({'fingerprint': fingerprint, 'entries': entries}, file_in)
+    os.replace(path + '.tmp', path)
+    logger.info(f"Saved {len(entries)} catalogue answers to {path}")
+
+
+class AnswerCatalogue:
+    """Serve the precomputed answers of the catalogue of the corpus.
+
+    The catalogue file is versioned by the pipeline fingerprint (models,
+    prompt and corpus version), so only answers computed with the current
+    pipeline are served; their faithfulness scores seed the scorer cache.
+    """
+
+    def __init__(self):
+        self.fingerprint = pipeline_fingerprint()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_corpus_version(self, corpus_version: str) -> None:
+        """Load the catalogue of a (re-)ingested corpus."""
+        self.fingerprint = pipeline_fingerprint(corpus_version)
+        self.reload()
+
+    def reload(self) -> None:
+        """Load the catalogue file of the current fingerprint, if any."""
+        path = catalogue_path(self.fingerprint)
+        if not os.path.exists(path):
+            self.entries = {}
+            logger.info(f"No answer catalogue at {path}")
+            return
+        with open(path, 'r', encoding='utf8') as file_out:
+            self.entries = json.load(file_out)['entries']
+        scorer = get_faithfulness_scorer()
+        for entry in self.entries.values():
+            if entry.get('faithfulness') is not None:
+                scorer.put(entry['question'], entry['answer'],
+                           entry['retrieved_docs'], entry['faithfulness'])
+        logger.info(f"Loaded {len(self.entries)} catalogue answers")
+
+    def get(self, question: str) -> Optional[Tuple[str, List[str]]]:
+        """Return the precomputed answer and documents or None."""
+        entry = self.entries.get(normalize_question(question))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['answer'], entry['retrieved_docs']
+
+    def stats(self) -> Dict[str, float]:
+        """Return hits, misses and the number of catalogue answers."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries)}
+
+
+_answer_catalogue: Optional[AnswerCatalogue] = None
+
+
+def get_answer_catalogue() -> Optional[AnswerCatalogue]:
+    """Return the answer catalogue or None when it is switched off."""
+    global _answer_catalogue
+    if cfg.WARMUP_CATALOGUE and _answer_catalogue is None:
+        _answer_catalogue = AnswerCatalogue()
+    return _answer_catalogue
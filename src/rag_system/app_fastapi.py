@@ -3,15 +3,14 @@ import json
 
 import box
 from dotenv import load_dotenv, find_dotenv
-from fastapi import FastAPI, Request, Response, Form, HTTPException
+from fastapi import Depends, FastAPI, Request, Response, Form, HTTPException
 from fastapi.encoders import jsonable_encoder
 from fastapi.templating import Jinja2Templates
 import uvicorn
 import yaml
 
-from rag_system.rag_pipelines import select_rag_pipeline
-from rag_system.responds import get_respond_fastapi
-from rag_system.ingest import load_data_into_store
+from rag_system.responds import get_respond_fastapi_async
+from rag_system.server import RagState, get_rag_state, lifespan, router
 
 load_dotenv(find_dotenv())
 
@@ -19,7 +18,8 @@ with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.include_router(router)
 # Configure templates
 templates = Jinja2Templates(directory="templates")
 
@@ -31,16 +31,13 @@ async def index(request: Request):
 
 
 @app.post("/get_answer")
-async def get_answer(request: Request, question: str = Form(str)):
+async def get_answer(request: Request, question: str = Form(str),
+                     state: RagState = Depends(get_rag_state)):
     """Load output result of the inference of the rag algorithm."""
-    doc_store = load_data_into_store()
-
-    rag_pipeline = select_rag_pipeline(doc_store)
     if not question:
         raise HTTPException(status_code=404)
-    print(question)
-    answer, relevant_documents = get_respond_fastapi(str(question),
-                                                     rag_pipeline)
+    answer, relevant_documents = await get_respond_fastapi_async(
+        str(question), state.rag_pipeline)
     response_data = jsonable_encoder(json.dumps(
         {"answer": answer,
          "relevant_documents": relevant_documents
@@ -6,10 +6,13 @@ import yaml
 from haystack import Pipeline
 
 from rag_system.rag_pipelines import select_rag_pipeline
-from rag_system.responds import get_respond_streamlit
+from rag_system.faithfulness_cache import get_faithfulness_scorer
+from rag_system.streaming import stream_answer
 from rag_system.utils import create_gt_data
 from rag_system.utils import create_qui_question_data
 from rag_system.ingest import load_data_into_store
+from rag_system.micro_batcher import enable_micro_batching
+from rag_system.warmup import build_catalogue
 
 NUM_COLS = 2
 PARAMS = ["faithfulness: "]
@@ -22,8 +25,13 @@ with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
 @st.cache_resource
 def initialize_document_store_pipeline():
     """Initialize the document store and pipeline."""
+    # Sessions share the pipeline and the forward passes of its models
+    enable_micro_batching(cfg.MICRO_BATCH)
     doc_store = load_data_into_store()
     rag_pipeline = select_rag_pipeline(doc_store)
+    if cfg.WARMUP_CATALOGUE and cfg.WARMUP_ON_START:
+        # Catalogue questions are then answered without a pipeline run
+        build_catalogue(doc_store, rag_pipeline)
     return rag_pipeline, doc_store
 
 
@@ -35,6 +43,8 @@ def initialize() -> None:
         st.session_state[VALS_STR[1]] = ""
     if 'parm_text' not in st.session_state:
         st.session_state.parm_text = ""
+    if 'faithfulness' not in st.session_state:
+        st.session_state.faithfulness = None
 
 
 @st.cache_data
@@ -45,6 +55,34 @@ def get_question_data():
     return question_gui_data, ground_truth_data
 
 
+def stream_into(stream_box, query: str, rag_pipeline: Pipeline):
+    """Render the streamed answer progressively and return the result."""
+    partial, result = "", ("", [])
+    for event, data in stream_answer(query, rag_pipeline):
+        if event == 'token':
+            partial += data
+            stream_box.markdown(partial)
+        elif event == 'answer':
+            result = data["answer"], data["relevant_documents"]
+        elif event == 'error':
+            st.error(data)
+    stream_box.empty()
+    return result
+
+
+@st.fragment(run_every=cfg.FAITHFULNESS_POLL_SEC)
+def show_faithfulness() -> None:
+    """Show the faithfulness score once its background scoring is done."""
+    future = st.session_state.faithfulness
+    if future is not None and future.done():
+        try:
+            st.session_state.parm_text = f"{PARAMS[0]}: {future.result()}"
+        except Exception as e:
+            st.session_state.parm_text = f"{PARAMS[0]}: failed ({e})"
+        st.session_state.faithfulness = None
+    st.write(st.session_state.parm_text)
+
+
 def enter_wonder_question(rag_pipeline: Pipeline, doc_store) -> None:
     """Generate and evauate AI answer for a question."""
     st.title("AI App for the Seven Ancient Wonders:")
@@ -53,13 +91,15 @@ def enter_wonder_question(rag_pipeline: Pipeline, doc_store) -> None:
 
     left_column, right_column = st.columns(NUM_COLS)
     with right_column:
+        # Shows the answer token by token while it is generated
+        stream_box = st.empty()
         st.text_area("AI generated answer",
                      value=st.session_state[VALS_STR[0]],
                      height=200)
         st.text_area("Ground truth answer",
                      value=st.session_state[VALS_STR[1]],
                      height=200)
-        st.write(st.session_state.parm_text)
+        show_faithfulness()
 
     with left_column:
         query = st.selectbox(
@@ -70,11 +110,14 @@ def enter_wonder_question(rag_pipeline: Pipeline, doc_store) -> None:
         st.write("You selected:", query)
         if st.button("Ask AI"):
             # Update the two text areas and parameter value with content
-            rag_answer, param_value = get_respond_streamlit(query,
-                                                            rag_pipeline)
+            rag_answer, retrieved_docs = stream_into(stream_box, query,
+                                                     rag_pipeline)
+            # Score in the background, show_faithfulness fills it in
+            st.session_state.faithfulness = get_faithfulness_scorer()\
+                .submit(query, rag_answer, retrieved_docs)
             st.session_state[VALS_STR[0]] = rag_answer
             st.session_state[VALS_STR[1]] = ground_truth_data[query]
-            st.session_state.parm_text = f"{PARAMS[0]}: {param_value}"
+            st.session_state.parm_text = f"{PARAMS[0]}: scoring..."
             st.rerun()
         elif st.button("Exit"):
             del doc_store
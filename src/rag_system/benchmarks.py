@@ -0,0 +1,500 @@
+"""Benchmark performance critical parts of the rag system."""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+import tempfile
+import timeit
+from typing import List
+
+import box
+from datasets import load_dataset
+from haystack import Document
+from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
+from haystack.components.rankers import TransformersSimilarityRanker
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+import numpy as np
+import yaml
+
+from rag_system.ann_index import IVFIndex
+from rag_system.bm25_index import BM25Index, BM25IndexRetriever
+from rag_system.embedders import CachingTextEmbedder, setup_embedder
+from rag_system.embedding_pool import embed_documents_in_processes
+from rag_system.ingest import load_embedded_data_into_inmemory_store
+from rag_system.ingest import update_bm25_index
+from rag_system.matrix_retriever import MatrixEmbeddingRetriever
+from rag_system.micro_batcher import enable_micro_batching
+from rag_system.micro_batcher import micro_batching_stats
+from rag_system.rerankers import CachedRanker
+from rag_system.retrievers import setup_hybrid_retriever
+from rag_system.snapshot import attached_embeddings
+from rag_system.utils import create_question_data
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+
+def create_benchmark_documents(num_docs: int) -> List[Document]:
+    """Repeat the dataset documents until there are num_docs of them."""
+    dataset = load_dataset(cfg.DATA_SET, split="train")
+    contents = [row["content"] for row in dataset]
+    return [Document(content=contents[i % len(contents)])
+            for i in range(num_docs)]
+
+
+def benchmark_embedding_scaling(num_docs: int, max_workers: int) -> None:
+    """Measure process-pool embedding throughput for 1..max_workers."""
+    docs = create_benchmark_documents(num_docs)
+    threads = cfg.EMBED_THREADS_PER_WORKER
+    print(f"{'workers':>8} {'seconds':>10} {'docs/sec':>10} {'speedup':>8}")
+    base_elapsed = None
+    for num_workers in range(1, max_workers + 1):
+        batch = [Document(content=doc.content) for doc in docs]
+        start = timeit.default_timer()
+        embed_documents_in_processes(batch, cfg.EMBEDDINGS, num_workers,
+                                     threads, cfg.EMBED_SHARD_SIZE,
+                                     cfg.EMBED_BATCH_SIZE)
+        elapsed = timeit.default_timer() - start
+        base_elapsed = base_elapsed or elapsed
+        print(f"{num_workers:>8} {elapsed:>10.2f} "
+              f"{num_docs / elapsed:>10.1f} {base_elapsed / elapsed:>8.2f}")
+
+
+def create_random_embeddings(num_docs: int, dim: int,
+                             seed: int = 0) -> np.ndarray:
+    """Draw a matrix of random embeddings, one row per document."""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((num_docs, dim), dtype=np.float32)
+
+
+def create_clustered_embeddings(num_docs: int, dim: int,
+                                num_clusters: int = 1000,
+                                seed: int = 0) -> np.ndarray:
+    """Draw embeddings around random topics, closer to real corpora."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+    noise = rng.standard_normal((num_docs, dim), dtype=np.float32)
+    return topics[rng.integers(num_clusters, size=num_docs)] + 0.5 * noise
+
+
+def time_queries(retrieve, queries: np.ndarray) -> float:
+    """Return the mean latency in milliseconds of retrieve over queries."""
+    start = timeit.default_timer()
+    for query in queries:
+        retrieve(query.tolist())
+    return (timeit.default_timer() - start) / len(queries) * 1000
+
+
+def benchmark_dense_retrievers(sizes: List[int], dim: int, num_queries: int,
+                               baseline_max_docs: int) -> None:
+    """Compare the matrix retriever with InMemoryEmbeddingRetriever."""
+    queries = np.random.default_rng(1).standard_normal(
+        (num_queries, dim), dtype=np.float32)
+    print(f"{'docs':>9} {'retriever':>20} {'ms/query':>10}")
+    for num_docs in sizes:
+        embeddings = create_random_embeddings(num_docs, dim)
+        docs = [Document(id=str(i), content=f"doc {i}")
+                for i in range(num_docs)]
+        retrievers = {}
+        for dtype in ('float32', 'float16'):
+            retrievers[f"matrix {dtype}"] = MatrixEmbeddingRetriever(
+                None, dtype=dtype)
+            retrievers[f"matrix {dtype}"].set_embeddings(docs, embeddings)
+        if num_docs <= baseline_max_docs:
+            # The per-document store keeps every embedding as a python list
+            doc_store = InMemoryDocumentStore()
+            doc_store.write_documents(
+                [Document(id=str(i), content=f"doc {i}",
+                          embedding=embeddings[i].tolist())
+                 for i in range(num_docs)])
+            retrievers['inmemory'] = InMemoryEmbeddingRetriever(doc_store)
+        for name, retriever in retrievers.items():
+            latency = time_queries(
+                lambda query, r=retriever: r.run(query_embedding=query),
+                queries)
+            print(f"{num_docs:>9} {name:>20} {latency:>10.2f}")
+        batch = retrievers['matrix float32']
+        start = timeit.default_timer()
+        batch.run_batch(queries)
+        latency = (timeit.default_timer() - start) / num_queries * 1000
+        print(f"{num_docs:>9} {'matrix batch':>20} {latency:>10.2f}")
+
+
+def benchmark_ann_index(num_docs: int, dim: int, nlist: int,
+                        nprobes: List[int], top_k: int,
+                        num_queries: int) -> None:
+    """Report recall@k and latency of the IVF index against exact search."""
+    embeddings = create_clustered_embeddings(num_docs, dim)
+    docs = [Document(id=str(i), content=f"doc {i}") for i in range(num_docs)]
+    queries = embeddings[np.random.default_rng(1).choice(
+        num_docs, num_queries)] + 0.1 * create_random_embeddings(
+            num_queries, dim, seed=2)
+
+    exact = MatrixEmbeddingRetriever(None, top_k=top_k)
+    exact.set_embeddings(docs, embeddings)
+    start = timeit.default_timer()
+    truth = [set(rows.tolist()) for query in queries
+             for rows, _ in exact.search(query, top_k)]
+    exact_ms = (timeit.default_timer() - start) / num_queries * 1000
+
+    start = timeit.default_timer()
+    ann_index = IVFIndex.train(embeddings, nlist)
+    print(f"Trained {nlist} cells in {timeit.default_timer() - start:.2f}s")
+    approx = MatrixEmbeddingRetriever(None, top_k=top_k, ann_index=ann_index)
+    approx.set_embeddings(docs, embeddings)
+
+    print(f"{'search':>12} {f'recall@{top_k}':>10} {'ms/query':>10}")
+    print(f"{'exact':>12} {1.0:>10.3f} {exact_ms:>10.2f}")
+    for nprobe in nprobes:
+        ann_index.nprobe = nprobe
+        start = timeit.default_timer()
+        found = [set(rows.tolist()) for query in queries
+                 for rows, _ in approx.search(query, top_k)]
+        latency = (timeit.default_timer() - start) / num_queries * 1000
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        print(f"{f'nprobe={nprobe}':>12} {recall:>10.3f} {latency:>10.2f}")
+
+
+def benchmark_quantization(top_k: int) -> None:
+    """Report memory and recall@k of quantized retrieval on the questions."""
+    doc_store = load_embedded_data_into_inmemory_store()
+    embeddings = attached_embeddings(doc_store)
+    if embeddings is None:
+        docs = [doc for doc in doc_store.filter_documents()
+                if doc.embedding is not None]
+        embeddings = np.asarray([doc.embedding for doc in docs],
+                                dtype=np.float32)
+    else:
+        docs = doc_store.filter_documents()
+    text_embedder = setup_embedder(cfg.EMBEDDINGS)
+    text_embedder.warm_up()
+    queries = np.asarray([text_embedder.run(text=question)["embedding"]
+                          for question in create_question_data()],
+                         dtype=np.float32)
+
+    exact = MatrixEmbeddingRetriever(None, top_k=top_k)
+    exact.set_embeddings(docs, embeddings)
+    truth = [set(rows.tolist()) for rows, _ in exact.search(queries, top_k)]
+
+    print(f"{len(docs)} documents, {len(queries)} questions; retriever RAM "
+          f"only, rescore matrix memory-mapped, in-memory store")
+    print(f"{'embeddings':>16} {'RAM bytes':>12} {'saving':>7} "
+          f"{f'recall@{top_k}':>10} {'ms/query':>10}")
+    print(f"{'float32':>16} {exact.memory_bytes:>12} {1.0:>7.1f} "
+          f"{1.0:>10.3f} {'':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for method in ('int8', 'binary'):
+            for rescore_factor in (1, cfg.QUANT_RESCORE_FACTOR):
+                retriever = MatrixEmbeddingRetriever(
+                    None, top_k=top_k, quantization=method,
+                    rescore_factor=rescore_factor,
+                    rescore_path=os.path.join(tmp_dir, f"{method}.npy"))
+                retriever.set_embeddings(docs, embeddings)
+                start = timeit.default_timer()
+                found = [set(rows.tolist())
+                         for rows, _ in retriever.search(queries, top_k)]
+                latency = ((timeit.default_timer() - start)
+                           / len(queries) * 1000)
+                recall = np.mean([len(f & t) / len(t)
+                                  for f, t in zip(found, truth)])
+                saving = exact.memory_bytes / retriever.memory_bytes
+                name = f"{method} x{rescore_factor}"
+                print(f"{name:>16} {retriever.memory_bytes:>12} "
+                      f"{saving:>7.1f} {recall:>10.3f} {latency:>10.2f}")
+    print("The saving holds for a store attached from its snapshot, which "
+          "keeps no float embeddings; a freshly ingested store keeps them "
+          "as python lists as well, milvus keeps its own vectors.")
+
+
+def benchmark_sparse_retrievers(sizes: List[int], top_k: int) -> None:
+    """Compare the bm25 index with InMemoryBM25Retriever on the questions."""
+    questions = create_question_data()
+    print(f"{'docs':>9} {'retriever':>12} {'build s':>8} {'ms/query':>10} "
+          f"{f'overlap@{top_k}':>10}")
+    for num_docs in sizes:
+        docs = [Document(id=str(i), content=doc.content)
+                for i, doc in enumerate(create_benchmark_documents(num_docs))]
+        doc_store = InMemoryDocumentStore(bm25_algorithm="BM25Okapi")
+        start = timeit.default_timer()
+        doc_store.write_documents(docs)
+        store_build = timeit.default_timer() - start
+        start = timeit.default_timer()
+        bm25_index = BM25Index(cfg.BM25_K1, cfg.BM25_B)
+        bm25_index.add(docs)
+        bm25_index.compact()
+        index_build = timeit.default_timer() - start
+
+        retrievers = {
+            'inmemory': (InMemoryBM25Retriever(doc_store), store_build),
+            'index': (BM25IndexRetriever(bm25_index, doc_store), index_build)}
+        retrievers['index'][0].warm_up()
+        found = {}
+        for name, (retriever, build) in retrievers.items():
+            start = timeit.default_timer()
+            found[name] = [{doc.id for doc in retriever.run(
+                query=question, top_k=top_k)["documents"]}
+                for question in questions]
+            latency = ((timeit.default_timer() - start)
+                       / len(questions) * 1000)
+            overlap = np.mean([len(f & t) / max(len(t), 1) for f, t in
+                               zip(found[name], found['inmemory'])])
+            print(f"{num_docs:>9} {name:>12} {build:>8.2f} "
+                  f"{latency:>10.2f} {overlap:>10.3f}")
+
+        # Incremental update: re-index 1% of the corpus
+        changed = docs[:max(1, num_docs // 100)]
+        start = timeit.default_timer()
+        bm25_index.remove([doc.id for doc in changed])
+        bm25_index.add(changed)
+        print(f"{num_docs:>9} {'index +1%':>12} "
+              f"{timeit.default_timer() - start:>8.2f}")
+
+
+def benchmark_hybrid_variants(repeats: int, bm25_path: str) -> None:
+    """Compare latency and quality of the hybrid retrieval variants.
+
+    Quality is the overlap with a reference ranking: the cross-encoder
+    scoring every candidate of both branches.
+    """
+    doc_store = load_embedded_data_into_inmemory_store()
+    if cfg.SPARSE_RETRIEVER == 'index':
+        update_bm25_index(doc_store, bm25_path)
+    questions = create_question_data()
+    top_k = cfg.HYBRID_TOP_K
+    ranker = TransformersSimilarityRanker(model=cfg.RERANKER_MODEL,
+                                          top_k=top_k)
+    ranker.warm_up()
+
+    everything = setup_hybrid_retriever(doc_store, 'concatenate', True,
+                                        bm25_index_path=bm25_path)
+    everything.warm_up()
+    reference = [{doc.id for doc in ranker.run(
+        query=question, documents=everything.run(
+            query=question, top_k=2 * cfg.HYBRID_BRANCH_TOP_K)["documents"]
+    )["documents"]} for question in questions]
+
+    variants = {
+        # The former pipeline: branches in sequence, joined 5 reranked
+        'sequential+rerank': (setup_hybrid_retriever(
+            doc_store, 'concatenate', False, concurrent=False,
+            bm25_index_path=bm25_path), True),
+        f'{cfg.HYBRID_FUSION}+rerank': (setup_hybrid_retriever(
+            doc_store, cfg.HYBRID_FUSION, True,
+            bm25_index_path=bm25_path), True),
+        f'{cfg.HYBRID_FUSION} only': (setup_hybrid_retriever(
+            doc_store, cfg.HYBRID_FUSION, False,
+            bm25_index_path=bm25_path), False)}
+    print(f"{'variant':>36} {'ms/query':>10} {f'overlap@{top_k}':>10}")
+    for name, (retriever, rerank) in variants.items():
+        retriever.warm_up()
+        start = timeit.default_timer()
+        for _ in range(repeats):
+            found = []
+            for question in questions:
+                docs = retriever.run(query=question)["documents"]
+                if rerank:
+                    docs = ranker.run(query=question,
+                                      documents=docs)["documents"]
+                found.append({doc.id for doc in docs})
+        latency = ((timeit.default_timer() - start)
+                   / (repeats * len(questions)) * 1000)
+        overlap = np.mean([len(f & t) / max(len(t), 1)
+                           for f, t in zip(found, reference)])
+        print(f"{name:>36} {latency:>10.2f} {overlap:>10.3f}")
+
+
+def benchmark_reranker(repeats: int, bm25_path: str) -> None:
+    """Compare the plain and the caching/pruning cross-encoder reranker.
+
+    The questions are asked repeats times, like the repeated traffic of
+    the ui; the candidates come from the hybrid retriever.
+    """
+    doc_store = load_embedded_data_into_inmemory_store()
+    if cfg.SPARSE_RETRIEVER == 'index':
+        update_bm25_index(doc_store, bm25_path)
+    retriever = setup_hybrid_retriever(doc_store, rerank=True,
+                                       bm25_index_path=bm25_path)
+    retriever.warm_up()
+    questions = create_question_data()
+    candidates = [retriever.run(query=question)["documents"]
+                  for question in questions]
+    top_k = cfg.HYBRID_TOP_K
+
+    plain = TransformersSimilarityRanker(model=cfg.RERANKER_MODEL,
+                                         top_k=top_k)
+    plain.warm_up()
+    latencies = []
+    for _ in range(repeats):
+        for question, docs in zip(questions, candidates):
+            start = timeit.default_timer()
+            plain.run(query=question, documents=docs)
+            latencies.append(timeit.default_timer() - start)
+    latencies = np.asarray(latencies) * 1000
+    pairs = np.mean([len(docs) for docs in candidates])
+
+    cached = CachedRanker(cfg.RERANKER_MODEL, top_k=top_k,
+                          cache_size=cfg.RERANK_CACHE_SIZE,
+                          max_length=cfg.RERANK_MAX_LENGTH,
+                          batch_size=cfg.RERANK_BATCH_SIZE,
+                          max_candidates=cfg.HYBRID_RERANK_CANDIDATES,
+                          min_candidates=top_k,
+                          gap_factor=cfg.RERANK_PRUNE_GAP)
+    cached.warm_up()
+    for _ in range(repeats):
+        for question, docs in zip(questions, candidates):
+            cached.run(query=question, documents=docs)
+    stats = cached.stats()
+    requests = stats['requests']
+
+    print(f"{len(questions) * repeats} requests, {pairs:.1f} candidates")
+    print(f"{'reranker':>10} {'calls/req':>10} {'pairs/req':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'plain':>10} {1.0:>10.2f} {pairs:>10.2f} "
+          f"{np.percentile(latencies, 50):>8.2f} "
+          f"{np.percentile(latencies, 95):>8.2f}")
+    print(f"{'cached':>10} {stats['model_calls_per_request']:>10.2f} "
+          f"{stats['pairs_scored'] / requests:>10.2f} "
+          f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f}")
+    print(f"cache hits {stats['cache_hits']}, pruned {stats['pruned']}")
+
+
+def benchmark_micro_batching(concurrencies: List[int], requests: int,
+                             bm25_path: str) -> None:
+    """Load test query embedding and reranking with and w/o micro batching.
+
+    Every request embeds a distinct question and reranks the candidates
+    of the hybrid retriever, so that no cache answers it.
+    """
+    doc_store = load_embedded_data_into_inmemory_store()
+    if cfg.SPARSE_RETRIEVER == 'index':
+        update_bm25_index(doc_store, bm25_path)
+    retriever = setup_hybrid_retriever(doc_store, rerank=True,
+                                       bm25_index_path=bm25_path)
+    retriever.warm_up()
+    questions = create_question_data()
+    candidates = [retriever.run(query=question)["documents"]
+                  for question in questions]
+    embedder = CachingTextEmbedder(cfg.EMBEDDINGS)
+    embedder.warm_up()
+    ranker = CachedRanker(cfg.RERANKER_MODEL, top_k=cfg.HYBRID_TOP_K,
+                          max_length=cfg.RERANK_MAX_LENGTH,
+                          batch_size=cfg.RERANK_BATCH_SIZE,
+                          max_candidates=cfg.HYBRID_RERANK_CANDIDATES)
+    ranker.warm_up()
+
+    def handle(i: int) -> float:
+        start = timeit.default_timer()
+        question = f"{questions[i % len(questions)]} ({i})"
+        embedder.run(text=question)
+        ranker.run(query=question,
+                   documents=candidates[i % len(questions)])
+        return timeit.default_timer() - start
+
+    print(f"{'mode':>10} {'clients':>8} {'req/s':>8} {'p50 ms':>8} "
+          f"{'p99 ms':>8}")
+    offset = 0
+    for batching in (False, True):
+        enable_micro_batching(batching)
+        for concurrency in concurrencies:
+            start = timeit.default_timer()
+            with ThreadPoolExecutor(concurrency) as pool:
+                latencies = np.asarray(list(pool.map(
+                    handle, range(offset, offset + requests)))) * 1000
+            elapsed = timeit.default_timer() - start
+            offset += requests
+            mode = 'batched' if batching else 'single'
+            print(f"{mode:>10} {concurrency:>8} {requests / elapsed:>8.1f} "
+                  f"{np.percentile(latencies, 50):>8.1f} "
+                  f"{np.percentile(latencies, 99):>8.1f}")
+    print(micro_batching_stats())
+
+
+def main():
+    """Run the selected benchmark from the command line."""
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__)
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    scaling = benchmarks.add_parser(
+        'embedding-scaling',
+        help='process-pool embedding throughput over 1..N cores')
+    scaling.add_argument('--docs', type=int, default=2000)
+    scaling.add_argument('--max-workers', type=int,
+                         default=multiprocessing.cpu_count())
+
+    dense = benchmarks.add_parser(
+        'dense-retrieval',
+        help='matrix vs in-memory embedding retriever latency')
+    dense.add_argument('--sizes', type=int, nargs='+',
+                       default=[10_000, 100_000, 1_000_000])
+    dense.add_argument('--dim', type=int, default=384)
+    dense.add_argument('--queries', type=int, default=50)
+    dense.add_argument('--baseline-max-docs', type=int, default=100_000,
+                       help='skip the slow per-document retriever above')
+
+    ann = benchmarks.add_parser(
+        'ann-index', help='recall@k vs latency of the ivf index')
+    ann.add_argument('--docs', type=int, default=200_000)
+    ann.add_argument('--dim', type=int, default=384)
+    ann.add_argument('--nlist', type=int, default=cfg.ANN_NLIST)
+    ann.add_argument('--nprobes', type=int, nargs='+',
+                     default=[1, 2, 4, 8, 16, 32])
+    ann.add_argument('--top-k', type=int, default=10)
+    ann.add_argument('--queries', type=int, default=200)
+
+    quant = benchmarks.add_parser(
+        'quantization',
+        help='memory and recall of int8/binary codes on the questions')
+    quant.add_argument('--top-k', type=int, default=5)
+
+    sparse = benchmarks.add_parser(
+        'sparse-retrieval',
+        help='bm25 index vs in-memory bm25 retriever latency')
+    sparse.add_argument('--sizes', type=int, nargs='+',
+                        default=[10_000, 100_000])
+    sparse.add_argument('--top-k', type=int, default=10)
+
+    hybrid = benchmarks.add_parser(
+        'hybrid-retrieval',
+        help='latency and quality of the hybrid fusion/reranker variants')
+    hybrid.add_argument('--repeats', type=int, default=3)
+
+    rerank = benchmarks.add_parser(
+        'reranker', help='plain vs caching/pruning cross-encoder reranker')
+    rerank.add_argument('--repeats', type=int, default=5)
+
+    batching = benchmarks.add_parser(
+        'micro-batching',
+        help='load test of embedding/reranking with micro batching')
+    batching.add_argument('--concurrency', type=int, nargs='+',
+                          default=[1, 4, 16, 32])
+    batching.add_argument('--requests', type=int, default=256)
+
+    args = parser.parse_args()
+    # The hybrid benchmarks index the store apart from the production index
+    with tempfile.TemporaryDirectory() as bm25_path:
+        if args.benchmark == 'embedding-scaling':
+            benchmark_embedding_scaling(args.docs, args.max_workers)
+        elif args.benchmark == 'dense-retrieval':
+            benchmark_dense_retrievers(args.sizes, args.dim, args.queries,
+                                       args.baseline_max_docs)
+        elif args.benchmark == 'ann-index':
+            benchmark_ann_index(args.docs, args.dim, args.nlist, args.nprobes,
+                                args.top_k, args.queries)
+        elif args.benchmark == 'quantization':
+            benchmark_quantization(args.top_k)
+        elif args.benchmark == 'sparse-retrieval':
+            benchmark_sparse_retrievers(args.sizes, args.top_k)
+        elif args.benchmark == 'hybrid-retrieval':
+            benchmark_hybrid_variants(args.repeats, bm25_path)
+        elif args.benchmark == 'reranker':
+            benchmark_reranker(args.repeats, bm25_path)
+        elif args.benchmark == 'micro-batching':
+            benchmark_micro_batching(args.concurrency, args.requests,
+                                     bm25_path)
+
+
+if __name__ == "__main__":
+    main()
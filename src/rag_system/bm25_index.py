@@ -0,0 +1,272 @@
+"""Contain a persistent, incrementally updatable bm25 inverted index."""
+from collections import Counter
+from dataclasses import replace
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from haystack import component, Document
+import numpy as np
+
+from rag_system.matrix_retriever import top_k_indices
+
+# Same tokenization as the bm25 retrieval of the in-memory document store
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+ARRAYS_FILE = 'bm25.npz'
+META_FILE = 'bm25.json'
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a text into lowercase bm25 terms."""
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+class BM25Index:
+    """Score documents with bm25 (Okapi) over compact posting lists.
+
+    Postings are stored CSR-like: the postings of term t are
+    rows[offsets[t]:offsets[t + 1]] with term frequencies tfs. Documents
+    added later go to small per-term delta lists, removed documents are
+    masked out; compact() merges both into the arrays, save() compacts
+    first. The total length of the live documents and their document
+    frequencies are kept up to date on add() and remove().
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.int32)
+        self.delta: Dict[int, List[Tuple[int, int]]] = {}
+        self.doc_ids: List[str] = []
+        self.doc_hashes: List[str] = []
+        self.doc_len = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.df = np.empty(0, dtype=np.int32)
+        self.total_len = 0
+        self._row_of: Dict[str, int] = {}
+        self._idf: Optional[np.ndarray] = None
+        # Term ids of every row, built on the first remove()
+        self._doc_terms: Optional[List[np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._row_of
+
+    def content_hash(self, doc_id: str) -> str:
+        """Return the content hash the document was indexed with."""
+        return self.doc_hashes[self._row_of[doc_id]]
+
+    def add(self, docs: List[Document]) -> None:
+        """Index new documents without touching the existing postings."""
+        first_row = len(self.doc_ids)
+        lengths, new_terms = [], []
+        for row, doc in enumerate(docs, start=first_row):
+            counts = Counter(tokenize(doc.content))
+            for term, tf in counts.items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                self.delta.setdefault(term_id, []).append((row, tf))
+                new_terms.append(term_id)
+            self.doc_ids.append(doc.id)
+            self.doc_hashes.append(doc.meta.get("content_hash", ""))
+            self._row_of[doc.id] = row
+            lengths.append(sum(counts.values()))
+            if self._doc_terms is not None:
+                self._doc_terms.append(np.asarray(
+                    [self.vocab[term] for term in counts], dtype=np.int64))
+        self.doc_len = np.concatenate(
+            [self.doc_len, np.asarray(lengths, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(docs), bool)])
+        self.total_len += sum(lengths)
+        self.df = np.pad(self.df, (0, len(self.vocab) - len(self.df)))
+        np.add.at(self.df, np.asarray(new_terms, dtype=np.int64), 1)
+        self._idf = None
+
+    def remove(self, doc_ids: List[str]) -> None:
+        """Mask documents out; their postings are dropped on compact()."""
+        if not doc_ids:
+            return
+        doc_terms = self._forward_index()
+        for doc_id in doc_ids:
+            row = self._row_of.pop(doc_id, None)
+            if row is not None:
+                self.alive[row] = False
+                self.total_len -= int(self.doc_len[row])
+                np.subtract.at(self.df, doc_terms[row], 1)
+        self._idf = None
+
+    def _forward_index(self) -> List[np.ndarray]:
+        """Return the term ids of every row, grouping the postings once."""
+        if self._doc_terms is None:
+            terms, rows, _ = self._all_postings()
+            order = np.argsort(rows, kind='stable')
+            bounds = np.cumsum(np.bincount(rows,
+                                           minlength=len(self.doc_ids)))
+            self._doc_terms = np.split(terms[order].astype(np.int64),
+                                       bounds[:-1])
+        return self._doc_terms
+
+    def _update_df(self) -> None:
+        """Recount the document frequencies of the live documents."""
+        terms, rows, _ = self._all_postings()
+        live = self.alive[rows]
+        self.df = np.bincount(terms[live], minlength=len(self.vocab))\
+            .astype(np.int32)
+        self._idf = None
+
+    def _all_postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return term ids, rows and tfs of all (base and delta) postings."""
+        terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32),
+                          np.diff(self.offsets))
+        delta = [(term, row, tf) for term, postings in self.delta.items()
+                 for row, tf in postings]
+        if not delta:
+            return terms, self.rows, self.tfs
+        delta = np.asarray(delta, dtype=np.int64).T
+        return (np.concatenate([terms, delta[0].astype(np.int32)]),
+                np.concatenate([self.rows, delta[1].astype(np.int32)]),
+                np.concatenate([self.tfs, delta[2].astype(np.int32)]))
+
+    def compact(self) -> None:
+        """Merge the delta postings and drop removed documents."""
+        terms, rows, tfs = self._all_postings()
+        keep = self.alive[rows]
+        new_row = np.cumsum(self.alive) - 1
+        terms, rows, tfs = terms[keep], new_row[rows[keep]], tfs[keep]
+        order = np.lexsort((rows, terms))
+        self.rows = rows[order].astype(np.int32)
+        self.tfs = tfs[order]
+        counts = np.bincount(terms, minlength=len(self.vocab))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.delta = {}
+
+        live = np.flatnonzero(self.alive)
+        self.doc_ids = [self.doc_ids[row] for row in live]
+        self.doc_hashes = [self.doc_hashes[row] for row in live]
+        self.doc_len = self.doc_len[live]
+        self.alive = np.ones(len(live), dtype=bool)
+        if self._doc_terms is not None:
+            self._doc_terms = [self._doc_terms[row] for row in live]
+        self._row_of = {doc_id: row
+                        for row, doc_id in enumerate(self.doc_ids)}
+
+    def idf(self) -> np.ndarray:
+        """Return the (cached) inverse document frequency of every term."""
+        if self._idf is None:
+            num_docs = len(self)
+            self._idf = np.log(1 + (num_docs - self.df + 0.5)
+                               / (self.df + 0.5))
+        return self._idf
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows and tfs of one term, base and delta postings."""
+        rows = tfs = np.empty(0, dtype=np.int32)
+        if term_id + 1 < len(self.offsets):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+        if term_id in self.delta:
+            delta = np.asarray(self.delta[term_id], dtype=np.int32)
+            rows = np.concatenate([rows, delta[:, 0]])
+            tfs = np.concatenate([tfs, delta[:, 1]])
+        return rows, tfs
+
+    def search(self, query: str, top_k: int)\
+            -> Tuple[List[str], np.ndarray]:
+        """Return ids and scores of the top_k documents of the query."""
+        term_ids = [self.vocab[term] for term in set(tokenize(query))
+                    if term in self.vocab]
+        if not term_ids or not len(self):
+            return [], np.empty(0)
+        avg_len = self.total_len / len(self)
+        idf = self.idf()
+        all_rows, all_scores = [], []
+        for term_id in term_ids:
+            rows, tfs = self._postings(term_id)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows]
+                              / avg_len)
+            all_rows.append(rows)
+            all_scores.append(idf[term_id] * tfs * (self.k1 + 1)
+                              / (tfs + norm))
+        rows, inverse = np.unique(np.concatenate(all_rows),
+                                  return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        live = self.alive[rows]
+        rows, scores = rows[live], scores[live]
+        indices, top_scores = top_k_indices(scores[None], top_k)
+        return [self.doc_ids[row] for row in rows[indices[0]]], top_scores[0]
+
+    def save(self, path: str) -> None:
+        """Compact the index and write it as numpy arrays plus json."""
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, ARRAYS_FILE + '.tmp.npz'),
+                 offsets=self.offsets, rows=self.rows, tfs=self.tfs,
+                 doc_len=self.doc_len)
+        with open(os.path.join(path, META_FILE + '.tmp'), 'w',
+                  encoding='utf8') as meta_file:
+            json.dump({'k1': self.k1, 'b': self.b,
+                       'vocab': sorted(self.vocab, key=self.vocab.get),
+                       'doc_ids': self.doc_ids,
+                       'doc_hashes': self.doc_hashes}, meta_file)
+        os.replace(os.path.join(path, ARRAYS_FILE + '.tmp.npz'),
+                   os.path.join(path, ARRAYS_FILE))
+        os.replace(os.path.join(path, META_FILE + '.tmp'),
+                   os.path.join(path, META_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> Optional['BM25Index']:
+        """Load the index saved at path or return None if there is none."""
+        try:
+            with open(os.path.join(path, META_FILE), 'r',
+                      encoding='utf8') as meta_file:
+                meta = json.load(meta_file)
+            arrays = np.load(os.path.join(path, ARRAYS_FILE))
+        except (OSError, ValueError):
+            return None
+        index = cls(meta['k1'], meta['b'])
+        index.vocab = {term: i for i, term in enumerate(meta['vocab'])}
+        index.doc_ids = meta['doc_ids']
+        index.doc_hashes = meta['doc_hashes']
+        with arrays:
+            index.offsets = arrays['offsets']
+            index.rows = arrays['rows']
+            index.tfs = arrays['tfs']
+            index.doc_len = arrays['doc_len']
+        index.alive = np.ones(len(index.doc_ids), dtype=bool)
+        index.total_len = int(index.doc_len.sum())
+        index._row_of = {doc_id: row
+                         for row, doc_id in enumerate(index.doc_ids)}
+        index._update_df()
+        return index
+
+
+@component
+class BM25IndexRetriever:
+    """Retrieve documents of a document store through a BM25Index."""
+
+    def __init__(self, index: BM25Index, document_store, top_k: int = 10):
+        self.index = index
+        self.document_store = document_store
+        self.top_k = top_k
+        self.documents: Optional[Dict[str, Document]] = None
+
+    def warm_up(self) -> None:
+        """Map the ids of the index to the documents of the store."""
+        if self.documents is None:
+            self.documents = {
+                doc.id: doc for doc in self.document_store.filter_documents()}
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None):
+        """Retrieve the top_k documents with the highest bm25 score."""
+        self.warm_up()
+        doc_ids, scores = self.index.search(query, top_k or self.top_k)
+        return {"documents": [replace(self.documents[doc_id],
+                                      score=float(score), embedding=None)
+                              for doc_id, score in zip(doc_ids, scores)
+                              if doc_id in self.documents]}
@@ -0,0 +1,47 @@
+"""Build or check the in-memory document store snapshot offline."""
+import argparse
+import logging
+import sys
+
+import box
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+import yaml
+
+from rag_system.ingest import convert_documents_into_embeddings
+from rag_system.ingest import extract_documents, write_documents
+from rag_system.snapshot import save_snapshot, snapshot_staleness
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+
+def main():
+    """Build the snapshot, or with --check only report whether it is stale."""
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', default=cfg.SNAPSHOT_PATH)
+    parser.add_argument('--text-only', action='store_true',
+                        default=cfg.TYPE_RETRIEVAL == 'sparse',
+                        help='store documents without embeddings (bm25)')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with 1 if the snapshot is stale')
+    args = parser.parse_args()
+    with_embeddings = not args.text_only
+
+    if args.check:
+        docs, _, _ = extract_documents()
+        reason = snapshot_staleness(args.path, with_embeddings, docs)
+        print(f"Snapshot at {args.path} is "
+              f"{'stale: ' + reason if reason else 'fresh'}")
+        sys.exit(1 if reason else 0)
+
+    if with_embeddings:
+        docs, _, num_workers = convert_documents_into_embeddings()
+    else:
+        docs, _, num_workers = extract_documents()
+    doc_store = write_documents(InMemoryDocumentStore(), docs, num_workers)
+    save_snapshot(doc_store, args.path, with_embeddings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Write documents into a document store in parallel, retried batches."""
+import concurrent.futures
+import logging
+import random
+import time
+import timeit
+from typing import List
+
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from pymilvus.exceptions import MilvusException
+
+logger = logging.getLogger('__main__')
+
+# Errors after which writing the same batch again may succeed
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, MilvusException)
+
+DEFAULT_MILVUS_INDEX = {"metric_type": "L2", "index_type": "AUTOINDEX",
+                        "params": {}}
+
+
+class DocumentWriteError(RuntimeError):
+    """Raised when batches could not be written into the document store."""
+
+
+def write_with_retry(doc_store, batch: List[Document], max_retries: int = 3,
+                     backoff: float = 0.5) -> int:
+    """Write one batch, retrying transient errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return doc_store.write_documents(batch)
+        except TRANSIENT_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2**attempt * (1 + random.random())
+            logger.warning(f"Writing batch failed ({e}), retry "
+                           f"{attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+    return 0
+
+
+def _drop_milvus_index(doc_store) -> bool:
+    """Release the milvus collection and drop its vector index."""
+    collection = getattr(doc_store, 'col', None)
+    if collection is None or not collection.has_index():
+        logger.info("Document store has no index to defer, writing as is")
+        return False
+    collection.release()
+    collection.drop_index()
+    return True
+
+
+def _build_milvus_index(doc_store) -> None:
+    """Build the vector index of the milvus collection and load it."""
+    start = timeit.default_timer()
+    collection = doc_store.col
+    collection.create_index(
+        getattr(doc_store, '_vector_field', 'vector'),
+        getattr(doc_store, 'index_params', None) or DEFAULT_MILVUS_INDEX)
+    collection.load()
+    logger.info(f"Built the deferred index in "
+                f"{timeit.default_timer() - start:.2f}s")
+
+
+def write_documents_batched(doc_store, docs: List[Document],
+                            batch_size: int = 256, concurrency: int = 4,
+                            max_retries: int = 3, backoff: float = 0.5,
+                            defer_index: bool = False) -> int:
+    """Write documents in batches over a thread pool and report docs/sec.
+
+    The in-memory store updates its bm25 statistics on every write and is
+    not thread-safe, so it is always written by a single thread. With
+    defer_index the milvus vector index is dropped during the bulk load
+    and built once at the end.
+    """
+    if not docs:
+        return 0
+    if isinstance(doc_store, InMemoryDocumentStore):
+        concurrency = 1
+    start = timeit.default_timer()
+    index_dropped = defer_index and _drop_milvus_index(doc_store)
+
+    batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)]
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) \
+            as executor:
+        futures = [executor.submit(write_with_retry, doc_store, batch,
+                                   max_retries, backoff)
+                   for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error writing batch to document store: {e}")
+                errors.append(e)
+
+    if index_dropped:
+        _build_milvus_index(doc_store)
+    if errors:
+        raise DocumentWriteError(
+            f"{len(errors)} of {len(batches)} batches could not be "
+            f"written") from errors[0]
+
+    elapsed = timeit.default_timer() - start
+    logger.info(f"Wrote {len(docs)} documents in {len(batches)} batches "
+                f"with {concurrency} threads in {elapsed:.2f}s "
+                f"({len(docs) / elapsed:.1f} docs/sec)")
+    return len(docs)
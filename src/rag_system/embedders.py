@@ -1,7 +1,146 @@
 """Contain wrappers of embedder components of tne rag pipeline."""
+from collections import OrderedDict
+import threading
+from typing import Dict, List, Optional
+
+import box
+from haystack import component
 from haystack.components.embedders import SentenceTransformersTextEmbedder
+import yaml
+
+from rag_system.embedding_cache import normalize_content
+from rag_system.micro_batcher import get_micro_batcher
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+_query_caches: Dict[str, 'QueryEmbeddingCache'] = {}
+
+
+class QueryEmbeddingCache:
+    """Keep the most recently used query embeddings of one model."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding of a normalized text or None."""
+        with self.lock:
+            embedding = self.entries.get(text)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(text)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: List[float]) -> None:
+        """Store an embedding, evicting the least recently used ones."""
+        with self.lock:
+            self.entries[text] = embedding
+            self.entries.move_to_end(text)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hits, misses, hit rate and the number of entries."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self.entries),
+                    'max_entries': self.max_entries}
+
+
+def get_query_embedding_cache(model_name: str) -> QueryEmbeddingCache:
+    """Return the query embedding cache shared by all embedders of a model."""
+    if model_name not in _query_caches:
+        _query_caches[model_name] = QueryEmbeddingCache(
+            cfg.QUERY_EMBED_CACHE_SIZE)
+    return _query_caches[model_name]
+
+
+def query_embedding_stats() -> Dict[str, Dict[str, float]]:
+    """Return the cache statistics of every query embedding model."""
+    return {model: cache.stats() for model, cache in _query_caches.items()}
+
+
+@component
+class CachingTextEmbedder:
+    """Embed a query string, reusing the embeddings of recent queries.
+
+    Drop-in replacement of SentenceTransformersTextEmbedder; the cache is
+    keyed by the model and the whitespace-normalized text and shared by
+    all embedders of the model, e.g. of several pipelines. With micro
+    batching on, cache misses of concurrent requests share forward passes.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.embedder = SentenceTransformersTextEmbedder(model=model)
+        self.cache = get_query_embedding_cache(model)
+
+    def warm_up(self) -> None:
+        """Load the embedding model."""
+        self.embedder.warm_up()
+
+    @component.output_types(embedding=List[float])
+    def run(self, text: str):
+        """Return the cached or freshly computed embedding of the text."""
+        text = normalize_content(text)
+        embedding = self.cache.get(text)
+        if embedding is None:
+            batcher = get_micro_batcher(f"embed:{self.model}",
+                                        self._embed_batch)
+            if batcher is None:
+                embedding = self.embedder.run(text=text)["embedding"]
+            else:
+                embedding = batcher.submit(text)
+            self.cache.put(text, embedding)
+        return {"embedding": embedding}
+
+    def run_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed many texts, the uncached ones in one forward pass."""
+        texts = [normalize_content(text) for text in texts]
+        embeddings = [self.cache.get(text) for text in texts]
+        missing = sorted({text for text, embedding in zip(texts, embeddings)
+                          if embedding is None})
+        if missing:
+            computed = dict(zip(missing, self._embed_batch(missing)))
+            for text, embedding in computed.items():
+                self.cache.put(text, embedding)
+            embeddings = [embedding if embedding is not None
+                          else computed[text]
+                          for text, embedding in zip(texts, embeddings)]
+        return embeddings
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed the queries of concurrent requests in one forward pass."""
+        embedder = self.embedder
+        return embedder.embedding_backend.embed(
+            [embedder.prefix + text + embedder.suffix for text in texts],
+            batch_size=len(texts),
+            normalize_embeddings=embedder.normalize_embeddings)
+
+
+def embed_texts(text_embedder, texts: List[str]) -> List[List[float]]:
+    """Embed many texts with a batch-capable or a plain text embedder."""
+    if hasattr(text_embedder, 'run_batch'):
+        return text_embedder.run_batch(texts)
+    return [text_embedder.run(text=text)["embedding"] for text in texts]
+
 
+def setup_embedder(model_name: str)\
+        -> SentenceTransformersTextEmbedder | CachingTextEmbedder:
+    """Transform a string into a vector.
 
-def setup_embedder(model_name: str) -> SentenceTransformersTextEmbedder:
-    """Transform a string into a vector."""
+    The semantic cache embeds the query before the pipeline run does, so
+    it always gets the caching embedder to embed each query only once.
+    """
+    if cfg.QUERY_EMBED_CACHE or cfg.SEMANTIC_CACHE:
+        return CachingTextEmbedder(model=model_name)
     return SentenceTransformersTextEmbedder(model=model_name)
@@ -0,0 +1,170 @@
+"""Cache document embeddings on disk keyed by model, revision and content."""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('__main__')
+
+INDEX_FILE = 'index.json'
+
+
+def normalize_content(content: str) -> str:
+    """Collapse whitespace so that formatting-only changes hit the cache."""
+    return " ".join((content or "").split())
+
+
+def embedding_key(model: str, revision: str, content: str) -> str:
+    """Build the content-addressed key of a single embedding."""
+    digest = hashlib.sha256()
+    for part in (model, revision, normalize_content(content)):
+        digest.update(part.encode('utf8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Keep embeddings in a memory-mapped float32 matrix and a json index.
+
+    Every (model, revision) pair gets its own directory, so all rows of its
+    matrix share one dimension. The index maps a content key to its row and
+    last access time; flush() rewrites the matrix with the most recently
+    used rows that fit into max_bytes.
+    """
+
+    def __init__(self, path: str, model: str, revision: str = 'main',
+                 max_bytes: int = 512 * 2**20):
+        self.model = model
+        self.revision = revision
+        self.max_bytes = max_bytes
+        model_id = hashlib.sha256(f"{model}@{revision}".encode('utf8'))
+        self.path = os.path.join(path, model_id.hexdigest()[:16])
+        self.hits = 0
+        self.misses = 0
+        self._rows: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        self._new: Dict[str, np.ndarray] = {}
+        self._vectors = None
+        self._vectors_file = None
+        self._touched = False
+        self._load()
+
+    def _load(self) -> None:
+        """Attach to the matrix and index written by a previous flush."""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path, 'r', encoding='utf8') as index_file:
+                index = json.load(index_file)
+            self._vectors_file = index['vectors_file']
+            self._vectors = np.load(os.path.join(self.path,
+                                                 self._vectors_file),
+                                    mmap_mode='r')
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable embedding cache: {e}")
+            self._vectors_file = None
+            return
+        for key, (row, last_used) in index['entries'].items():
+            self._rows[key] = row
+            self._last_used[key] = last_used
+
+    def __len__(self) -> int:
+        return len(self._rows.keys() | self._new.keys())
+
+    def get(self, content: str) -> Optional[List[float]]:
+        """Return the cached embedding of the content or None."""
+        key = embedding_key(self.model, self.revision, content)
+        if key in self._new:
+            vector = self._new[key]
+        elif key in self._rows:
+            vector = self._vectors[self._rows[key]]
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._last_used[key] = time.time()
+        self._touched = True
+        return vector.tolist()
+
+    def put(self, content: str, embedding: List[float]) -> None:
+        """Add a freshly computed embedding; it is persisted on flush()."""
+        key = embedding_key(self.model, self.revision, content)
+        self._new[key] = np.asarray(embedding, dtype=np.float32)
+        self._last_used[key] = time.time()
+        self._touched = True
+
+    def flush(self) -> None:
+        """Write the most recently used entries that fit into max_bytes.
+
+        Cache hits only rewrite the index with their access times. A new
+        matrix is written next to the old one before the index switches
+        over with os.replace(); the matrix before the old one is deleted,
+        the old one stays for processes that still have it mapped.
+        """
+        if not self._new and not self._touched:
+            return
+        if not self._new:
+            self._write_index(self._vectors_file, self._rows,
+                              self._vectors.shape[1])
+            self._touched = False
+            return
+        keys = sorted(self._rows.keys() | self._new.keys(),
+                      key=lambda k: self._last_used[k], reverse=True)
+        dim = next(iter(self._new.values())).shape[0]
+        max_rows = max(1, self.max_bytes // (dim * 4))
+        evicted = max(0, len(keys) - max_rows)
+        keys = keys[:max_rows]
+        vectors = np.empty((len(keys), dim), dtype=np.float32)
+        for row, key in enumerate(keys):
+            vectors[row] = (self._new[key] if key in self._new
+                            else self._vectors[self._rows[key]])
+
+        # Write the new matrix first, then switch the index over to it
+        os.makedirs(self.path, exist_ok=True)
+        vectors_file = f"vectors-{time.time_ns()}.npy"
+        vectors_path = os.path.join(self.path, vectors_file)
+        with open(vectors_path + '.tmp', 'wb') as npy_file:
+            np.save(npy_file, vectors)
+        os.replace(vectors_path + '.tmp', vectors_path)
+        rows = {key: row for row, key in enumerate(keys)}
+        self._write_index(vectors_file, rows, dim)
+        self._remove_stale_vectors(keep=(self._vectors_file, vectors_file))
+
+        self._vectors_file = vectors_file
+        self._vectors = np.load(vectors_path, mmap_mode='r')
+        self._rows = rows
+        self._last_used = {key: self._last_used[key] for key in keys}
+        self._new = {}
+        self._touched = False
+        if evicted:
+            logger.info(f"Evicted {evicted} entries from the embedding cache")
+
+    def _write_index(self, vectors_file: str, rows: Dict[str, int],
+                     dim: int) -> None:
+        """Atomically replace the index with the rows of vectors_file."""
+        index = {'model': self.model,
+                 'revision': self.revision,
+                 'dim': dim,
+                 'vectors_file': vectors_file,
+                 'entries': {key: [row, self._last_used[key]]
+                             for key, row in rows.items()}}
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w', encoding='utf8') as index_file:
+            json.dump(index, index_file)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _remove_stale_vectors(self, keep: Tuple[Optional[str], str]) \
+            -> None:
+        """Delete the matrices neither the old nor the new index names."""
+        for name in os.listdir(self.path):
+            if name.startswith('vectors-') and name.endswith('.npy') \
+                    and name not in keep:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError as e:
+                    logger.warning(f"Could not remove {name}: {e}")
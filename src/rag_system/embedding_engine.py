@@ -0,0 +1,112 @@
+"""Embed documents with one warmed-up model in length-sorted batches."""
+import logging
+import os
+import timeit
+from typing import Dict, Iterator, List
+
+from haystack import Document
+from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+from haystack.utils import ComponentDevice
+import torch
+
+logger = logging.getLogger('__main__')
+
+_engines: Dict[str, 'EmbeddingEngine'] = {}
+
+
+def available_memory() -> int:
+    """Return the available memory in bytes on the embedding device.
+
+    On linux this is MemAvailable, which unlike the free pages includes
+    the reclaimable page cache.
+    """
+    if torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf8') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+class EmbeddingEngine:
+    """Own a single SentenceTransformers model and embed documents with it.
+
+    Documents are embedded in order of their length so that every batch pads
+    to similar lengths. The batch size starts at batch_size and is doubled
+    while the throughput (characters/sec) improves and enough memory is free;
+    once it drops the engine settles on the best batch size seen so far.
+    """
+
+    def __init__(self, model: str, device: ComponentDevice,
+                 batch_size: int = 16, max_batch_size: int = 256,
+                 min_free_bytes: int = 2**30):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
+        self.min_free_bytes = min_free_bytes
+        self.docs_per_sec = 0.0
+        self.embedder = SentenceTransformersDocumentEmbedder(
+            model=model, device=device, batch_size=batch_size,
+            progress_bar=False)
+        self.embedder.warm_up()
+
+    def _next_batch_size(self, batch_size: int, throughput: float,
+                         best: Dict[str, float]) -> int:
+        """Pick the size of the next batch from the measured throughput."""
+        if available_memory() < self.min_free_bytes:
+            return max(1, batch_size // 2)
+        if throughput > best['throughput'] * 1.05:
+            best['throughput'], best['batch_size'] = throughput, batch_size
+            if not best['settled']:
+                return min(batch_size * 2, self.max_batch_size)
+            return batch_size
+        best['settled'] = True
+        return int(best['batch_size'])
+
+    def embed(self, docs: List[Document]) -> Iterator[Document]:
+        """Yield the embedded documents in their original order."""
+        order = sorted(range(len(docs)),
+                       key=lambda i: len(docs[i].content or ""))
+        finished: Dict[int, Document] = {}
+        next_out, pos = 0, 0
+        batch_size = self.batch_size
+        best = {'throughput': 0.0, 'batch_size': batch_size, 'settled': False}
+        start = timeit.default_timer()
+        while pos < len(order):
+            batch_ids = order[pos:pos + batch_size]
+            batch = [docs[i] for i in batch_ids]
+            batch_start = timeit.default_timer()
+            self.embedder.batch_size = len(batch)
+            embedded = self.embedder.run(documents=batch)["documents"]
+            elapsed = timeit.default_timer() - batch_start
+            pos += len(batch_ids)
+
+            finished.update(zip(batch_ids, embedded))
+            while next_out in finished:
+                yield finished.pop(next_out)
+                next_out += 1
+
+            num_chars = sum(len(doc.content or "") for doc in batch)
+            batch_size = self._next_batch_size(
+                batch_size, num_chars / max(elapsed, 1e-9), best)
+
+        elapsed = timeit.default_timer() - start
+        if docs:
+            self.docs_per_sec = len(docs) / max(elapsed, 1e-9)
+            logger.info(f"Embedded {len(docs)} documents in {elapsed:.2f}s "
+                        f"({self.docs_per_sec:.1f} docs/sec, "
+                        f"batch size {int(best['batch_size'])})")
+
+
+def get_embedding_engine(model: str, device: ComponentDevice,
+                         **kwargs) -> EmbeddingEngine:
+    """Return the engine of the model, loading the model only once."""
+    key = f"{model}@{device.to_torch_str()}"
+    if key not in _engines:
+        _engines[key] = EmbeddingEngine(model, device, **kwargs)
+    return _engines[key]
@@ -0,0 +1,88 @@
+"""Embed large corpora with a pool of worker processes, one model each."""
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import timeit
+from typing import List, Tuple
+
+from haystack import Document
+import numpy as np
+import torch
+
+logger = logging.getLogger('__main__')
+
+# Model of the current worker process, loaded once by _init_worker
+_model = None
+
+
+def _init_worker(model: str, num_threads: int) -> None:
+    """Load the model in a worker and pin its torch thread count."""
+    global _model
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(num_threads)
+    _model = SentenceTransformer(model, device='cpu')
+
+
+def _embedding_dim() -> int:
+    """Return the dimension of the embeddings of the worker's model."""
+    return _model.get_sentence_embedding_dimension()
+
+
+def _embed_shard(task: Tuple[str, int, int, List[int], List[str], int])\
+        -> int:
+    """Embed one shard and write its rows into the shared matrix."""
+    shm_name, num_docs, dim, indices, texts, batch_size = task
+    vectors = _model.encode(texts, batch_size=batch_size,
+                            convert_to_numpy=True, show_progress_bar=False)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    matrix = np.ndarray((num_docs, dim), dtype=np.float32, buffer=shm.buf)
+    matrix[indices] = vectors
+    # Release the view before closing, the buffer must not be exported
+    del matrix
+    shm.close()
+    return len(indices)
+
+
+def embed_documents_in_processes(docs: List[Document], model: str,
+                                 num_workers: int, threads_per_worker: int,
+                                 shard_size: int = 256,
+                                 batch_size: int = 32) -> List[Document]:
+    """Embed documents with num_workers processes sharing one result matrix.
+
+    Documents are sorted by length and cut into shards which the workers
+    take from the pool's task queue. Every worker writes its embeddings
+    straight into a shared memory matrix, so only row indices and texts
+    are pickled.
+    """
+    if not docs:
+        return docs
+    start = timeit.default_timer()
+    order = sorted(range(len(docs)), key=lambda i: len(docs[i].content or ""))
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(num_workers, initializer=_init_worker,
+                  initargs=(model, threads_per_worker)) as pool:
+        dim = pool.apply(_embedding_dim)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=len(docs) * dim * 4)
+        try:
+            shards = [order[i:i + shard_size]
+                      for i in range(0, len(order), shard_size)]
+            tasks = [(shm.name, len(docs), dim, shard,
+                      [docs[j].content or "" for j in shard], batch_size)
+                     for shard in shards]
+            for _ in pool.imap_unordered(_embed_shard, tasks):
+                pass
+            matrix = np.ndarray((len(docs), dim), dtype=np.float32,
+                                buffer=shm.buf)
+            for doc, vector in zip(docs, matrix):
+                doc.embedding = vector.tolist()
+            del matrix
+        finally:
+            shm.close()
+            shm.unlink()
+
+    elapsed = timeit.default_timer() - start
+    logger.info(f"Embedded {len(docs)} documents with {num_workers} "
+                f"processes x {threads_per_worker} threads in "
+                f"{elapsed:.2f}s ({len(docs) / elapsed:.1f} docs/sec)")
+    return docs
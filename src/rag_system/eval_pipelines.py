@@ -1,7 +1,13 @@
 """Contain evaluation haystack pipelines of the rag algorithm."""
+import threading
+from typing import Optional
+
 from haystack import Pipeline
 from haystack.components.evaluators.faithfulness import FaithfulnessEvaluator
 
+_eval_pipeline: Optional[Pipeline] = None
+_eval_pipeline_lock = threading.Lock()
+
 
 def evaluate_gt_pipeline() -> Pipeline:
     """Build basic evaluation haystack pipeline with ground truth data."""
@@ -14,3 +20,12 @@ def evaluate_gt_pipeline() -> Pipeline:
     #                             evaluator)
 
     return eval_pipeline
+
+
+def get_eval_pipeline() -> Pipeline:
+    """Return the evaluation pipeline of the process, built once."""
+    global _eval_pipeline
+    with _eval_pipeline_lock:
+        if _eval_pipeline is None:
+            _eval_pipeline = evaluate_gt_pipeline()
+        return _eval_pipeline
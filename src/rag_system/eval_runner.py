@@ -0,0 +1,209 @@
+"""Run evaluation questions concurrently, checkpointing every result."""
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import timeit
+from typing import Any, Dict, List, Optional, Tuple
+
+import box
+from datasets import load_dataset
+from haystack import Pipeline
+import numpy as np
+import yaml
+
+from rag_system.answer_cache import normalize_question, pipeline_fingerprint
+from rag_system.eval_pipelines import evaluate_gt_pipeline
+from rag_system.inference import execute_pipeline, run_pipeline
+from rag_system.ingest import store_corpus_version
+from rag_system.utils import create_gt_answer_data, create_question_data
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+def load_eval_questions(source: str = '', split: str = 'train',
+                        question_field: str = 'question',
+                        answer_field: str = 'answer',
+                        limit: Optional[int] = None)\
+        -> List[Tuple[str, str]]:
+    """Load (question, ground truth) pairs of an evaluation set.
+
+    source - '' for the built-in wonder questions, a .jsonl/.json/.csv
+    file or the name of a hugging face dataset; a missing ground truth
+    field gives empty ground truth answers.
+    """
+    if not source:
+        rows = [{question_field: question, answer_field: answer}
+                for question, answer in zip(create_question_data(),
+                                            create_gt_answer_data())]
+    elif source.endswith('.jsonl'):
+        with open(source, 'r', encoding='utf8') as file_in:
+            rows = [json.loads(line) for line in file_in if line.strip()]
+    elif source.endswith('.json'):
+        with open(source, 'r', encoding='utf8') as file_in:
+            rows = json.load(file_in)
+    elif source.endswith('.csv'):
+        with open(source, 'r', encoding='utf8', newline='') as file_in:
+            rows = list(csv.DictReader(file_in))
+    else:
+        rows = load_dataset(source, split=split)
+    pairs = [(row[question_field], row.get(answer_field) or '')
+             for row in rows]
+    return pairs[:limit] if limit else pairs
+
+
+def question_id(question: str) -> str:
+    """Identify a question independent of its case and whitespace."""
+    return hashlib.sha256(
+        normalize_question(question).encode('utf8')).hexdigest()[:16]
+
+
+class EvalCheckpoint:
+    """Append finished results to a jsonl file to resume a crashed run.
+
+    Every line holds one question result and the pipeline fingerprint it
+    was computed with; failed results and results of another fingerprint
+    (other models, prompt or corpus) are run again.
+    """
+
+    def __init__(self, path: str, fingerprint: str, resume: bool = True):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.done: Dict[str, Dict[str, Any]] = {}
+        line = "\n"
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf8') as file_in:
+                for line in file_in:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of a crashed run may be cut off
+                        continue
+                    if record.get('fingerprint') == fingerprint \
+                            and 'error' not in record:
+                        self.done[record['id']] = record
+        elif os.path.exists(path):
+            os.remove(path)
+        self.file = open(path, 'a', encoding='utf8')
+        if self.file.tell() and not line.endswith("\n"):
+            # Start after the cut off line instead of continuing it
+            self.file.write("\n")
+
+    def save(self, record: Dict[str, Any]) -> None:
+        """Write one result through to the disk."""
+        record = {**record, 'fingerprint': self.fingerprint}
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.done[record['id']] = record
+
+    def close(self) -> None:
+        """Close the checkpoint file."""
+        self.file.close()
+
+
+def score_faithfulness(eval_pipeline: Pipeline, question: str, answer: str,
+                       retrieved_docs: List[str]) -> float:
+    """Score one answer with the faithfulness evaluator."""
+    responds = eval_pipeline.run({
+        "faithfulness": {"questions": [question],
+                         "contexts": [retrieved_docs],
+                         "predicted_answers": [answer]}})
+    return responds['faithfulness']['score']
+
+
+def evaluate_question(question: str, gt_answer: str, rag_pipeline: Pipeline,
+                      eval_pipeline: Optional[Pipeline],
+                      use_cache: bool) -> Dict[str, Any]:
+    """Answer and optionally score one question, timing the answer."""
+    record = {'id': question_id(question), 'question': question,
+              'gt_answer': gt_answer}
+    start = timeit.default_timer()
+    try:
+        answer, retrieved_docs = (run_pipeline if use_cache
+                                  else execute_pipeline)(question,
+                                                         rag_pipeline)
+    except Exception as e:
+        logger.error(f"Answering '{question}' failed: {e}")
+        record.update(latency=timeit.default_timer() - start, error=str(e))
+        return record
+    record.update(latency=timeit.default_timer() - start, answer=answer,
+                  retrieved_docs=retrieved_docs)
+    if eval_pipeline is not None:
+        try:
+            record['faithfulness'] = score_faithfulness(
+                eval_pipeline, question, answer, retrieved_docs)
+        except Exception as e:
+            logger.error(f"Scoring '{question}' failed: {e}")
+            record['error'] = f"faithfulness: {e}"
+    return record
+
+
+def summarize_results(records: List[Dict[str, Any]], elapsed: float,
+                      evaluated: int) -> Dict[str, float]:
+    """Return counts, latency percentiles and the mean faithfulness."""
+    latencies = np.asarray([record['latency'] for record in records
+                            if 'answer' in record] or [0.0]) * 1000
+    scores = [record['faithfulness'] for record in records
+              if record.get('faithfulness') is not None]
+    return {'questions': len(records),
+            'errors': sum('error' in record for record in records),
+            'evaluated': evaluated, 'wall_time_sec': elapsed,
+            'questions_per_sec': evaluated / elapsed if elapsed else 0.0,
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p95_ms': float(np.percentile(latencies, 95)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'faithfulness_mean': float(np.mean(scores)) if scores else None}
+
+
+def run_evaluation(pairs: List[Tuple[str, str]], rag_pipeline: Pipeline,
+                   doc_store, concurrency: int = cfg.EVAL_CONCURRENCY,
+                   checkpoint_path: str = cfg.EVAL_CHECKPOINT_PATH,
+                   resume: bool = True, faithfulness: bool = False,
+                   use_cache: bool = False)\
+        -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """Evaluate the questions on concurrency threads, resumably.
+
+    Questions already in the checkpoint of the same pipeline fingerprint
+    are skipped; the others are answered (without the answer caches
+    unless use_cache), optionally scored and appended to the checkpoint
+    as soon as each finishes. Returns the records in input order and
+    their summary; latencies of resumed records are the recorded ones.
+    """
+    fingerprint = pipeline_fingerprint(store_corpus_version(doc_store))
+    checkpoint = EvalCheckpoint(checkpoint_path, fingerprint, resume)
+    todo = {}
+    for question, gt_answer in pairs:
+        if question_id(question) not in checkpoint.done:
+            todo.setdefault(question_id(question), (question, gt_answer))
+    logger.info(f"Evaluating {len(todo)} questions, "
+                f"{len(pairs) - len(todo)} resumed from {checkpoint_path}")
+    eval_pipeline = evaluate_gt_pipeline() if faithfulness else None
+
+    start = timeit.default_timer()
+    try:
+        with ThreadPoolExecutor(max(1, concurrency)) as executor:
+            futures = [executor.submit(evaluate_question, question,
+                                       gt_answer, rag_pipeline,
+                                       eval_pipeline, use_cache)
+                       for question, gt_answer in todo.values()]
+            for done, future in enumerate(as_completed(futures), 1):
+                checkpoint.save(future.result())
+                if done % 50 == 0:
+                    logger.info(f"Evaluated {done}/{len(futures)}")
+    finally:
+        checkpoint.close()
+    elapsed = timeit.default_timer() - start
+
+    records = [checkpoint.done[question_id(question)]
+               for question, _ in pairs]
+    return records, summarize_results(records, elapsed, len(todo))
@@ -0,0 +1,122 @@
+"""Contain a cached, background scorer of answer faithfulness."""
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import box
+import yaml
+
+from rag_system.eval_pipelines import get_eval_pipeline
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+def faithfulness_key(question: str, answer: str,
+                     retrieved_docs: List[str]) -> str:
+    """Hash the question, answer and contexts of a faithfulness score."""
+    payload = json.dumps([question, answer, retrieved_docs])
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+class FaithfulnessScorer:
+    """Score answers on background threads, caching the scores.
+
+    Scores are kept in an lru keyed by the hash of the question, answer
+    and contexts; a repeated request gets the cached score at once and a
+    request already being scored shares the future of the first one.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_workers: int = 2):
+        self.max_entries = max_entries
+        self.scores: OrderedDict = OrderedDict()
+        self.pending: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers,
+                                           thread_name_prefix='faithfulness')
+        self.counters = {'hits': 0, 'misses': 0, 'failed': 0}
+
+    def cached(self, key: str) -> Optional[float]:
+        """Return the cached score of a key or None."""
+        with self.lock:
+            return self.scores.get(key)
+
+    def submit(self, question: str, answer: str,
+               retrieved_docs: List[str]) -> Future:
+        """Return a future of the score, computed in the background."""
+        key = faithfulness_key(question, answer, retrieved_docs)
+        with self.lock:
+            if key in self.scores:
+                self.scores.move_to_end(key)
+                self.counters['hits'] += 1
+                future = Future()
+                future.set_result(self.scores[key])
+                return future
+            if key in self.pending:
+                self.counters['hits'] += 1
+                return self.pending[key]
+            self.counters['misses'] += 1
+            future = self.executor.submit(self._score, key, question,
+                                          answer, retrieved_docs)
+            self.pending[key] = future
+            return future
+
+    def put(self, question: str, answer: str, retrieved_docs: List[str],
+            score: float) -> None:
+        """Store a score computed elsewhere, e.g. by the warm-up job."""
+        key = faithfulness_key(question, answer, retrieved_docs)
+        with self.lock:
+            self.scores[key] = score
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+
+    def score(self, question: str, answer: str,
+              retrieved_docs: List[str]) -> float:
+        """Return the cached or freshly computed score, waiting for it."""
+        return self.submit(question, answer, retrieved_docs).result()
+
+    def _score(self, key: str, question: str, answer: str,
+               retrieved_docs: List[str]) -> float:
+        """Run the evaluator pipeline and remember the score."""
+        try:
+            responds = get_eval_pipeline().run({
+                "faithfulness": {"questions": [question],
+                                 "contexts": [retrieved_docs],
+                                 "predicted_answers": [answer]}})
+            score = responds['faithfulness']['score']
+        except Exception as e:
+            logger.error(f"Faithfulness scoring failed: {e}")
+            with self.lock:
+                self.counters['failed'] += 1
+                self.pending.pop(key, None)
+            raise
+        with self.lock:
+            self.scores[key] = score
+            self.pending.pop(key, None)
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+        return score
+
+    def stats(self) -> Dict[str, float]:
+        """Return hits, misses, failures and the number of scores."""
+        with self.lock:
+            return {**self.counters, 'entries': len(self.scores),
+                    'pending': len(self.pending)}
+
+
+_faithfulness_scorer: Optional[FaithfulnessScorer] = None
+
+
+def get_faithfulness_scorer() -> FaithfulnessScorer:
+    """Return the faithfulness scorer of the process."""
+    global _faithfulness_scorer
+    if _faithfulness_scorer is None:
+        _faithfulness_scorer = FaithfulnessScorer(
+            cfg.FAITHFULNESS_CACHE_SIZE, cfg.FAITHFULNESS_WORKERS)
+    return _faithfulness_scorer
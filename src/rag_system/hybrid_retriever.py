@@ -0,0 +1,129 @@
+"""Contain a hybrid retriever running its dense and bm25 branches at once."""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from typing import Dict, List, Optional
+
+from haystack import component, Document
+
+from rag_system.embedders import embed_texts
+
+# Rank offset of reciprocal rank fusion, 60 as in the original paper
+RRF_K = 60
+
+
+def fuse_documents(document_lists: List[List[Document]], mode: str,
+                   weights: Optional[List[float]] = None)\
+        -> List[Document]:
+    """Join the ranked lists of the branches into one ranked list.
+
+    'reciprocal_rank_fusion' - sum of weight / (RRF_K + rank)
+    'weighted' - weighted sum of the min-max normalized branch scores
+    'concatenate' - every document once with its best raw score
+    """
+    weights = weights or [1.0] * len(document_lists)
+    documents: Dict[str, Document] = {}
+    scores: Dict[str, float] = {}
+    for docs, weight in zip(document_lists, weights):
+        branch_scores = [doc.score or 0.0 for doc in docs]
+        low, high = min(branch_scores, default=0), max(branch_scores,
+                                                       default=0)
+        for rank, (doc, score) in enumerate(zip(docs, branch_scores)):
+            documents.setdefault(doc.id, doc)
+            if mode == 'reciprocal_rank_fusion':
+                scores[doc.id] = (scores.get(doc.id, 0.0)
+                                  + weight / (RRF_K + rank + 1))
+            elif mode == 'weighted':
+                norm = (score - low) / (high - low) if high > low else 1.0
+                scores[doc.id] = scores.get(doc.id, 0.0) + weight * norm
+            elif mode == 'concatenate':
+                scores[doc.id] = max(scores.get(doc.id, score), score)
+            else:
+                raise ValueError(f"Unknown fusion mode: {mode}")
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [replace(documents[doc_id], score=scores[doc_id])
+            for doc_id in ranked]
+
+
+@component
+class HybridRetriever:
+    """Retrieve with embeddings and bm25 concurrently and fuse the results.
+
+    The bm25 branch runs on a small shared thread pool while the calling
+    thread embeds the query and searches the dense retriever; both mostly
+    spend their time in numpy/torch code that releases the gil.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    def __init__(self, text_embedder, dense_retriever, sparse_retriever,
+                 fusion: str = 'reciprocal_rank_fusion',
+                 weights: Optional[List[float]] = None,
+                 branch_top_k: int = 10, top_k: int = 5,
+                 concurrent: bool = True, max_workers: int = 4):
+        self.text_embedder = text_embedder
+        self.dense_retriever = dense_retriever
+        self.sparse_retriever = sparse_retriever
+        self.fusion = fusion
+        self.weights = weights
+        self.branch_top_k = branch_top_k
+        self.top_k = top_k
+        self.concurrent = concurrent
+        self.max_workers = max_workers
+
+    def warm_up(self) -> None:
+        """Load the embedding model and the retriever indices."""
+        for part in (self.text_embedder, self.dense_retriever,
+                     self.sparse_retriever):
+            if hasattr(part, 'warm_up'):
+                part.warm_up()
+        if self.concurrent and HybridRetriever._executor is None:
+            HybridRetriever._executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix='bm25')
+
+    def _dense(self, query: str) -> List[Document]:
+        """Embed the query and retrieve by embedding similarity."""
+        embedding = self.text_embedder.run(text=query)["embedding"]
+        return self.dense_retriever.run(query_embedding=embedding,
+                                        top_k=self.branch_top_k)["documents"]
+
+    def _sparse(self, query: str) -> List[Document]:
+        """Retrieve by bm25 score."""
+        return self.sparse_retriever.run(query=query,
+                                         top_k=self.branch_top_k)["documents"]
+
+    def run_batch(self, queries: List[str],
+                  top_k: Optional[int] = None) -> List[List[Document]]:
+        """Retrieve for many queries, embedding and scoring them at once."""
+        self.warm_up()
+        sparse = [HybridRetriever._executor.submit(self._sparse, query)
+                  if self.concurrent else None for query in queries]
+        embeddings = embed_texts(self.text_embedder, queries)
+        if hasattr(self.dense_retriever, 'run_batch'):
+            dense = self.dense_retriever.run_batch(embeddings,
+                                                   self.branch_top_k)
+        else:
+            dense = [self.dense_retriever.run(
+                query_embedding=embedding,
+                top_k=self.branch_top_k)["documents"]
+                for embedding in embeddings]
+        results = []
+        for query, dense_docs, future in zip(queries, dense, sparse):
+            sparse_docs = future.result() if future else self._sparse(query)
+            documents = fuse_documents([dense_docs, sparse_docs],
+                                       self.fusion, self.weights)
+            results.append(documents[:top_k or self.top_k])
+        return results
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, top_k: Optional[int] = None):
+        """Retrieve the fused top_k documents of both branches."""
+        self.warm_up()
+        if self.concurrent:
+            sparse = HybridRetriever._executor.submit(self._sparse, query)
+            dense_docs = self._dense(query)
+            sparse_docs = sparse.result()
+        else:
+            dense_docs, sparse_docs = self._dense(query), self._sparse(query)
+        documents = fuse_documents([dense_docs, sparse_docs], self.fusion,
+                                   self.weights)
+        return {"documents": documents[:top_k or self.top_k]}
@@ -1,15 +1,180 @@
 """Run inference of the rag pipeline."""
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
 import box
-from haystack import Pipeline
+from haystack import Document, Pipeline
 import yaml
 
+from rag_system.answer_cache import get_answer_cache, normalize_question
+from rag_system.answer_catalogue import get_answer_catalogue
+from rag_system.embedders import embed_texts
+from rag_system.semantic_cache import get_semantic_cache
 from rag_system.utils import extract_rag_answer, extract_retrieved_docs
 
 with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
+logger = logging.getLogger('__main__')
+
 
 def run_pipeline(query: str, rag_pipeline: Pipeline) -> Pipeline:
+    """Answer from the catalogue/caches or run the rag/no rag pipeline."""
+    catalogue = get_answer_catalogue()
+    if catalogue is not None:
+        precomputed = catalogue.get(query)
+        if precomputed is not None:
+            return precomputed
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        cached = answer_cache.get(query)
+        if cached is not None:
+            return cached
+    semantic_cache = get_semantic_cache() \
+        if cfg.TYPE_RETRIEVAL in ('dense', 'hybrid') else None
+    if semantic_cache is not None:
+        embedding = embed_query(query, rag_pipeline)
+        cached = semantic_cache.get(query, embedding)
+        if cached is not None:
+            return cached
+    rag_answer, retrieved_docs = execute_pipeline(query, rag_pipeline)
+    if answer_cache is not None:
+        answer_cache.put(query, (rag_answer, retrieved_docs))
+    if semantic_cache is not None:
+        semantic_cache.put(query, embedding, (rag_answer, retrieved_docs))
+
+    return rag_answer, retrieved_docs
+
+
+def query_text_embedder(rag_pipeline: Pipeline):
+    """Return the text embedder of the dense/hybrid pipeline."""
+    if cfg.TYPE_RETRIEVAL == 'hybrid':
+        return rag_pipeline.get_component("hybrid_retriever").text_embedder
+    return rag_pipeline.get_component("text_embedder")
+
+
+def embed_query(query: str, rag_pipeline: Pipeline) -> List[float]:
+    """Embed the query with the text embedder of the dense/hybrid pipeline."""
+    return query_text_embedder(rag_pipeline).run(text=query)["embedding"]
+
+
+def retrieve_batch(queries: List[str],
+                   rag_pipeline: Pipeline) -> List[List[Document]]:
+    """Retrieve the documents of many queries in vectorized steps."""
+    if cfg.TYPE_RETRIEVAL == 'dense':
+        embeddings = embed_texts(query_text_embedder(rag_pipeline), queries)
+        retriever = rag_pipeline.get_component("retriever")
+        if hasattr(retriever, 'run_batch'):
+            return retriever.run_batch(embeddings)
+        return [retriever.run(query_embedding=embedding)["documents"]
+                for embedding in embeddings]
+    if cfg.TYPE_RETRIEVAL == 'sparse':
+        retriever = rag_pipeline.get_component("retriever")
+        return [retriever.run(query=query)["documents"] for query in queries]
+    if cfg.TYPE_RETRIEVAL == 'hybrid':
+        return rag_pipeline.get_component("hybrid_retriever").run_batch(
+            queries)
+    return [[] for _ in queries]
+
+
+def generate_answer(query: str, documents: List[Document],
+                    rag_pipeline: Pipeline) -> Tuple[str, List[str]]:
+    """Run reranker, prompt, llm and answer builder on retrieved documents."""
+    if cfg.TYPE_RETRIEVAL == 'hybrid' and cfg.HYBRID_RERANKER:
+        documents = rag_pipeline.get_component("ranker").run(
+            query=query, documents=documents)["documents"]
+    prompt = rag_pipeline.get_component("prompt_builder").run(
+        question=query, documents=documents)["prompt"]
+    generated = rag_pipeline.get_component("llm").run(prompt=prompt)
+    response_rag = {"answer_builder": rag_pipeline.get_component(
+        "answer_builder").run(query=query, replies=generated["replies"],
+                              meta=generated["meta"], documents=documents)}
+
+    return extract_rag_answer(response_rag), \
+        extract_retrieved_docs(response_rag)
+
+
+def run_pipeline_batch(queries: List[str], rag_pipeline: Pipeline,
+                       max_concurrency: int = cfg.BULK_MAX_CONCURRENCY,
+                       on_result: Optional[Callable] = None)\
+        -> List[Tuple[str, List[str]] | Exception]:
+    """Answer many questions, batching the embedding and retrieval.
+
+    Cached and repeated questions are answered once; the others are
+    embedded in one forward pass and retrieved in one vectorized step,
+    then the llm calls fan out over max_concurrency threads. Results are
+    returned in input order, a failed question as its exception;
+    on_result(index, result) is called as soon as each one is ready.
+    """
+    results: List = [None] * len(queries)
+
+    def finish(indices: List[int], result) -> None:
+        for index in indices:
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+    positions: Dict[str, List[int]] = {}
+    for index, query in enumerate(queries):
+        positions.setdefault(normalize_question(query), []).append(index)
+    catalogue = get_answer_catalogue()
+    answer_cache = get_answer_cache()
+    pending = []
+    for indices in positions.values():
+        query = queries[indices[0]]
+        cached = catalogue.get(query) if catalogue else None
+        if cached is None and answer_cache is not None:
+            cached = answer_cache.get(query)
+        if cached is not None:
+            finish(indices, cached)
+        else:
+            pending.append(indices)
+
+    semantic_cache = get_semantic_cache() \
+        if cfg.TYPE_RETRIEVAL in ('dense', 'hybrid') else None
+    embeddings = {}
+    if semantic_cache is not None and pending:
+        pending_queries = [queries[indices[0]] for indices in pending]
+        vectors = embed_texts(query_text_embedder(rag_pipeline),
+                              pending_queries)
+        embeddings = dict(zip(pending_queries, vectors))
+        misses = []
+        for indices in pending:
+            query = queries[indices[0]]
+            cached = semantic_cache.get(query, embeddings[query])
+            if cached is not None:
+                finish(indices, cached)
+            else:
+                misses.append(indices)
+        pending = misses
+
+    pending_queries = [queries[indices[0]] for indices in pending]
+    documents = retrieve_batch(pending_queries, rag_pipeline) \
+        if pending else []
+    with ThreadPoolExecutor(max(1, max_concurrency)) as executor:
+        futures = {executor.submit(generate_answer, query, docs,
+                                   rag_pipeline): (query, indices)
+                   for query, docs, indices in zip(pending_queries,
+                                                   documents, pending)}
+        for future in as_completed(futures):
+            query, indices = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Answering '{query}' failed: {e}")
+                finish(indices, e)
+                continue
+            if answer_cache is not None:
+                answer_cache.put(query, result)
+            if semantic_cache is not None:
+                semantic_cache.put(query, embeddings[query], result)
+            finish(indices, result)
+
+    return results
+
+
+def execute_pipeline(query: str, rag_pipeline: Pipeline) -> Pipeline:
     """Run rag/no rag pipeline with predifined parameters."""
     if cfg.TYPE_RETRIEVAL == 'dense':
         # Execute the query
@@ -27,15 +192,13 @@ def run_pipeline(query: str, rag_pipeline: Pipeline) -> Pipeline:
              }
         )
     elif cfg.TYPE_RETRIEVAL == 'hybrid':
-        response_rag = rag_pipeline.run(
-            {"text_embedder": {"text": query},
-             "bm25_retriever": {"query": query},
-             "document_joiner": {"top_k": 5},
-             "ranker": {"query": query},
-             "prompt_builder": {"question": query},
-             "answer_builder": {"query": query}
-             }
-        )
+        inputs = {"hybrid_retriever": {"query": query},
+                  "prompt_builder": {"question": query},
+                  "answer_builder": {"query": query}
+                  }
+        if cfg.HYBRID_RERANKER:
+            inputs["ranker"] = {"query": query}
+        response_rag = rag_pipeline.run(inputs)
     elif cfg.TYPE_RETRIEVAL == 'no_rag':
         response_rag = response_rag = rag_pipeline.run(
             {"prompt_builder": {"question": query},
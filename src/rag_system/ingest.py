@@ -1,22 +1,38 @@
 """Import files to build rag algorithm."""
 
-import concurrent.futures
-from itertools import chain
+import hashlib
+import json
 import logging
 import multiprocessing
+import timeit
 
 from datasets import load_dataset
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack import Document
-from haystack.components.embedders import SentenceTransformersDocumentEmbedder
 from haystack.utils import ComponentDevice
 from milvus_haystack import MilvusDocumentStore
+import numpy as np
 import torch
 
 import box
 from dotenv import load_dotenv, find_dotenv
 import yaml
 
+from rag_system.ann_index import IVFIndex
+from rag_system.answer_cache import get_answer_cache
+from rag_system.answer_catalogue import get_answer_catalogue
+from rag_system.bm25_index import BM25Index
+from rag_system.doc_writer import write_documents_batched, write_with_retry
+from rag_system.embedding_cache import EmbeddingCache, normalize_content
+from rag_system.embedding_engine import get_embedding_engine
+from rag_system.embedding_pool import embed_documents_in_processes
+from rag_system.semantic_cache import get_semantic_cache
+from rag_system.snapshot import attached_embeddings
+from rag_system.snapshot import content_hashes_version
+from rag_system.snapshot import load_snapshot, save_snapshot
+from rag_system.snapshot import snapshot_staleness
+from rag_system.streaming_ingest import run_streaming_pipeline
+
 load_dotenv(find_dotenv())
 logger = logging.getLogger('__main__')
 
@@ -25,117 +41,381 @@ with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
 
-def create_document(doc):
-    """Construct a document from loaded file."""
-    return Document(content=doc["content"], meta=doc["meta"])
+def stable_document_id(content, meta):
+    """Derive a document id from its source key, or its meta and content.
 
+    With the DOC_ID_KEYS meta fields present the id stays the same when
+    the content is edited (tracked by content_hash), otherwise it hashes
+    meta and normalized content, so documents never share an id by meta.
+    """
+    keys = cfg.DOC_ID_KEYS
+    if keys and all(key in meta for key in keys):
+        source = json.dumps([meta[key] for key in keys], default=str)
+    else:
+        source = json.dumps([meta, normalize_content(content)],
+                            sort_keys=True, default=str)
+    return hashlib.sha256(source.encode('utf8')).hexdigest()
 
-def embed_batch_documents(docs_batch, model, device):
-    """Perform embedding on the certain document."""
-    doc_embedder = SentenceTransformersDocumentEmbedder(model=model,
-                                                        device=device)
-    doc_embedder.warm_up()
-    return doc_embedder.run(docs_batch)["documents"]
 
+def unique_documents(docs):
+    """Drop repeated ids, warning about those with different contents."""
+    unique = {}
+    for doc in docs:
+        first = unique.setdefault(doc.id, doc)
+        if first.meta.get("content_hash") != doc.meta.get("content_hash"):
+            logger.warning(f"Documents with the same id {doc.id} differ, "
+                           f"keeping the first; check DOC_ID_KEYS")
+    return list(unique.values())
+
+
+def create_document(doc):
+    """Construct a document from loaded file."""
+    content_hash = hashlib.sha256(
+        normalize_content(doc["content"]).encode('utf8')).hexdigest()
+    return Document(id=stable_document_id(doc["content"], doc["meta"]),
+                    content=doc["content"],
+                    meta={**doc["meta"], "content_hash": content_hash})
 
-def extract_documents():
-    """Extract all documents from the dataset in parallel."""
-    dataset = load_dataset('bilgeyucel/seven-wonders', split="train")
 
+def select_device():
+    """Select the gpu if it is available, otherwise the cpu."""
     # Check if a GPU is available
     device_str = "cuda:0" if torch.cuda.is_available() else "cpu"
 
-    device = ComponentDevice.from_str(device_str)
+    return ComponentDevice.from_str(device_str)
+
+
+def extract_documents():
+    """Extract all documents from the dataset."""
+    dataset = load_dataset(cfg.DATA_SET, split="train")
+    device = select_device()
     # Determine the number of CPU cores and threads
     num_cores = multiprocessing.cpu_count()
 
     # Use up to the number of cores, but not more than dataset size
     num_workers = min(num_cores, len(dataset))
 
-    # Parallelize document creation
-    with concurrent.futures.ProcessPoolExecutor(
-            max_workers=num_workers) as executor:
-        docs = list(executor.map(create_document, dataset))
+    # Building a Document is cheaper than pickling it to another process
+    docs = unique_documents(create_document(row) for row in dataset)
 
     return docs, device, num_workers
 
 
 def write_documents(doc_store, final_docs, num_workers):
     """Write all documents/their embeddings in the selected document store."""
-    # file_paths = glob.glob("./milvus-document-store.md")
-    def write_batch(batch):
-        try:
-            doc_store.write_documents(batch)
-        except Exception as e:
-            logger.error(f"Error writing batch to document store: {e}")
-            raise
-    # write_batch_size = min(50, len(final_docs), num_workers * 5)
-
-    # Write documents to the store in batches
-    # batches = [final_docs[i:i + write_batch_size] for i
-    #            in range(0, len(final_docs), write_batch_size)]
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) \
-         as executor:
-        # for batch in batches:
-        executor.submit(write_batch, final_docs)
+    write_documents_batched(doc_store, final_docs,
+                            batch_size=cfg.WRITE_BATCH_SIZE,
+                            concurrency=cfg.WRITE_CONCURRENCY or num_workers,
+                            max_retries=cfg.WRITE_MAX_RETRIES,
+                            backoff=cfg.WRITE_BACKOFF_SEC,
+                            defer_index=cfg.WRITE_DEFER_INDEX)
 
     return doc_store
 
 
+def open_embedding_cache():
+    """Open the on-disk embedding cache if it is enabled."""
+    if not cfg.EMBED_CACHE:
+        return None
+    return EmbeddingCache(cfg.EMBED_CACHE_PATH, cfg.EMBEDDINGS,
+                          cfg.EMBEDDINGS_REVISION,
+                          cfg.EMBED_CACHE_MAX_MB * 2**20)
+
+
+def embed_documents(docs, device, num_workers, cache=None,
+                    mode=cfg.EMBED_MODE):
+    """Compute embeddings of the given documents in parallel.
+
+    A cache passed by the caller is only filled, the caller flushes it;
+    otherwise the cache is opened and flushed here.
+    """
+    owns_cache = cache is None
+    if owns_cache:
+        cache = open_embedding_cache()
+    # Reuse embeddings of unchanged documents from the on-disk cache
+    cached_docs, docs_to_embed = [], docs
+    if cache is not None:
+        docs_to_embed = []
+        for doc in docs:
+            doc.embedding = cache.get(doc.content)
+            if doc.embedding is None:
+                docs_to_embed.append(doc)
+            else:
+                cached_docs.append(doc)
+
+    embedded_docs = []
+    if docs_to_embed and mode == 'process_pool' \
+            and device.to_torch_str() == 'cpu':
+        # Shard the corpus over worker processes with one model each
+        threads_per_worker = cfg.EMBED_THREADS_PER_WORKER
+        embed_workers = (cfg.EMBED_WORKERS or max(
+            1, multiprocessing.cpu_count() // threads_per_worker))
+        embedded_docs = embed_documents_in_processes(
+            docs_to_embed, cfg.EMBEDDINGS, embed_workers,
+            threads_per_worker, shard_size=cfg.EMBED_SHARD_SIZE,
+            batch_size=cfg.EMBED_BATCH_SIZE)
+    elif docs_to_embed:
+        # Load the model once and embed in length-sorted adaptive batches
+        engine = get_embedding_engine(
+            cfg.EMBEDDINGS, device,
+            batch_size=cfg.EMBED_BATCH_SIZE,
+            max_batch_size=cfg.EMBED_MAX_BATCH_SIZE,
+            min_free_bytes=cfg.EMBED_MIN_FREE_MB * 2**20)
+        embedded_docs = list(engine.embed(docs_to_embed))
+
+    if cache is not None:
+        for doc in embedded_docs:
+            cache.put(doc.content, doc.embedding)
+    if cache is not None and owns_cache:
+        cache.flush()
+        logger.info(f"Embedding cache: {cache.hits} hits, "
+                    f"{cache.misses} misses, {len(cache)} entries")
+    return cached_docs + embedded_docs
+
+
 def convert_documents_into_embeddings():
     """Compute embeddings of the all documents in parallel."""
     docs, device, num_workers = extract_documents()
-
-    # Initialize the embedder once
-    doc_embedder = SentenceTransformersDocumentEmbedder(
-        model=cfg.EMBEDDINGS, device=device)
-    doc_embedder.warm_up()
-    # Embed documents in batches
-    batch_size = 32 if device == "cuda:0" else 8
-    with concurrent.futures.ThreadPoolExecutor(
-            max_workers=num_workers) as executor:
-        futures = [executor.submit(embed_batch_documents,
-                                   docs[i:i + batch_size],
-                                   cfg.EMBEDDINGS, device)
-                   for i in range(0, len(docs), batch_size)]
-        docs_with_embeddings = [f.result() for f in
-                                concurrent.futures.as_completed(futures)]
-    final_docs = list(chain.from_iterable(docs_with_embeddings))
+    final_docs = embed_documents(docs, device, num_workers)
 
     return final_docs, device, num_workers
 
 
+def stored_content_hashes(doc_store):
+    """Map the id of every stored document to its content hash.
+
+    filter_documents() of milvus returns at most 10000 documents, so its
+    collection is paged through with a query iterator instead.
+    """
+    if not isinstance(doc_store, MilvusDocumentStore):
+        return {doc.id: doc.meta.get("content_hash")
+                for doc in doc_store.filter_documents()}
+    collection = doc_store.col
+    if collection is None:
+        return {}
+    primary_field = collection.schema.primary_field.name
+    iterator = collection.query_iterator(
+        batch_size=cfg.SYNC_PAGE_SIZE, expr="",
+        output_fields=[primary_field, "content_hash"])
+    stored_hashes = {}
+    try:
+        while page := iterator.next():
+            for row in page:
+                stored_hashes[row[primary_field]] = row.get("content_hash")
+    finally:
+        iterator.close()
+    return stored_hashes
+
+
+def store_corpus_version(doc_store) -> str:
+    """Hash the ids and content hashes of every stored document."""
+    return content_hashes_version(stored_content_hashes(doc_store))
+
+
+def sync_documents_into_store(doc_store, docs, device, num_workers):
+    """Embed and write only new/changed documents, delete removed ones."""
+    start = timeit.default_timer()
+    stored_hashes = stored_content_hashes(doc_store)
+
+    new_docs, changed_docs, unchanged = [], [], 0
+    for doc in docs:
+        if doc.id not in stored_hashes:
+            new_docs.append(doc)
+        elif stored_hashes[doc.id] != doc.meta["content_hash"]:
+            changed_docs.append(doc)
+        else:
+            unchanged += 1
+    current_ids = {doc.id for doc in docs}
+    deleted_ids = [doc_id for doc_id in stored_hashes
+                   if doc_id not in current_ids]
+
+    # Changed documents are replaced: delete the old row, write the new one
+    stale_ids = deleted_ids + [doc.id for doc in changed_docs]
+    if stale_ids:
+        doc_store.delete_documents(stale_ids)
+    if new_docs or changed_docs:
+        final_docs = embed_documents(new_docs + changed_docs, device,
+                                     num_workers)
+        doc_store = write_documents(doc_store, final_docs, num_workers)
+
+    elapsed = timeit.default_timer() - start
+    logger.info(f"Incremental ingest: {len(new_docs)} added, "
+                f"{len(changed_docs)} updated, {len(deleted_ids)} deleted, "
+                f"{unchanged} unchanged in {elapsed:.2f}s")
+    return doc_store
+
+
+def stream_documents_into_store(doc_store, embed=True):
+    """Read, embed and write documents in overlapping bounded batches."""
+    dataset = load_dataset(cfg.DATA_SET, split="train",
+                           streaming=cfg.DATASET_STREAMING)
+    device = select_device()
+    cache = open_embedding_cache() if embed else None
+    embedded_batches = [0]
+
+    def embed_batch(batch):
+        # The process pool would reload its models for every batch
+        batch = embed_documents(batch, device, 1, cache=cache, mode='engine')
+        embedded_batches[0] += 1
+        if cache is not None and \
+                embedded_batches[0] % cfg.STREAM_CACHE_FLUSH_BATCHES == 0:
+            # Bound the new embeddings held in memory by the cache
+            cache.flush()
+        return batch
+
+    def write_batch(batch):
+        write_with_retry(doc_store, batch, cfg.WRITE_MAX_RETRIES,
+                         cfg.WRITE_BACKOFF_SEC)
+        return batch
+
+    stages = [('embed', embed_batch)] if embed else []
+    stages.append(('write', write_batch))
+    run_streaming_pipeline(map(create_document, dataset), stages,
+                           batch_size=cfg.STREAM_BATCH_SIZE,
+                           queue_size=cfg.STREAM_QUEUE_SIZE,
+                           log_interval=cfg.STREAM_LOG_INTERVAL)
+    if cache is not None:
+        cache.flush()
+        logger.info(f"Embedding cache: {cache.hits} hits, "
+                    f"{cache.misses} misses, {len(cache)} entries")
+    return doc_store
+
+
+def load_inmemory_store_from_snapshot(with_embeddings=True):
+    """Attach to the snapshot of the in-memory store if it is fresh."""
+    if not cfg.SNAPSHOT:
+        return None
+    docs = extract_documents()[0] if cfg.SNAPSHOT_VERIFY_CORPUS else None
+    reason = snapshot_staleness(cfg.SNAPSHOT_PATH, with_embeddings, docs)
+    if reason is not None:
+        logger.info(f"Rebuilding the in-memory store: {reason}")
+        return None
+    return load_snapshot(cfg.SNAPSHOT_PATH,
+                         copy_embeddings=cfg.DENSE_RETRIEVER != 'matrix',
+                         index_bm25=cfg.SPARSE_RETRIEVER != 'index')
+
+
 def load_text_data_into_inmemory_store() -> InMemoryDocumentStore:
     """Load and embed data into the in-memory document store."""
+    inmemory_doc_store = load_inmemory_store_from_snapshot(
+        with_embeddings=False)
+    if inmemory_doc_store is not None:
+        return inmemory_doc_store
+
     # Initialize the document store
     inmemory_doc_store = InMemoryDocumentStore()
-    final_docs, _, num_workers = extract_documents()
-    inmemory_doc_store = write_documents(inmemory_doc_store,
-                                         final_docs,
-                                         num_workers)
+    if cfg.INGEST_STREAMING:
+        stream_documents_into_store(inmemory_doc_store, embed=False)
+    else:
+        final_docs, _, num_workers = extract_documents()
+        inmemory_doc_store = write_documents(inmemory_doc_store,
+                                             final_docs,
+                                             num_workers)
+    if cfg.SNAPSHOT:
+        save_snapshot(inmemory_doc_store, cfg.SNAPSHOT_PATH,
+                      with_embeddings=False)
     return inmemory_doc_store
 
 
 def load_embedded_data_into_inmemory_store() -> InMemoryDocumentStore:
     """Load and embed data into the in-memory document store."""
+    inmemory_doc_store = load_inmemory_store_from_snapshot()
+    if inmemory_doc_store is not None:
+        return inmemory_doc_store
+
     # Initialize the document store
     inmemory_doc_store = InMemoryDocumentStore()
-    final_docs, _, num_workers = convert_documents_into_embeddings()
-    inmemory_doc_store = write_documents(inmemory_doc_store,
-                                         final_docs,
-                                         num_workers)
+    if cfg.INGEST_STREAMING:
+        stream_documents_into_store(inmemory_doc_store)
+    else:
+        final_docs, _, num_workers = convert_documents_into_embeddings()
+        inmemory_doc_store = write_documents(inmemory_doc_store,
+                                             final_docs,
+                                             num_workers)
+    if cfg.SNAPSHOT:
+        save_snapshot(inmemory_doc_store, cfg.SNAPSHOT_PATH)
     return inmemory_doc_store
 
 
+def update_ann_index(doc_store):
+    """Train the ann index of the in-memory store or update it in place."""
+    start = timeit.default_timer()
+    vectors = attached_embeddings(doc_store)
+    if vectors is None:
+        docs = [doc for doc in doc_store.filter_documents()
+                if doc.embedding is not None]
+        vectors = np.asarray([doc.embedding for doc in docs],
+                             dtype=np.float32)
+    else:
+        docs = doc_store.filter_documents()
+    if not docs:
+        return None
+    ann_index = IVFIndex.load(cfg.ANN_INDEX_PATH, cfg.ANN_NPROBE)
+    known = {} if ann_index is None else ann_index.cells
+    pending = sum(doc.id not in known for doc in docs)
+    # Retrain on another model or cell count, or once the documents
+    # inserted without retraining would unbalance the cells
+    if ann_index is None or ann_index.centroids.shape[1] != vectors.shape[1]\
+            or ann_index.nlist != max(1, min(cfg.ANN_NLIST, len(docs))) \
+            or ann_index.inserted + pending \
+            > cfg.ANN_RETRAIN_FRACTION * len(docs):
+        ann_index = IVFIndex.train(vectors, cfg.ANN_NLIST, cfg.ANN_NPROBE,
+                                   cfg.ANN_TRAIN_ITERATIONS,
+                                   ids=[doc.id for doc in docs])
+
+    current_ids = {doc.id for doc in docs}
+    removed = [doc_id for doc_id in ann_index.cells
+               if doc_id not in current_ids]
+    ann_index.remove(removed)
+    new_rows = [row for row, doc in enumerate(docs)
+                if doc.id not in ann_index.cells]
+    ann_index.add([docs[row].id for row in new_rows], vectors[new_rows])
+    ann_index.save(cfg.ANN_INDEX_PATH)
+    logger.info(f"Ann index with {ann_index.nlist} cells: "
+                f"{len(new_rows)} inserted, {len(removed)} removed in "
+                f"{timeit.default_timer() - start:.2f}s")
+    return ann_index
+
+
+def update_bm25_index(doc_store, path: str = cfg.BM25_INDEX_PATH):
+    """Load the bm25 index at path and apply the changes of the store."""
+    start = timeit.default_timer()
+    bm25_index = BM25Index.load(path) or BM25Index(
+        cfg.BM25_K1, cfg.BM25_B)
+    docs = doc_store.filter_documents()
+    current = {doc.id: doc for doc in docs}
+    changed = [doc for doc in docs if doc.id in bm25_index
+               and bm25_index.content_hash(doc.id)
+               != doc.meta.get("content_hash", "")]
+    removed = [doc_id for doc_id in bm25_index.doc_ids
+               if doc_id in bm25_index and doc_id not in current]
+    added = [doc for doc in docs if doc.id not in bm25_index]
+    bm25_index.remove(removed + [doc.id for doc in changed])
+    bm25_index.add(added + changed)
+    if added or changed or removed:
+        bm25_index.save(path)
+    logger.info(f"Bm25 index with {len(bm25_index)} documents: "
+                f"{len(added)} added, {len(changed)} updated, "
+                f"{len(removed)} removed in "
+                f"{timeit.default_timer() - start:.2f}s")
+    return bm25_index
+
+
 def load_embedded_data_into_milvus():
     """Load and embed documents into the milvus doc store/vector database."""
-
+    incremental = cfg.INGEST_MODE == 'incremental'
     milvus_doc_store = MilvusDocumentStore(
         # sql_url="sqlite:///mydb.db",
         connection_args={"uri": cfg.DOCSTORE_PATH},
-        drop_old=True,
+        drop_old=not incremental,
     )
-    
+    if incremental:
+        docs, device, num_workers = extract_documents()
+        return sync_documents_into_store(milvus_doc_store, docs, device,
+                                         num_workers)
+    if cfg.INGEST_STREAMING:
+        return stream_documents_into_store(milvus_doc_store)
+
     final_docs, _, num_workers = convert_documents_into_embeddings()
 
     milvus_doc_store = write_documents(milvus_doc_store,
@@ -144,6 +424,17 @@ def load_embedded_data_into_milvus():
     return milvus_doc_store
 
 
+def record_corpus_version(doc_store):
+    """Key the cached and precomputed answers to the corpus version."""
+    caches = [cache for cache in (get_answer_cache(), get_semantic_cache(),
+                                  get_answer_catalogue())
+              if cache is not None]
+    if caches:
+        version = store_corpus_version(doc_store)
+        for cache in caches:
+            cache.set_corpus_version(version)
+
+
 def load_data_into_store():
     """Select type of doc store and type of documents/embeddings."""
     doc_store = InMemoryDocumentStore()
@@ -156,4 +447,12 @@ def load_data_into_store():
     elif cfg.TYPE_DOCSTORE == 'milvus' and cfg.TYPE_RETRIEVAL == 'dense':
         doc_store = load_embedded_data_into_milvus()
 
+    if cfg.ANN_INDEX and cfg.TYPE_DOCSTORE == 'inmemory' \
+            and cfg.TYPE_RETRIEVAL in ('dense', 'hybrid'):
+        update_ann_index(doc_store)
+    if cfg.SPARSE_RETRIEVER == 'index' and cfg.TYPE_DOCSTORE == 'inmemory' \
+            and cfg.TYPE_RETRIEVAL in ('sparse', 'hybrid'):
+        update_bm25_index(doc_store)
+    record_corpus_version(doc_store)
+
     return doc_store
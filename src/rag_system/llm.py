@@ -8,6 +8,8 @@ from haystack.components.generators import OpenAIGenerator
 # from haystack.utils import Secret
 import yaml
 
+from rag_system.streaming import stream_callback
+
 load_dotenv(find_dotenv())
 
 with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
@@ -17,5 +19,7 @@ with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
 def setup_single_llm(model_name: str) -> Optional[object] | None:
     """Build single llm (non-chat-TGI) model for RAG algorithm."""
     if cfg.LLM_TYPE == 'openai':
-        return OpenAIGenerator(model=model_name)
+        # Tokens go to the event sink of a streaming request, if any
+        callback = stream_callback if cfg.LLM_STREAMING else None
+        return OpenAIGenerator(model=model_name, streaming_callback=callback)
     return None
@@ -1,16 +1,16 @@
 """Main entry point for the rag algorithm."""
-import timeit
+import argparse
+import json
+import logging
 
 import box
 from dotenv import find_dotenv, load_dotenv
 import yaml
 
-# from rag_system.evaluate import build_rag_eval_report, evaluate_rag
-from rag_system.inference import run_pipeline
+from rag_system.eval_runner import load_eval_questions, run_evaluation
 from rag_system.ingest import load_data_into_store
+from rag_system.micro_batcher import enable_micro_batching
 from rag_system.rag_pipelines import select_rag_pipeline
-# from rag_system.utils import create_gt_answer_data
-from rag_system.utils import create_question_data
 
 
 load_dotenv(find_dotenv())
@@ -20,28 +20,42 @@ with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
 
 def main():
     """Apply test questions on Q&A system with ground truth evaluation."""
-    query_list = create_question_data()
-
-    rag_answers, retrieved_docs_all, rag_questions = [], [], []
-    # gt_answers = create_gt_answer_data()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--questions', default=cfg.EVAL_QUESTIONS,
+                        help='.jsonl/.json/.csv file or hugging face '
+                             'dataset, default the built-in questions')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--question-field', default=cfg.EVAL_QUESTION_FIELD)
+    parser.add_argument('--answer-field', default=cfg.EVAL_ANSWER_FIELD)
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--concurrency', type=int,
+                        default=cfg.EVAL_CONCURRENCY)
+    parser.add_argument('--checkpoint', default=cfg.EVAL_CHECKPOINT_PATH)
+    parser.add_argument('--fresh', action='store_true',
+                        help='discard the checkpoint instead of resuming')
+    parser.add_argument('--faithfulness', action='store_true',
+                        help='score every answer with the llm evaluator')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='answer through the answer caches')
+    args = parser.parse_args()
+
+    pairs = load_eval_questions(args.questions, args.split,
+                                args.question_field, args.answer_field,
+                                args.limit)
+    # The concurrent questions share the forward passes of the models
+    enable_micro_batching(cfg.MICRO_BATCH)
     data_store = load_data_into_store()
-
-    start = timeit.default_timer()
     curr_rag_pipeline = select_rag_pipeline(data_store)
-    for curr_query in query_list:
-
-        rag_answer, retrieved_docs = run_pipeline(curr_query,
-                                                  curr_rag_pipeline)
-        rag_questions.append(curr_query)
-        rag_answers.append(rag_answer)
-        retrieved_docs_all.append(retrieved_docs)
-    # inputs, results = evaluate_rag(query_list, rag_answers,
-    #                                gt_answers, retrieved_docs_all)
-    end = timeit.default_timer()
-    # build_rag_eval_report(inputs, results)
+    records, summary = run_evaluation(
+        pairs, curr_rag_pipeline, data_store, args.concurrency,
+        args.checkpoint, not args.fresh, args.faithfulness, args.use_cache)
+
     print('=' * 50)
-    print(f"Time to retrieve answer: {end - start}")
-    print(rag_answers)
+    print(json.dumps(summary, indent=2))
+    for record in records[:10]:
+        print(f"{record['question']}\n  -> "
+              f"{record.get('answer', record.get('error'))}")
 
 
 if __name__ == "__main__":
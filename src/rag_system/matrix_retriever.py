@@ -0,0 +1,192 @@
+"""Contain a dense retriever over one contiguous numpy embedding matrix."""
+from dataclasses import replace
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from haystack import component, Document
+import numpy as np
+
+from rag_system.quantization import QuantizedMatrix
+
+logger = logging.getLogger('__main__')
+
+# Rows upcast to float32 at once when scoring a float16 matrix
+SCORE_CHUNK_ROWS = 65536
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale every row to unit length so that dot product is cosine."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int)\
+        -> Tuple[np.ndarray, np.ndarray]:
+    """Return the indices and scores of the top_k columns of every row."""
+    top_k = min(top_k, scores.shape[1])
+    if top_k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return (np.take_along_axis(indices, order, axis=1),
+            np.take_along_axis(top_scores, order, axis=1))
+
+
+@component
+class MatrixEmbeddingRetriever:
+    """Retrieve documents by cosine similarity with a single matrix product.
+
+    All corpus embeddings are copied once into a normalized matrix, stored
+    as float32 or float16 (half the memory). The matrix is built on
+    warm_up() or on the first query. With an ann_index only the rows of
+    the cells nearest to the query are scored.
+
+    With quantization ('int8' or 'binary') only the compact codes are kept
+    in memory. They select rescore_factor * top_k candidates which are then
+    rescored with the full precision matrix, memory-mapped from
+    rescore_path (kept in memory when no path is given). The document
+    store is never modified: its float embeddings stay resident next to
+    the codes unless the store was attached from a snapshot without them.
+    """
+
+    def __init__(self, document_store, top_k: int = 10,
+                 dtype: str = 'float32', ann_index=None,
+                 quantization: str = 'none', rescore_factor: int = 4,
+                 rescore_path: Optional[str] = None):
+        self.document_store = document_store
+        self.top_k = top_k
+        self.dtype = np.dtype(dtype)
+        self.ann_index = ann_index
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.rescore_path = rescore_path
+        self.documents: List[Document] = []
+        self.matrix: Optional[np.ndarray] = None
+        self.codes: Optional[QuantizedMatrix] = None
+
+    def warm_up(self) -> None:
+        """Build the embedding matrix of the document store."""
+        if self.matrix is None:
+            self.build()
+
+    def build(self) -> None:
+        """Copy the embeddings of the document store into the matrix."""
+        stored = self.document_store.filter_documents()
+        documents = [doc for doc in stored if doc.embedding is not None]
+        if stored and not documents:
+            logger.warning("No embeddings in the document store, attach "
+                           "its snapshot with set_embeddings()")
+        self.set_embeddings(documents,
+                            [doc.embedding for doc in documents])
+
+    def set_embeddings(self, documents: List[Document],
+                       embeddings: np.ndarray,
+                       normalized: bool = False) -> None:
+        """Use the embeddings, one row per document, as the matrix.
+
+        Already normalized rows of the matrix dtype (a mapped snapshot)
+        are used as they are, without copying them into memory.
+        """
+        # Results never carry embeddings, do not keep them referenced
+        self.documents = [replace(doc, embedding=None) for doc in documents]
+        if not documents:
+            self.matrix = np.empty((0, 0), dtype=self.dtype)
+            return
+        matrix = embeddings if normalized else normalize_rows(embeddings)
+        if matrix.dtype != self.dtype:
+            matrix = matrix.astype(self.dtype)
+        if self.quantization == 'none':
+            self.matrix = matrix
+        else:
+            self.codes = QuantizedMatrix(matrix, self.quantization)
+            self.matrix = (matrix if isinstance(matrix, np.memmap)
+                           else self._map_from_disk(matrix))
+        if self.ann_index is not None:
+            self.ann_index.bind([doc.id for doc in documents], self.matrix)
+
+    def _map_from_disk(self, matrix: np.ndarray) -> np.ndarray:
+        """Write the full precision matrix to disk and map it read-only."""
+        if self.rescore_path is None:
+            return matrix
+        os.makedirs(os.path.dirname(self.rescore_path) or '.', exist_ok=True)
+        np.save(self.rescore_path, matrix)
+        return np.load(self.rescore_path, mmap_mode='r')
+
+    @property
+    def memory_bytes(self) -> int:
+        """Return the memory of the codes and the matrix kept in RAM.
+
+        A memory-mapped rescore matrix is not counted, nor are embeddings
+        still held by the documents of the document store.
+        """
+        codes = 0 if self.codes is None else self.codes.nbytes
+        if self.matrix is None or isinstance(self.matrix, np.memmap):
+            return codes
+        return codes + self.matrix.nbytes
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Compute the cosine similarity of every query to every document.
+
+        With quantization this is the approximate first-pass similarity.
+        """
+        self.warm_up()
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        if len(self.matrix) == 0:
+            return np.empty((len(queries), 0), dtype=np.float32)
+        if self.codes is not None:
+            return self.codes.scores(queries)
+        if self.dtype == np.float32:
+            return queries @ self.matrix.T
+        # numpy has no fast float16 matmul, upcast the matrix chunk-wise
+        return np.concatenate(
+            [queries @ self.matrix[i:i + SCORE_CHUNK_ROWS].astype(
+                np.float32).T
+             for i in range(0, len(self.matrix), SCORE_CHUNK_ROWS)],
+            axis=1)
+
+    def search(self, query_embeddings: np.ndarray, top_k: int)\
+            -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return rows and scores of the top_k documents of every query."""
+        self.warm_up()
+        if self.ann_index is not None and len(self.matrix):
+            return self.ann_index.search(query_embeddings, top_k)
+        if self.codes is None:
+            return list(zip(*top_k_indices(self.scores(query_embeddings),
+                                           top_k)))
+
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        candidates, _ = top_k_indices(self.codes.scores(queries),
+                                      top_k * self.rescore_factor)
+        results = []
+        for query, rows in zip(queries, candidates):
+            # Sorted rows read the memory-mapped matrix sequentially
+            rows = np.sort(rows)
+            exact = (self.matrix[rows].astype(np.float32) @ query)[None]
+            indices, scores = top_k_indices(exact, top_k)
+            results.append((rows[indices[0]], scores[0]))
+        return results
+
+    def _to_documents(self, indices: np.ndarray,
+                      scores: np.ndarray) -> List[Document]:
+        """Return copies of the documents carrying their similarity score."""
+        return [replace(self.documents[i], score=float(score), embedding=None)
+                for i, score in zip(indices, scores)]
+
+    @component.output_types(documents=List[Document])
+    def run(self, query_embedding: List[float], top_k: Optional[int] = None):
+        """Retrieve the top_k documents most similar to the query."""
+        [(indices, scores)] = self.search(query_embedding,
+                                          top_k or self.top_k)
+        return {"documents": self._to_documents(indices, scores)}
+
+    def run_batch(self, query_embeddings: List[List[float]],
+                  top_k: Optional[int] = None) -> List[List[Document]]:
+        """Retrieve the top_k documents of a batch of queries at once."""
+        return [self._to_documents(indices, scores)
+                for indices, scores in self.search(query_embeddings,
+                                                   top_k or self.top_k)]
@@ -0,0 +1,123 @@
+"""Contain a scheduler batching model calls of concurrent requests."""
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import box
+import yaml
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+_batchers: Dict[str, 'MicroBatcher'] = {}
+_batchers_lock = threading.Lock()
+_enabled = False
+
+
+class MicroBatcher:
+    """Collect items of concurrent threads and process them as one batch.
+
+    A worker thread takes the first waiting item, gathers more for up to
+    max_wait_ms or until max_batch_size items, runs process_batch once on
+    all of them and hands every caller its own result (or the error).
+    Batches never hold more requests than the threads submitting at
+    once, e.g. the pipeline executor slots of the servers.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 name: str = 'micro-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: queue.Queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        threading.Thread(target=self._loop, name=name, daemon=True).start()
+
+    def submit_many(self, items: List[Any]) -> List[Any]:
+        """Process the items within shared batches and wait for them."""
+        futures = [Future() for _ in items]
+        for item, future in zip(items, futures):
+            self.queue.put((item, future))
+        return [future.result() for future in futures]
+
+    def submit(self, item: Any) -> Any:
+        """Process one item within a shared batch and wait for it."""
+        return self.submit_many([item])[0]
+
+    def _collect(self) -> List:
+        """Wait for a first item, then gather more until the deadline."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        """Run the batches of the queued items forever."""
+        while True:
+            batch = self._collect()
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                logger.warning(f"Micro batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            if len(results) != len(batch):
+                error = RuntimeError(f"Micro batch of {len(batch)} items "
+                                     f"returned {len(results)} results")
+                logger.warning(str(error))
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self) -> Dict[str, float]:
+        """Return the number and mean size of the processed batches."""
+        return {'batches': self.batches, 'items': self.items,
+                'mean_batch_size': self.items / max(self.batches, 1),
+                'largest_batch': self.largest_batch,
+                'queue_depth': self.queue.qsize()}
+
+
+def enable_micro_batching(enabled: bool = True) -> None:
+    """Turn batching of concurrent model calls on, e.g. for the server."""
+    global _enabled
+    _enabled = enabled
+
+
+def get_micro_batcher(name: str,
+                      process_batch: Callable[[List[Any]], List[Any]])\
+        -> Optional[MicroBatcher]:
+    """Return the batcher of a model or None when batching is off."""
+    if not _enabled:
+        return None
+    with _batchers_lock:
+        if name not in _batchers:
+            _batchers[name] = MicroBatcher(process_batch,
+                                           cfg.MICRO_BATCH_MAX_SIZE,
+                                           cfg.MICRO_BATCH_MAX_WAIT_MS, name)
+        return _batchers[name]
+
+
+def micro_batching_stats() -> Dict[str, Dict[str, float]]:
+    """Return the statistics of every batcher."""
+    return {name: batcher.stats() for name, batcher in _batchers.items()}
@@ -0,0 +1,115 @@
+"""Contain the bounded executor running pipelines for the fastapi apps."""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+import box
+from fastapi import HTTPException
+import numpy as np
+import yaml
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+class PipelineExecutor:
+    """Run synchronous pipeline calls off the event loop, bounded.
+
+    At most max_in_flight calls run on the dedicated thread pool; up to
+    max_queue more wait for a slot. Further requests are rejected at once
+    with 429, requests waiting longer than queue_timeout with 503, both
+    with a Retry-After header.
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32,
+                 queue_timeout: float = 30, retry_after: int = 5):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_in_flight,
+                                           thread_name_prefix='pipeline')
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters = {'completed': 0, 'failed': 0, 'rejected': 0,
+                         'timed_out': 0}
+        self.waits = deque(maxlen=1000)
+
+    def _busy(self, status_code: int, detail: str) -> HTTPException:
+        """Build the load-shedding error with its Retry-After header."""
+        return HTTPException(status_code=status_code, detail=detail,
+                             headers={"Retry-After": str(self.retry_after)})
+
+    def check_capacity(self) -> None:
+        """Reject with 429 when all slots and queue places are taken."""
+        if self.in_flight + self.waiting >= \
+                self.max_in_flight + self.max_queue:
+            self.counters['rejected'] += 1
+            logger.warning("Rejected a request, the pipeline queue is full")
+            raise self._busy(429, "Too many requests, queue is full")
+
+    async def run(self, func: Callable, *args):
+        """Wait for a free slot and run func(*args) on the thread pool."""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.check_capacity()
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters['timed_out'] += 1
+            raise self._busy(503, "Timed out waiting for a free worker")
+        finally:
+            self.waiting -= 1
+        self.waits.append(time.monotonic() - start)
+
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        call = self.executor.submit(func, *args)
+        # A cancelled request (disconnect, timeout) leaves the thread
+        # running, the slot is freed only when the call itself is done
+        call.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            result = await asyncio.wrap_future(call)
+        except Exception:
+            self.counters['failed'] += 1
+            raise
+        self.counters['completed'] += 1
+        return result
+
+    def _release(self) -> None:
+        """Free the slot of a finished pipeline call."""
+        self.in_flight -= 1
+        self.slots.release()
+
+    def stats(self) -> Dict[str, float]:
+        """Return in-flight and queued calls, counters and wait times."""
+        waits = np.asarray(self.waits or [0.0]) * 1000
+        return {**self.counters, 'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'wait_p50_ms': float(np.percentile(waits, 50)),
+                'wait_p95_ms': float(np.percentile(waits, 95))}
+
+
+_pipeline_executor: Optional[PipelineExecutor] = None
+
+
+def get_pipeline_executor() -> PipelineExecutor:
+    """Return the pipeline executor of the server process."""
+    global _pipeline_executor
+    if _pipeline_executor is None:
+        _pipeline_executor = PipelineExecutor(
+            cfg.PIPELINE_MAX_IN_FLIGHT, cfg.PIPELINE_MAX_QUEUE,
+            cfg.PIPELINE_QUEUE_TIMEOUT_SEC, cfg.PIPELINE_RETRY_AFTER_SEC)
+    return _pipeline_executor
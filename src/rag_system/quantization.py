@@ -0,0 +1,57 @@
+"""Contain scalar (int8) and binary quantization of embedding matrices."""
+import numpy as np
+
+# Rows decoded at once when scoring the compact codes
+CHUNK_ROWS = 65536
+
+# Number of set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                          axis=1).sum(axis=1).astype(np.uint16)
+
+
+class QuantizedMatrix:
+    """Hold the compact codes of a row-normalized embedding matrix.
+
+    'int8' stores every dimension scaled to [-127, 127] (a quarter of
+    float32), 'binary' stores only the sign bits (1/32 of float32) and
+    compares them by hamming distance.
+    """
+
+    def __init__(self, matrix: np.ndarray, method: str):
+        self.method = method
+        self.dim = matrix.shape[1]
+        if method == 'int8':
+            self.scale = np.abs(matrix).max(axis=0) / 127
+            self.scale[self.scale == 0] = 1.0
+            self.codes = np.round(matrix / self.scale).astype(np.int8)
+        elif method == 'binary':
+            self.scale = None
+            self.codes = np.packbits(matrix > 0, axis=1)
+        else:
+            raise ValueError(f"Unknown quantization method: {method}")
+
+    @property
+    def nbytes(self) -> int:
+        """Return the memory used by the codes."""
+        scale_bytes = 0 if self.scale is None else self.scale.nbytes
+        return self.codes.nbytes + scale_bytes
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Approximate the similarity of normalized queries to every row."""
+        if self.method == 'int8':
+            weighted = (queries * self.scale).astype(np.float32)
+            return np.concatenate(
+                [weighted @ self.codes[i:i + CHUNK_ROWS].astype(
+                    np.float32).T
+                 for i in range(0, len(self.codes), CHUNK_ROWS)], axis=1)
+
+        query_bits = np.packbits(queries > 0, axis=1)
+        distances = np.empty((len(queries), len(self.codes)),
+                             dtype=np.float32)
+        for row, bits in enumerate(query_bits):
+            for i in range(0, len(self.codes), CHUNK_ROWS):
+                xor = np.bitwise_xor(self.codes[i:i + CHUNK_ROWS], bits)
+                distances[row, i:i + CHUNK_ROWS] = \
+                    _POPCOUNT[xor].sum(axis=1)
+        # Map the hamming distance to [-1, 1] like a cosine similarity
+        return 1 - 2 * distances / self.dim
@@ -1,8 +1,6 @@
 """Contain wrapper function of separater rag pipeline components."""
 from haystack import Pipeline
 from haystack.components.builders.answer_builder import AnswerBuilder
-from haystack.components.joiners import DocumentJoiner
-from haystack.components.rankers import TransformersSimilarityRanker
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 
 import box
@@ -11,9 +9,11 @@ import yaml
 from rag_system.llm import setup_single_llm
 
 from rag_system.embedders import setup_embedder
+from rag_system.rerankers import setup_ranker
+from rag_system.streaming import DocumentsTap
 from rag_system.wrapper_prompts import setup_prompt
 from rag_system.retrievers import setup_single_retriever
-from rag_system.retrievers import setup_hyrbrid_retriever
+from rag_system.retrievers import setup_hybrid_retriever
 
 with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
@@ -49,6 +49,7 @@ def setup_rag_dense_pipeline(data_store: InMemoryDocumentStore) -> Pipeline:
     dense_pipeline = Pipeline()
     dense_pipeline.add_component("text_embedder", text_embedder)
     dense_pipeline.add_component("retriever", retriever)
+    dense_pipeline.add_component("documents_tap", DocumentsTap())
     dense_pipeline.add_component("prompt_builder", prompt)
     dense_pipeline.add_component("llm", llm)
     dense_pipeline.add_component(instance=AnswerBuilder(),
@@ -57,11 +58,13 @@ def setup_rag_dense_pipeline(data_store: InMemoryDocumentStore) -> Pipeline:
     # Now, connect the components to each other
     dense_pipeline.connect("text_embedder.embedding",
                            "retriever.query_embedding")
-    dense_pipeline.connect("retriever", "prompt_builder.documents")
+    dense_pipeline.connect("retriever", "documents_tap")
+    dense_pipeline.connect("documents_tap", "prompt_builder.documents")
     dense_pipeline.connect("prompt_builder", "llm")
     dense_pipeline.connect("llm.replies", "answer_builder.replies")
     dense_pipeline.connect("llm.meta", "answer_builder.meta")
-    dense_pipeline.connect("retriever.documents", "answer_builder.documents")
+    dense_pipeline.connect("documents_tap.documents",
+                           "answer_builder.documents")
     # dense_pipeline.draw(path=cfg.PIPELINE_PATH)
 
     return dense_pipeline
@@ -75,54 +78,56 @@ def setup_rag_sparse_pipeline(data_store: InMemoryDocumentStore) -> Pipeline:
 
     sparse_pipeline = Pipeline()
     sparse_pipeline.add_component("retriever", bm25_retriever)
+    sparse_pipeline.add_component("documents_tap", DocumentsTap())
     sparse_pipeline.add_component("prompt_builder", prompt)
     sparse_pipeline.add_component("llm", llm)
     sparse_pipeline.add_component(instance=AnswerBuilder(),
                                   name="answer_builder")
     # Now, connect the components to each other
-    sparse_pipeline.connect("retriever", "prompt_builder.documents")
+    sparse_pipeline.connect("retriever", "documents_tap")
+    sparse_pipeline.connect("documents_tap", "prompt_builder.documents")
     sparse_pipeline.connect("prompt_builder", "llm")
     sparse_pipeline.connect("llm.replies", "answer_builder.replies")
     sparse_pipeline.connect("llm.meta", "answer_builder.meta")
-    sparse_pipeline.connect("retriever.documents", "answer_builder.documents")
+    sparse_pipeline.connect("documents_tap.documents",
+                            "answer_builder.documents")
     # sparse_pipeline.draw(path=cfg.PIPELINE_PATH)
 
     return sparse_pipeline
 
 
-def setup_rag_hybrid_pipeline(data_store: InMemoryDocumentStore) -> Pipeline:
-    """Build basic rag haystack pipeline."""
+def setup_rag_hybrid_pipeline(data_store: InMemoryDocumentStore,
+                              fusion: str = cfg.HYBRID_FUSION,
+                              rerank: bool = cfg.HYBRID_RERANKER,
+                              concurrent: bool = cfg.HYBRID_CONCURRENT)\
+        -> Pipeline:
+    """Build hybrid rag pipeline: fused dense and bm25 retrieval."""
     prompt = setup_prompt()
     llm = setup_single_llm(cfg.LLM_MODEL)
-    text_embedder = setup_embedder(cfg.EMBEDDINGS)
-    embedding_retriever, bm25_retriever = setup_hyrbrid_retriever(data_store)
-
-    document_joiner = DocumentJoiner()
-    ranker = TransformersSimilarityRanker(model="BAAI/bge-reranker-base")
+    hybrid_retriever = setup_hybrid_retriever(data_store, fusion, rerank,
+                                              concurrent)
 
     hybrid_pipeline = Pipeline()
-    hybrid_pipeline.add_component("text_embedder", text_embedder)
-    hybrid_pipeline.add_component("embedding_retriever", embedding_retriever)
-    hybrid_pipeline.add_component("bm25_retriever", bm25_retriever)
-    hybrid_pipeline.add_component("document_joiner", document_joiner)
-    hybrid_pipeline.add_component("ranker", ranker)
+    hybrid_pipeline.add_component("hybrid_retriever", hybrid_retriever)
+    hybrid_pipeline.add_component("documents_tap", DocumentsTap())
     hybrid_pipeline.add_component("prompt_builder", prompt)
     hybrid_pipeline.add_component("llm", llm)
     hybrid_pipeline.add_component(instance=AnswerBuilder(),
                                   name="answer_builder")
 
     # Now, connect the components to each other
-    hybrid_pipeline.connect("text_embedder",
-                            "embedding_retriever.query_embedding")
-    hybrid_pipeline.connect("bm25_retriever", "document_joiner.documents")
-    hybrid_pipeline.connect("embedding_retriever",
-                            "document_joiner.documents")
-    hybrid_pipeline.connect("document_joiner", "ranker")
-    hybrid_pipeline.connect("ranker", "prompt_builder.documents")
+    documents = "hybrid_retriever"
+    if rerank:
+        ranker = setup_ranker(cfg.HYBRID_TOP_K)
+        hybrid_pipeline.add_component("ranker", ranker)
+        hybrid_pipeline.connect("hybrid_retriever", "ranker")
+        documents = "ranker"
+    hybrid_pipeline.connect(documents, "documents_tap")
+    hybrid_pipeline.connect("documents_tap", "prompt_builder.documents")
     hybrid_pipeline.connect("prompt_builder.prompt", "llm.prompt")
     hybrid_pipeline.connect("llm.replies", "answer_builder.replies")
     hybrid_pipeline.connect("llm.meta", "answer_builder.meta")
-    hybrid_pipeline.connect("ranker", "answer_builder.documents")
+    hybrid_pipeline.connect("documents_tap", "answer_builder.documents")
     # hybrid_pipeline.draw(path=cfg.PIPELINE_PATH)
 
     return hybrid_pipeline
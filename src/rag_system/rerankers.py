@@ -0,0 +1,209 @@
+"""Contain the cross-encoder reranker of the hybrid rag pipeline."""
+from collections import deque, OrderedDict
+from dataclasses import replace
+import hashlib
+import logging
+import threading
+import timeit
+from typing import Dict, List, Optional, Tuple
+
+import box
+from haystack import component, Document
+from haystack.components.rankers import TransformersSimilarityRanker
+import numpy as np
+import torch
+import yaml
+
+from rag_system.micro_batcher import get_micro_batcher
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+def query_hash(query: str) -> str:
+    """Hash a query after normalizing case and whitespace."""
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha1(normalized.encode('utf8')).hexdigest()
+
+
+def prune_candidates(documents: List[Document], max_candidates: int,
+                     min_candidates: int = 1,
+                     gap_factor: float = 0.0) -> List[Document]:
+    """Keep the candidates worth scoring with the cross-encoder.
+
+    The candidates are capped at the max_candidates best ranked ones. With
+    a gap_factor the list is cut at its largest score gap behind the first
+    min_candidates, if that gap exceeds gap_factor times the mean gap.
+    Gaps compared with gaps do not depend on the score scale: the rrf
+    scores of documents found by both branches stand apart from those
+    found by one, as do the outliers of weighted or concatenated scores.
+    """
+    ranked = sorted(documents, key=lambda doc: doc.score or 0.0,
+                    reverse=True)[:max_candidates]
+    min_candidates = max(min_candidates, 1)
+    if gap_factor <= 0 or len(ranked) <= min_candidates:
+        return ranked
+    scores = np.asarray([doc.score or 0.0 for doc in ranked])
+    gaps = scores[:-1] - scores[1:]
+    cut = int(np.argmax(gaps[min_candidates - 1:])) + min_candidates - 1
+    if gaps[cut] > gap_factor * gaps.mean():
+        return ranked[:cut + 1]
+    return ranked
+
+
+def content_key(doc: Document) -> str:
+    """Return the content hash of a document, computing it if missing."""
+    return doc.meta.get('content_hash') or hashlib.sha1(
+        (doc.content or "").encode('utf8')).hexdigest()
+
+
+@component
+class CachedRanker:
+    """Rerank documents with a cross-encoder, caching every pair score.
+
+    Scores are kept in an lru cache keyed by (model, query hash, doc id,
+    content hash), so an edited document with the same id is rescored.
+    Only uncached pairs go through the model, in batches truncated to
+    max_length tokens. Candidates behind a large first-stage score gap
+    are pruned, never fewer than min_candidates remain.
+    """
+
+    def __init__(self, model: str, top_k: int = 5, cache_size: int = 10000,
+                 max_length: int = 256, batch_size: int = 16,
+                 max_candidates: int = 10, min_candidates: int = 5,
+                 gap_factor: float = 0.0, scale_score: bool = True,
+                 calibration_factor: float = 1.0):
+        self.model = model
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+        self.min_candidates = min_candidates
+        self.gap_factor = gap_factor
+        self.scale_score = scale_score
+        self.calibration_factor = calibration_factor
+        self.ranker = TransformersSimilarityRanker(model=model, top_k=top_k)
+        self.cache: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'model_calls': 0, 'pairs_scored': 0,
+                         'cache_hits': 0, 'pruned': 0}
+        self.latencies = deque(maxlen=1000)
+
+    def warm_up(self) -> None:
+        """Load the cross-encoder model and tokenizer."""
+        self.ranker.warm_up()
+
+    def _score_pairs(self, query: str,
+                     documents: List[Document]) -> np.ndarray:
+        """Run the cross-encoder over the pairs of one query."""
+        pairs = [(query, doc.content or "") for doc in documents]
+        batcher = get_micro_batcher(f"rerank:{self.model}", self._forward)
+        if batcher is None:
+            scores = self._forward(pairs)
+        else:
+            # Pairs of concurrent requests share the forward passes
+            scores = batcher.submit_many(pairs)
+        with self.lock:
+            self.counters['pairs_scored'] += len(documents)
+        return np.asarray(scores, dtype=np.float32)
+
+    def _forward(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Score (query, text) pairs in batches truncated to max_length."""
+        device = self.ranker.device.first_device.to_torch()
+        scores = []
+        for i in range(0, len(pairs), self.batch_size):
+            queries, texts = zip(*pairs[i:i + self.batch_size])
+            features = self.ranker.tokenizer(
+                list(queries), list(texts), padding=True, truncation=True,
+                max_length=self.max_length, return_tensors="pt").to(device)
+            with torch.inference_mode():
+                logits = self.ranker.model(**features).logits.squeeze(dim=1)
+            scores.extend(logits.float().cpu().tolist())
+            with self.lock:
+                self.counters['model_calls'] += 1
+        return scores
+
+    def _cached_scores(self, query: str, documents: List[Document])\
+            -> Dict[str, float]:
+        """Return the raw scores of the pairs, scoring only cache misses."""
+        key = (self.model, query_hash(query))
+        scores, missing = {}, []
+        with self.lock:
+            for doc in documents:
+                score = self.cache.get(key + (doc.id, content_key(doc)))
+                if score is None:
+                    missing.append(doc)
+                else:
+                    self.cache.move_to_end(key + (doc.id, content_key(doc)))
+                    scores[doc.id] = score
+            self.counters['cache_hits'] += len(scores)
+        if missing:
+            new_scores = self._score_pairs(query, missing)
+            with self.lock:
+                for doc, score in zip(missing, new_scores.tolist()):
+                    scores[doc.id] = score
+                    self.cache[key + (doc.id, content_key(doc))] = score
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return scores
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters and the p50/p95 latency in milliseconds."""
+        latencies = np.asarray(self.latencies or [0.0]) * 1000
+        requests = max(self.counters['requests'], 1)
+        return {**self.counters,
+                'model_calls_per_request':
+                    self.counters['model_calls'] / requests,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95))}
+
+    @component.output_types(documents=List[Document])
+    def run(self, query: str, documents: List[Document],
+            top_k: Optional[int] = None):
+        """Return the top_k documents ordered by cross-encoder score."""
+        start = timeit.default_timer()
+        top_k = top_k or self.top_k
+        candidates = prune_candidates(documents, self.max_candidates,
+                                      self.min_candidates, self.gap_factor)
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['pruned'] += len(documents) - len(candidates)
+        if not candidates:
+            self.latencies.append(timeit.default_timer() - start)
+            return {"documents": []}
+
+        if self.ranker.model is None:
+            self.warm_up()
+        scores = self._cached_scores(query, candidates)
+        ranked: List[Tuple[float, Document]] = []
+        for doc in candidates:
+            score = scores[doc.id]
+            if self.scale_score:
+                score = float(1 / (1 + np.exp(-score
+                                              * self.calibration_factor)))
+            ranked.append((score, doc))
+        ranked.sort(key=lambda pair: pair[0], reverse=True)
+        elapsed = timeit.default_timer() - start
+        self.latencies.append(elapsed)
+        logger.debug(f"Reranked {len(candidates)} of {len(documents)} "
+                     f"candidates in {elapsed * 1000:.1f}ms")
+        return {"documents": [replace(doc, score=score)
+                              for score, doc in ranked[:top_k]]}
+
+
+def setup_ranker(top_k: int = cfg.HYBRID_TOP_K)\
+        -> CachedRanker | TransformersSimilarityRanker:
+    """Build the caching/pruning reranker or the plain haystack one."""
+    if not cfg.RERANK_CACHE:
+        return TransformersSimilarityRanker(model=cfg.RERANKER_MODEL,
+                                            top_k=top_k)
+    return CachedRanker(model=cfg.RERANKER_MODEL, top_k=top_k,
+                        cache_size=cfg.RERANK_CACHE_SIZE,
+                        max_length=cfg.RERANK_MAX_LENGTH,
+                        batch_size=cfg.RERANK_BATCH_SIZE,
+                        max_candidates=cfg.HYBRID_RERANK_CANDIDATES,
+                        min_candidates=top_k,
+                        gap_factor=cfg.RERANK_PRUNE_GAP)
@@ -1,9 +1,16 @@
 """Provide respond functions to fastapi and streamlit endpoints."""
-from typing import Tuple, List
+import asyncio
+from typing import Dict, Tuple, List
 
 from haystack import Pipeline
-from rag_system.eval_pipelines import evaluate_gt_pipeline
+from rag_system.answer_cache import normalize_question
+from rag_system.faithfulness_cache import get_faithfulness_scorer
 from rag_system.inference import run_pipeline
+from rag_system.pipeline_executor import get_pipeline_executor
+
+# Pipeline runs in flight, keyed by pipeline and normalized question
+_in_flight: Dict[Tuple[int, str], asyncio.Future] = {}
+single_flight_counters = {'leaders': 0, 'coalesced': 0}
 
 
 def get_respond_fastapi(query: str,
@@ -15,17 +22,52 @@ def get_respond_fastapi(query: str,
     return rag_answer, retrieved_docs
 
 
+def _forget_in_flight(key: Tuple[int, str], task: asyncio.Future) -> None:
+    """Remove a finished run so that the next request runs again."""
+    _in_flight.pop(key, None)
+    if not task.cancelled():
+        # Mark the error retrieved even if every waiter went away
+        task.exception()
+
+
+async def get_respond_fastapi_async(query: str,
+                                    rag_pipeline: Pipeline)\
+        -> Tuple[str, List[str]]:
+    """Run inference once for identical concurrent questions.
+
+    The first request of a question starts the pipeline run on the bounded
+    pipeline executor; concurrent requests with the same normalized
+    question and pipeline wait for that run and share its result or
+    error. Waiters are
+    shielded, so a cancelled (disconnected) request does not cancel the
+    run of the others.
+    """
+    key = (id(rag_pipeline), normalize_question(query))
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(get_pipeline_executor().run(
+            get_respond_fastapi, query, rag_pipeline))
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _forget_in_flight(key, done))
+        single_flight_counters['leaders'] += 1
+    else:
+        single_flight_counters['coalesced'] += 1
+
+    return await asyncio.shield(task)
+
+
+def evaluate_faithfulness(query: str, rag_answer: str,
+                          retrieved_docs: List[str]) -> float:
+    """Score the faithfulness of an answer to the retrieved documents."""
+    return get_faithfulness_scorer().score(query, rag_answer,
+                                           retrieved_docs)
+
+
 def get_respond_streamlit(query: str,
                           rag_pipeline: Pipeline)\
         -> Tuple[str, float]:
     """Run inference on the rag pipeline."""
-    eval_pipeline = evaluate_gt_pipeline()
     rag_answer, retrieved_docs = run_pipeline(query, rag_pipeline)
-    responds = eval_pipeline.run({
-        "faithfulness": {"questions": [query],
-                         "contexts": [retrieved_docs],
-                         "predicted_answers": [rag_answer]},
-    }
-    )
-
-    return rag_answer, responds['faithfulness']['score']
+
+    return rag_answer, evaluate_faithfulness(query, rag_answer,
+                                             retrieved_docs)
@@ -7,30 +7,91 @@ from haystack.components.retrievers.in_memory import InMemoryEmbeddingRetriever
 from milvus_haystack.milvus_embedding_retriever import MilvusEmbeddingRetriever
 import yaml
 
+from rag_system.ann_index import IVFIndex
+from rag_system.bm25_index import BM25Index, BM25IndexRetriever
+from rag_system.embedders import setup_embedder
+from rag_system.hybrid_retriever import HybridRetriever
+from rag_system.matrix_retriever import MatrixEmbeddingRetriever
+from rag_system.snapshot import attached_embeddings
+
 with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
 
+def setup_inmemory_dense_retriever(doc_store: object)\
+        -> InMemoryEmbeddingRetriever | MatrixEmbeddingRetriever:
+    """Build the per-document or the numpy matrix embedding retriever."""
+    if cfg.DENSE_RETRIEVER == 'matrix':
+        ann_index = (IVFIndex.load(cfg.ANN_INDEX_PATH, cfg.ANN_NPROBE)
+                     if cfg.ANN_INDEX else None)
+        retriever = MatrixEmbeddingRetriever(
+            document_store=doc_store, dtype=cfg.MATRIX_DTYPE,
+            ann_index=ann_index, quantization=cfg.QUANTIZATION,
+            rescore_factor=cfg.QUANT_RESCORE_FACTOR,
+            rescore_path=cfg.QUANT_RESCORE_PATH)
+        embeddings = attached_embeddings(doc_store)
+        if embeddings is not None:
+            # Search the mapped snapshot rows instead of copying them
+            retriever.set_embeddings(doc_store.filter_documents(),
+                                     embeddings, normalized=True)
+        return retriever
+    return InMemoryEmbeddingRetriever(document_store=doc_store)
+
+
+def setup_inmemory_sparse_retriever(
+        doc_store: object, bm25_index_path: str = cfg.BM25_INDEX_PATH)\
+        -> InMemoryBM25Retriever | BM25IndexRetriever:
+    """Build the haystack bm25 retriever or the persistent bm25 index one."""
+    if cfg.SPARSE_RETRIEVER == 'index':
+        bm25_index = BM25Index.load(bm25_index_path) or BM25Index(
+            cfg.BM25_K1, cfg.BM25_B)
+        return BM25IndexRetriever(index=bm25_index, document_store=doc_store)
+    return InMemoryBM25Retriever(document_store=doc_store)
+
+
 def setup_single_retriever(doc_store: object)\
     -> InMemoryBM25Retriever | MilvusEmbeddingRetriever |\
-        InMemoryEmbeddingRetriever:
+        InMemoryEmbeddingRetriever | MatrixEmbeddingRetriever |\
+        BM25IndexRetriever:
     """Build embedding or a single retreiver based on data."""
     retriever = None
     if cfg.TYPE_RETRIEVAL == 'dense' and cfg.TYPE_DOCSTORE == 'inmemory':
-        retriever = InMemoryEmbeddingRetriever(document_store=doc_store)
+        retriever = setup_inmemory_dense_retriever(doc_store)
     elif cfg.TYPE_RETRIEVAL == 'dense' and cfg.TYPE_DOCSTORE == 'milvus':
         retriever = MilvusEmbeddingRetriever(document_store=doc_store)
     elif cfg.TYPE_RETRIEVAL == 'sparse' and cfg.TYPE_DOCSTORE == 'inmemory':
-        retriever = InMemoryBM25Retriever(document_store=doc_store)
+        retriever = setup_inmemory_sparse_retriever(doc_store)
     elif cfg.TYPE_RETRIEVAL == 'hybrid' and cfg.TYPE_DOCSTORE == 'inmemory':
         retriever = MilvusEmbeddingRetriever(document_store=doc_store)
     return retriever
 
 
-def setup_hyrbrid_retriever(doc_store: object) -> \
-        Tuple[InMemoryEmbeddingRetriever, InMemoryBM25Retriever]:
+def setup_hyrbrid_retriever(
+        doc_store: object, bm25_index_path: str = cfg.BM25_INDEX_PATH) -> \
+        Tuple[InMemoryEmbeddingRetriever | MatrixEmbeddingRetriever,
+              InMemoryBM25Retriever | BM25IndexRetriever]:
     """Build embedding and sparse(bm25)-based retreiver."""
-    dense_retriever = InMemoryEmbeddingRetriever(doc_store)
-    sparse_retriever = InMemoryBM25Retriever(doc_store)
+    dense_retriever = setup_inmemory_dense_retriever(doc_store)
+    sparse_retriever = setup_inmemory_sparse_retriever(doc_store,
+                                                       bm25_index_path)
 
     return dense_retriever, sparse_retriever
+
+
+def setup_hybrid_retriever(doc_store: object,
+                           fusion: str = cfg.HYBRID_FUSION,
+                           rerank: bool = cfg.HYBRID_RERANKER,
+                           concurrent: bool = cfg.HYBRID_CONCURRENT,
+                           bm25_index_path: str = cfg.BM25_INDEX_PATH)\
+        -> HybridRetriever:
+    """Build the fused dense and bm25 retriever of the hybrid pipeline."""
+    dense_retriever, sparse_retriever = setup_hyrbrid_retriever(
+        doc_store, bm25_index_path)
+    # With a reranker the fusion only caps the candidates it has to score
+    top_k = cfg.HYBRID_RERANK_CANDIDATES if rerank else cfg.HYBRID_TOP_K
+    return HybridRetriever(
+        text_embedder=setup_embedder(cfg.EMBEDDINGS),
+        dense_retriever=dense_retriever, sparse_retriever=sparse_retriever,
+        fusion=fusion, weights=cfg.HYBRID_WEIGHTS,
+        branch_top_k=cfg.HYBRID_BRANCH_TOP_K, top_k=top_k,
+        concurrent=concurrent)
@@ -0,0 +1,135 @@
+"""Contain a semantic cache of answers keyed by query embeddings."""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import box
+import numpy as np
+import yaml
+
+from rag_system.answer_cache import pipeline_fingerprint
+from rag_system.matrix_retriever import normalize_rows
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+class SemanticCache:
+    """Answer paraphrases of earlier questions by embedding similarity.
+
+    The normalized query embeddings are rows of one small matrix; a lookup
+    is a single matrix-vector product. A hit needs a cosine similarity of
+    at least threshold. Hits within risk_margin above the threshold are
+    counted as risky (a paraphrase and a different question look alike
+    there) and logged with both questions so they can be audited.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024,
+                 ttl: float = 3600, risk_margin: float = 0.03):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.risk_margin = risk_margin
+        self.matrix: Optional[np.ndarray] = None
+        self.questions: List[str] = []
+        self.values: List[Tuple[str, List[str]]] = []
+        self.expires = np.empty(0)
+        self.last_used = np.empty(0)
+        self.lock = threading.Lock()
+        self.fingerprint = pipeline_fingerprint()
+        self.counters = {'hits': 0, 'misses': 0, 'risky_hits': 0,
+                         'near_misses': 0, 'expired': 0, 'evictions': 0}
+
+    def set_corpus_version(self, corpus_version: str) -> None:
+        """Drop all entries when the pipeline fingerprint changes."""
+        fingerprint = pipeline_fingerprint(corpus_version)
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self.matrix = None
+                self.questions, self.values = [], []
+                self.expires, self.last_used = np.empty(0), np.empty(0)
+
+    def get(self, question: str, embedding: List[float])\
+            -> Optional[Tuple[str, List[str]]]:
+        """Return the answer of the most similar earlier question or None."""
+        query = normalize_rows(np.asarray(embedding)[None])[0]
+        now = time.time()
+        with self.lock:
+            if not self.questions:
+                self.counters['misses'] += 1
+                return None
+            similarities = self.matrix[:len(self.questions)] @ query
+            expired = self.expires < now
+            self.counters['expired'] += int(
+                (expired & (similarities >= self.threshold)).sum())
+            similarities[expired] = -np.inf
+            row = int(np.argmax(similarities))
+            similarity = float(similarities[row])
+            if similarity < self.threshold:
+                self.counters['misses'] += 1
+                if similarity >= self.threshold - self.risk_margin:
+                    self.counters['near_misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            self.last_used[row] = now
+            if similarity < self.threshold + self.risk_margin:
+                self.counters['risky_hits'] += 1
+            logger.info(f"Semantic cache hit {similarity:.3f}: "
+                        f"'{question}' ~ '{self.questions[row]}'")
+            return self.values[row]
+
+    def put(self, question: str, embedding: List[float],
+            value: Tuple[str, List[str]]) -> None:
+        """Remember the answer of a question under its embedding."""
+        vector = normalize_rows(np.asarray(embedding)[None])[0]
+        now = time.time()
+        with self.lock:
+            if self.matrix is None or self.matrix.shape[1] != len(vector):
+                self.matrix = np.empty((self.max_entries, len(vector)),
+                                       dtype=np.float32)
+                self.questions, self.values = [], []
+                self.expires, self.last_used = np.empty(0), np.empty(0)
+            if len(self.questions) < self.max_entries:
+                row = len(self.questions)
+                self.questions.append(question)
+                self.values.append(tuple(value))
+                self.expires = np.append(self.expires, now + self.ttl)
+                self.last_used = np.append(self.last_used, now)
+            else:
+                # Reuse an expired row or else the least recently used one
+                stale = np.where(self.expires < now, -np.inf, self.last_used)
+                row = int(np.argmin(stale))
+                self.counters['evictions'] += int(self.expires[row] >= now)
+                self.questions[row] = question
+                self.values[row] = tuple(value)
+                self.expires[row] = now + self.ttl
+                self.last_used[row] = now
+            self.matrix[row] = vector
+
+    def stats(self) -> Dict[str, float]:
+        """Return the counters, the hit rate and the number of entries."""
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            hits = self.counters['hits']
+            return {**self.counters, 'entries': len(self.questions),
+                    'hit_rate': hits / lookups if lookups else 0.0,
+                    'risky_hit_rate':
+                        self.counters['risky_hits'] / hits if hits else 0.0}
+
+
+_semantic_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Return the semantic cache of the process or None when disabled."""
+    global _semantic_cache
+    if cfg.SEMANTIC_CACHE and _semantic_cache is None:
+        _semantic_cache = SemanticCache(cfg.SEMANTIC_CACHE_THRESHOLD,
+                                        cfg.SEMANTIC_CACHE_SIZE,
+                                        cfg.SEMANTIC_CACHE_TTL_SEC,
+                                        cfg.SEMANTIC_CACHE_RISK_MARGIN)
+    return _semantic_cache
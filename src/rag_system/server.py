@@ -0,0 +1,238 @@
+"""Share the startup lifecycle and health endpoints of the fastapi apps."""
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import logging
+import timeit
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+import box
+from fastapi import APIRouter, Depends, FastAPI, Form, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+import yaml
+
+from rag_system.answer_cache import get_answer_cache
+from rag_system.answer_catalogue import get_answer_catalogue
+from rag_system.embedders import query_embedding_stats
+from rag_system.inference import run_pipeline_batch
+from rag_system.ingest import load_data_into_store
+from rag_system.micro_batcher import enable_micro_batching
+from rag_system.micro_batcher import micro_batching_stats
+from rag_system.pipeline_executor import get_pipeline_executor
+from rag_system.rag_pipelines import select_rag_pipeline
+from rag_system.responds import single_flight_counters
+from rag_system.semantic_cache import get_semantic_cache
+from rag_system.streaming import answer_with_events
+from rag_system.warmup import build_catalogue
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+router = APIRouter()
+
+
+class RagState:
+    """Hold the document store and rag pipeline shared across requests."""
+
+    def __init__(self):
+        self.doc_store = None
+        self.rag_pipeline = None
+        self.ready = False
+        self.error = None
+        self.timings: Dict[str, float] = {}
+
+    def _timed(self, phase: str, func: Callable, *args):
+        """Run one startup phase and record its duration in seconds."""
+        start = timeit.default_timer()
+        result = func(*args)
+        self.timings[phase] = timeit.default_timer() - start
+        logger.info(f"Startup phase {phase}: {self.timings[phase]:.2f}s")
+        return result
+
+    def build(self) -> None:
+        """Build the store and pipeline once and warm up their models."""
+        start = timeit.default_timer()
+        try:
+            self.doc_store = self._timed('load_data_into_store',
+                                         load_data_into_store)
+            self.rag_pipeline = self._timed('select_rag_pipeline',
+                                            select_rag_pipeline,
+                                            self.doc_store)
+            self._timed('warm_up', self.rag_pipeline.warm_up)
+            if cfg.WARMUP_CATALOGUE and cfg.WARMUP_ON_START:
+                self._timed('build_catalogue', build_catalogue,
+                            self.doc_store, self.rag_pipeline)
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Startup of the rag system failed: {e}")
+            return
+        self.timings['total'] = timeit.default_timer() - start
+        self.ready = True
+        logger.info(f"Rag system ready in {self.timings['total']:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the rag state in the background while the server starts."""
+    logging.basicConfig(level=logging.INFO)
+    app.state.rag = RagState()
+    # Concurrent requests share the forward passes of embedder and reranker
+    enable_micro_batching(cfg.MICRO_BATCH)
+    if cfg.MICRO_BATCH and \
+            cfg.PIPELINE_MAX_IN_FLIGHT < cfg.MICRO_BATCH_MAX_SIZE:
+        logger.warning(f"Micro batches are capped at "
+                       f"PIPELINE_MAX_IN_FLIGHT={cfg.PIPELINE_MAX_IN_FLIGHT}"
+                       f" concurrent runs, below MICRO_BATCH_MAX_SIZE="
+                       f"{cfg.MICRO_BATCH_MAX_SIZE}")
+    # Build off the event loop so that liveness answers during warm-up
+    startup = asyncio.create_task(asyncio.to_thread(app.state.rag.build))
+    yield
+    if not startup.done():
+        logger.warning("Server stopped before the rag system was ready.")
+
+
+def get_rag_state(request: Request) -> RagState:
+    """Return the warmed-up rag state or reject the request with 503."""
+    state = request.app.state.rag
+    if not state.ready:
+        raise HTTPException(status_code=503,
+                            detail=state.error or "Rag system is warming up")
+    return state
+
+
+@router.get("/health/live")
+async def liveness() -> Dict[str, str]:
+    """Report that the server process is running."""
+    return {"status": "alive"}
+
+
+@router.get("/health/ready")
+async def readiness(request: Request) -> Dict[str, str | Dict[str, float]]:
+    """Report ready only after the store and models are warmed up."""
+    state = get_rag_state(request)
+    return {"status": "ready", "startup_timings": state.timings}
+
+
+@router.get("/metrics")
+async def metrics() -> Dict[str, Dict[str, float]]:
+    """Report the counters of the caches and layers before the pipeline."""
+    answer_cache = get_answer_cache()
+    semantic_cache = get_semantic_cache()
+    catalogue = get_answer_catalogue()
+    return {"answer_catalogue": catalogue.stats() if catalogue else {},
+            "answer_cache": answer_cache.stats() if answer_cache else {},
+            "semantic_cache":
+                semantic_cache.stats() if semantic_cache else {},
+            "query_embeddings": query_embedding_stats(),
+            "single_flight": single_flight_counters,
+            "micro_batching": micro_batching_stats(),
+            "pipeline_executor": get_pipeline_executor().stats()}
+
+
+async def executor_events(func: Callable, *args)\
+        -> AsyncIterator[Tuple[str, Any]]:
+    """Run func(*args, sink) on the pipeline executor, yield its events."""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def sink(event: str, data: Any) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def produce() -> None:
+        try:
+            await get_pipeline_executor().run(func, *args, sink)
+        except HTTPException as e:
+            events.put_nowait(('error', e.detail))
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+    finally:
+        if not task.done():
+            # The client went away, let the run finish on its own
+            task.add_done_callback(lambda done: done.exception())
+
+
+async def answer_events(question: str,
+                        state: RagState) -> AsyncIterator[str]:
+    """Format the events of a streamed pipeline run as sse."""
+    async for name, data in executor_events(answer_with_events, question,
+                                            state.rag_pipeline):
+        yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/get_answer/stream")
+async def get_answer_stream(question: str = Form(...),
+                            state: RagState = Depends(get_rag_state))\
+        -> StreamingResponse:
+    """Stream document ids, then llm tokens, then the answer as sse."""
+    if not question:
+        raise HTTPException(status_code=404)
+    get_pipeline_executor().check_capacity()
+    return StreamingResponse(answer_events(question, state),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+class BulkQuestions(BaseModel):
+    """Questions of a bulk request, ndjson - stream results as they come."""
+
+    questions: List[str]
+    ndjson: bool = False
+
+
+def result_payload(index: int, question: str,
+                   result: Tuple[str, List[str]] | Exception)\
+        -> Dict[str, Any]:
+    """Describe the answer or the error of one bulk question."""
+    payload = {"index": index, "question": question}
+    if isinstance(result, Exception):
+        payload["error"] = str(result)
+    else:
+        payload["answer"], payload["relevant_documents"] = result
+    return payload
+
+
+def answer_batch_with_events(questions: List[str], rag_pipeline,
+                             sink: Callable[[str, Any], None]) -> None:
+    """Answer the bulk questions, sending every result when it is ready."""
+    run_pipeline_batch(
+        questions, rag_pipeline,
+        on_result=lambda index, result: sink(
+            'result', result_payload(index, questions[index], result)))
+
+
+async def bulk_ndjson(questions: List[str],
+                      state: RagState) -> AsyncIterator[str]:
+    """Format the bulk results as ndjson lines in completion order."""
+    async for name, data in executor_events(answer_batch_with_events,
+                                            questions, state.rag_pipeline):
+        yield json.dumps(data if name == 'result' else {"error": data}) \
+            + "\n"
+
+
+@router.post("/get_answers", response_model=None)
+async def get_answers(bulk: BulkQuestions,
+                      state: RagState = Depends(get_rag_state))\
+        -> Dict[str, List[Dict[str, Any]]] | StreamingResponse:
+    """Answer many questions at once, in input order or as ndjson."""
+    if len(bulk.questions) > cfg.BULK_MAX_QUESTIONS:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {cfg.BULK_MAX_QUESTIONS} "
+                                   "questions per request")
+    executor = get_pipeline_executor()
+    if bulk.ndjson:
+        executor.check_capacity()
+        return StreamingResponse(bulk_ndjson(bulk.questions, state),
+                                 media_type="application/x-ndjson")
+    results = await executor.run(run_pipeline_batch, bulk.questions,
+                                 state.rag_pipeline)
+    return {"answers": [result_payload(index, question, result)
+                        for index, (question, result)
+                        in enumerate(zip(bulk.questions, results))]}
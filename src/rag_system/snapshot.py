@@ -0,0 +1,185 @@
+"""Save and restore snapshots of the in-memory document store."""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import box
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+import numpy as np
+import yaml
+
+logger = logging.getLogger('__main__')
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+# 2 - document ids from DOC_ID_KEYS or meta and content
+# 3 - unit length embedding rows and their norms
+SNAPSHOT_FORMAT = 3
+MANIFEST_FILE = 'manifest.json'
+DOCUMENTS_FILE = 'documents.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+NORMS_FILE = 'norms.npy'
+
+
+def corpus_version(docs: List[Document]) -> str:
+    """Hash the ids and content hashes of the documents of a corpus."""
+    return content_hashes_version({doc.id: doc.meta.get('content_hash')
+                                   for doc in docs})
+
+
+def content_hashes_version(content_hashes: Dict[str, Optional[str]]) -> str:
+    """Hash a mapping of document ids to content hashes."""
+    digest = hashlib.sha256()
+    for key in sorted(f"{doc_id}:{content_hash or ''}"
+                      for doc_id, content_hash in content_hashes.items()):
+        digest.update(key.encode('utf8'))
+    return digest.hexdigest()
+
+
+def snapshot_config(with_embeddings: bool) -> Dict[str, str | int | None]:
+    """Describe the configuration a snapshot has to be built with."""
+    return {'format': SNAPSHOT_FORMAT,
+            'dataset': cfg.DATA_SET,
+            'doc_id_keys': list(cfg.DOC_ID_KEYS),
+            'embeddings': cfg.EMBEDDINGS if with_embeddings else None,
+            'embeddings_revision':
+                cfg.EMBEDDINGS_REVISION if with_embeddings else None}
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """Read the manifest of the snapshot or None if there is no snapshot."""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r',
+                  encoding='utf8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_staleness(path: str, with_embeddings: bool,
+                       docs: Optional[List[Document]] = None)\
+        -> Optional[str]:
+    """Return why the snapshot cannot be used, or None if it is fresh.
+
+    Without docs only the configuration is compared; with the documents of
+    the current corpus their version is compared as well.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return f"no snapshot at {path}"
+    for key, value in snapshot_config(with_embeddings).items():
+        if manifest.get(key) != value:
+            return f"{key} changed from {manifest.get(key)} to {value}"
+    if docs is not None and manifest['corpus_version'] != \
+            corpus_version(docs):
+        return "the corpus changed since the snapshot was built"
+    return None
+
+
+def save_snapshot(doc_store: InMemoryDocumentStore, path: str,
+                  with_embeddings: bool = True) -> Dict:
+    """Write documents as json and their embeddings as one float32 matrix.
+
+    The rows are stored normalized, as the matrix retriever searches them,
+    next to their norms which restore the original embeddings.
+    """
+    docs = doc_store.filter_documents()
+    tmp_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    with open(os.path.join(tmp_path, DOCUMENTS_FILE), 'w',
+              encoding='utf8') as docs_file:
+        json.dump([{'id': doc.id, 'content': doc.content, 'meta': doc.meta}
+                   for doc in docs], docs_file, separators=(',', ':'))
+    if with_embeddings:
+        embeddings = np.asarray([doc.embedding for doc in docs],
+                                dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1)
+        norms[norms == 0] = 1.0
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE),
+                embeddings / norms[:, None])
+        np.save(os.path.join(tmp_path, NORMS_FILE), norms)
+
+    manifest = {**snapshot_config(with_embeddings),
+                'num_docs': len(docs),
+                'corpus_version': corpus_version(docs),
+                'created': time.time()}
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w',
+              encoding='utf8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    # Swap directories so that readers never see a half written snapshot
+    old_path = path.rstrip('/') + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    logger.info(f"Saved snapshot of {len(docs)} documents to {path}")
+    return manifest
+
+
+def load_snapshot_embeddings(path: str) -> Optional[np.ndarray]:
+    """Map the normalized embedding matrix of the snapshot read-only.
+
+    Processes mapping the same snapshot share its pages.
+    """
+    embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+    if not os.path.exists(embeddings_path):
+        return None
+    return np.load(embeddings_path, mmap_mode='r')
+
+
+def load_snapshot(path: str, copy_embeddings: bool = False,
+                  index_bm25: bool = True) -> InMemoryDocumentStore:
+    """Build an in-memory store from the documents of the snapshot.
+
+    The documents get no embeddings, the matrix retriever maps them with
+    attached_embeddings(); copy_embeddings gives every document its
+    embedding as a list, for retrievers reading them from the store.
+    Without index_bm25 the documents are stored without the bm25
+    statistics of the store, for pipelines searching a BM25Index.
+    """
+    with open(os.path.join(path, DOCUMENTS_FILE), 'r',
+              encoding='utf8') as docs_file:
+        rows = json.load(docs_file)
+    embeddings = load_snapshot_embeddings(path)
+    norms = None
+    if copy_embeddings and embeddings is not None:
+        norms = np.load(os.path.join(path, NORMS_FILE))
+    docs = [Document(id=row['id'], content=row['content'], meta=row['meta'],
+                     embedding=None if norms is None
+                     else (embeddings[i] * norms[i]).tolist())
+            for i, row in enumerate(rows)]
+    doc_store = InMemoryDocumentStore()
+    if index_bm25:
+        doc_store.write_documents(docs)
+    else:
+        doc_store.storage.update((doc.id, doc) for doc in docs)
+    logger.info(f"Loaded snapshot of {len(docs)} documents from {path}")
+    return doc_store
+
+
+def attached_embeddings(doc_store: InMemoryDocumentStore,
+                        path: str = cfg.SNAPSHOT_PATH)\
+        -> Optional[np.ndarray]:
+    """Return the mapped matrix of a store loaded without its embeddings.
+
+    Row i belongs to the i-th document of the store; None if the store
+    holds its own embeddings or was not loaded from the snapshot.
+    """
+    manifest = read_manifest(path)
+    if not cfg.SNAPSHOT or manifest is None or not manifest['embeddings'] \
+            or manifest['num_docs'] != doc_store.count_documents():
+        return None
+    if any(doc.embedding is not None
+           for doc in doc_store.filter_documents()):
+        return None
+    return load_snapshot_embeddings(path)
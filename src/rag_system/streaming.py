@@ -0,0 +1,86 @@
+"""Stream retrieved documents and llm tokens of a pipeline run as events."""
+import logging
+import queue
+import threading
+import timeit
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from haystack import component, Document, Pipeline
+from haystack.dataclasses import StreamingChunk
+
+from rag_system.inference import run_pipeline
+
+logger = logging.getLogger('__main__')
+
+# Event sink of the pipeline run of the current thread
+_local = threading.local()
+
+
+def emit(event: str, data: Any) -> None:
+    """Send an event to the sink of the current thread, if it has one."""
+    sink: Optional[Callable] = getattr(_local, 'sink', None)
+    if sink is not None:
+        sink(event, data)
+
+
+def stream_callback(chunk: StreamingChunk) -> None:
+    """Forward the generated tokens of the llm as 'token' events."""
+    if chunk.content:
+        emit('token', chunk.content)
+
+
+@component
+class DocumentsTap:
+    """Pass documents through, emitting their ids once retrieval is done."""
+
+    @component.output_types(documents=List[Document])
+    def run(self, documents: List[Document]):
+        """Emit the ids and scores of the documents and return them."""
+        emit('documents', [{"id": doc.id, "score": doc.score}
+                           for doc in documents])
+        return {"documents": documents}
+
+
+def answer_with_events(query: str, rag_pipeline: Pipeline,
+                       sink: Callable[[str, Any], None]) -> None:
+    """Run the pipeline and send its events to sink, logging ttfb/ttft.
+
+    Events: 'documents' (ids and scores after retrieval), 'token' (every
+    generated chunk), then 'answer' (answer and document contents) or
+    'error'. A cached answer comes as a single 'answer' event.
+    """
+    start = timeit.default_timer()
+    first = {}
+
+    def timed_sink(event: str, data: Any) -> None:
+        for mark, matches in (('ttfb', True), ('ttft', event == 'token')):
+            if matches and mark not in first:
+                first[mark] = timeit.default_timer() - start
+                logger.info(f"Streaming {mark} {first[mark] * 1000:.0f}ms")
+        sink(event, data)
+
+    _local.sink = timed_sink
+    try:
+        answer, documents = run_pipeline(query, rag_pipeline)
+        timed_sink('answer', {"answer": answer,
+                              "relevant_documents": documents})
+    except Exception as e:
+        logger.error(f"Streaming pipeline run failed: {e}")
+        timed_sink('error', str(e))
+    finally:
+        _local.sink = None
+
+
+def stream_answer(query: str, rag_pipeline: Pipeline)\
+        -> Iterator[Tuple[str, Any]]:
+    """Yield the (event, data) pairs of a pipeline run as they happen."""
+    events: queue.Queue = queue.Queue()
+
+    def produce() -> None:
+        answer_with_events(query, rag_pipeline,
+                           lambda event, data: events.put((event, data)))
+        events.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (event := events.get()) is not None:
+        yield event
@@ -0,0 +1,142 @@
+"""Run ingestion as overlapping stages connected by bounded queues."""
+import logging
+import queue
+import threading
+import timeit
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger('__main__')
+
+# Marks the end of the stream in a stage queue
+_DONE = object()
+
+
+class StageStats:
+    """Count the documents and busy time of one ingestion stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = 0
+        self.busy = 0.0
+        self.error = None
+
+    def __str__(self) -> str:
+        rate = self.docs / self.busy if self.busy else 0.0
+        return f"{self.name}: {self.docs} docs, {rate:.1f} docs/sec"
+
+
+def make_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Group a (possibly endless) iterable into lists of batch_size."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _put(out_queue: queue.Queue, item, stop: threading.Event) -> None:
+    """Block while the queue is full unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(in_queue: queue.Queue, stop: threading.Event):
+    """Block while the queue is empty unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return in_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _read(batches: Iterator[List], stats: StageStats,
+          out_queue: queue.Queue, stop: threading.Event) -> None:
+    """Pull batches from the source and feed them to the first stage."""
+    try:
+        while not stop.is_set():
+            start = timeit.default_timer()
+            batch = next(batches, _DONE)
+            if batch is _DONE:
+                break
+            stats.busy += timeit.default_timer() - start
+            stats.docs += len(batch)
+            _put(out_queue, batch, stop)
+    except Exception as e:
+        stats.error = e
+        stop.set()
+    finally:
+        _put(out_queue, _DONE, stop)
+
+
+def _work(func: Callable[[List], List], stats: StageStats,
+          in_queue: queue.Queue, out_queue: queue.Queue | None,
+          stop: threading.Event) -> None:
+    """Apply the stage function to every batch and pass the result on."""
+    try:
+        while True:
+            batch = _get(in_queue, stop)
+            if batch is _DONE:
+                break
+            start = timeit.default_timer()
+            batch = func(batch)
+            stats.busy += timeit.default_timer() - start
+            stats.docs += len(batch)
+            if out_queue is not None:
+                _put(out_queue, batch, stop)
+    except Exception as e:
+        stats.error = e
+        stop.set()
+    finally:
+        if out_queue is not None:
+            _put(out_queue, _DONE, stop)
+
+
+def run_streaming_pipeline(items: Iterable,
+                           stages: List[Tuple[str, Callable[[List], List]]],
+                           batch_size: int = 64, queue_size: int = 4,
+                           log_interval: float = 10.0)\
+        -> Dict[str, StageStats]:
+    """Stream items through the stages, each one running in its own thread.
+
+    Every stage is connected to the next one by a queue holding at most
+    queue_size batches, so a slow stage blocks the stages before it and
+    memory stays bounded by the number of batches in flight.
+    """
+    stop = threading.Event()
+    stats = [StageStats('read')] + [StageStats(name) for name, _ in stages]
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = [threading.Thread(target=_read, daemon=True,
+                                args=(make_batches(items, batch_size),
+                                      stats[0], queues[0], stop))]
+    for i, (_, func) in enumerate(stages):
+        out_queue = queues[i + 1] if i + 1 < len(queues) else None
+        threads.append(threading.Thread(target=_work, daemon=True,
+                                        args=(func, stats[i + 1], queues[i],
+                                              out_queue, stop)))
+
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        threads[-1].join(timeout=log_interval)
+        depths = ", ".join(f"{name} queue {q.qsize()}/{queue_size}"
+                           for (name, _), q in zip(stages, queues))
+        logger.info(f"Streaming ingest: {'; '.join(map(str, stats))}; "
+                    f"{depths}")
+
+    for stage in stats:
+        if stage.error is not None:
+            raise RuntimeError(f"Stage {stage.name} of the streaming "
+                               f"ingestion failed") from stage.error
+    elapsed = timeit.default_timer() - start
+    logger.info(f"Streaming ingest finished: {stats[-1].docs} docs in "
+                f"{elapsed:.2f}s ({stats[-1].docs / elapsed:.1f} docs/sec)")
+    return {stage.name: stage for stage in stats}
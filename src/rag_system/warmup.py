@@ -0,0 +1,73 @@
+"""Precompute the answers of the question catalogue, at start or offline."""
+import argparse
+import logging
+import os
+
+import box
+from dotenv import find_dotenv, load_dotenv
+from haystack import Pipeline
+import yaml
+
+from rag_system.answer_cache import pipeline_fingerprint
+from rag_system.answer_catalogue import catalogue_path, get_answer_catalogue
+from rag_system.answer_catalogue import save_catalogue
+from rag_system.eval_runner import load_eval_questions, run_evaluation
+from rag_system.ingest import load_data_into_store, store_corpus_version
+from rag_system.rag_pipelines import select_rag_pipeline
+
+with open('rag_system/config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+logger = logging.getLogger('__main__')
+
+
+def build_catalogue(doc_store, rag_pipeline: Pipeline,
+                    faithfulness: bool = cfg.WARMUP_FAITHFULNESS,
+                    force: bool = False) -> str:
+    """Answer the catalogue questions unless the current version exists.
+
+    The answers, documents and faithfulness scores are written to the
+    catalogue file of the pipeline fingerprint; an interrupted warm-up
+    resumes from its checkpoint. Returns the path of the catalogue.
+    """
+    fingerprint = pipeline_fingerprint(store_corpus_version(doc_store))
+    path = catalogue_path(fingerprint)
+    if os.path.exists(path) and not force:
+        logger.info(f"Answer catalogue {path} is up to date")
+    else:
+        pairs = load_eval_questions(cfg.WARMUP_QUESTIONS,
+                                    question_field=cfg.EVAL_QUESTION_FIELD,
+                                    answer_field=cfg.EVAL_ANSWER_FIELD)
+        records, summary = run_evaluation(
+            pairs, rag_pipeline, doc_store, cfg.EVAL_CONCURRENCY,
+            path + '.partial.jsonl', not force, faithfulness)
+        logger.info(f"Answered the catalogue: {summary}")
+        save_catalogue(path, fingerprint, records)
+        os.remove(path + '.partial.jsonl')
+    catalogue = get_answer_catalogue()
+    if catalogue is not None:
+        catalogue.fingerprint = fingerprint
+        catalogue.reload()
+    return path
+
+
+def main():
+    """Build the answer catalogue of the configured corpus and pipeline."""
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(find_dotenv())
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--force', action='store_true',
+                        help='recompute an existing catalogue')
+    parser.add_argument('--no-faithfulness', action='store_true',
+                        help='skip the faithfulness scores')
+    args = parser.parse_args()
+
+    doc_store = load_data_into_store()
+    rag_pipeline = select_rag_pipeline(doc_store)
+    path = build_catalogue(doc_store, rag_pipeline,
+                           not args.no_faithfulness, args.force)
+    print(f"Answer catalogue: {path}")
+
+
+if __name__ == "__main__":
+    main()
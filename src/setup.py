@@ -96,7 +96,8 @@ setup(
     entry_points={
         'console_scripts': [
             'start-rag-system=rag_system.app_fastapi:run',  # Entry point
-            'start-streamlit-app=rag_system.run_app_streamlit:main'
+            'start-streamlit-app=rag_system.run_app_streamlit:main',
+            'build-rag-snapshot=rag_system.build_snapshot:main'
         ]
     },
 )
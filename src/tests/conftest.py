@@ -0,0 +1,7 @@
+"""Run the tests from src, where the modules read rag_system/config.yml."""
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(SRC_DIR)
+sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,66 @@
+"""Test the ivf approximate nearest-neighbour index."""
+import numpy as np
+
+from rag_system.ann_index import IVFIndex
+from rag_system.matrix_retriever import normalize_rows
+
+
+def clustered_vectors(num_docs: int = 400, dim: int = 16, seed: int = 0):
+    """Draw normalized vectors around a few well separated centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(8, dim))
+    vectors = centers[rng.integers(0, 8, num_docs)] \
+        + 0.05 * rng.normal(size=(num_docs, dim))
+    return normalize_rows(vectors.astype(np.float32))
+
+
+def test_search_finds_the_exact_neighbours_of_clustered_data():
+    vectors = clustered_vectors()
+    ids = [str(i) for i in range(len(vectors))]
+    index = IVFIndex.train(vectors, nlist=8, nprobe=2)
+    assert index.bind(ids, vectors) == len(ids)
+
+    queries = vectors[:20]
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+    for (rows, scores), truth in zip(index.search(queries, 5), exact):
+        assert set(rows.tolist()) == set(truth.tolist())
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_save_load_keeps_the_cells(tmp_path):
+    vectors = clustered_vectors()
+    ids = [str(i) for i in range(len(vectors))]
+    index = IVFIndex.train(vectors, nlist=8)
+    index.add(ids, vectors)
+    index.save(str(tmp_path))
+
+    loaded = IVFIndex.load(str(tmp_path), nprobe=3)
+    assert loaded.nprobe == 3
+    assert loaded.cells == index.cells
+    assert np.allclose(loaded.centroids, index.centroids)
+    assert IVFIndex.load(str(tmp_path / 'missing')) is None
+
+
+def test_bind_inserts_new_and_skips_removed_documents():
+    vectors = clustered_vectors()
+    ids = [str(i) for i in range(len(vectors))]
+    index = IVFIndex.train(vectors, nlist=8, nprobe=8)
+    index.add(ids[:300], vectors[:300])
+    index.remove(ids[:10])
+    assert '0' not in index.cells
+
+    # Rebinding to the current rows inserts the unknown documents
+    assert index.bind(ids[10:], vectors[10:]) == 100
+    rows, _ = index.search(vectors[350], 1)[0]
+    assert rows.tolist() == [340]
+
+
+def test_inserted_documents_are_counted_since_training(tmp_path):
+    vectors = clustered_vectors()
+    ids = [str(i) for i in range(len(vectors))]
+    index = IVFIndex.train(vectors[:300], nlist=8, ids=ids[:300])
+    assert len(index.cells) == 300 and index.inserted == 0
+    index.add(ids[300:], vectors[300:])
+    assert index.inserted == 100
+    index.save(str(tmp_path))
+    assert IVFIndex.load(str(tmp_path)).inserted == 100
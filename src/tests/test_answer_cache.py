@@ -0,0 +1,62 @@
+"""Test the exact-match answer cache."""
+from rag_system.answer_cache import AnswerCache, cfg, pipeline_fingerprint
+
+ANSWER = ('In Giza.', ['The Great Pyramid of Giza'])
+
+
+def test_get_normalizes_the_question():
+    cache = AnswerCache()
+    assert cache.get('Where is the pyramid?') is None
+    cache.put('Where is the pyramid?', ANSWER)
+    assert cache.get('  where IS the   pyramid? ') == ANSWER
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_lru_eviction_and_ttl():
+    cache = AnswerCache(max_entries=2)
+    cache.put('one', ANSWER)
+    cache.put('two', ANSWER)
+    cache.get('one')
+    cache.put('three', ANSWER)
+    assert cache.get('two') is None
+    assert cache.get('one') == ANSWER
+    assert cache.stats()['evictions'] == 1
+
+    expiring = AnswerCache(ttl=-1)
+    expiring.put('one', ANSWER)
+    assert expiring.get('one') is None
+    assert expiring.stats()['expired'] == 1
+
+
+def test_sqlite_backend_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'answers.db')
+    AnswerCache(path=path).put('where is the pyramid?', ANSWER)
+    restarted = AnswerCache(path=path)
+    assert restarted.get('Where is the pyramid?') == ANSWER
+    assert restarted.stats()['disk_hits'] == 1
+    assert restarted.get('Where is the pyramid?') == ANSWER
+    assert restarted.stats()['hits'] == 1
+
+
+def test_a_new_corpus_version_invalidates_the_answers(tmp_path):
+    path = str(tmp_path / 'answers.db')
+    cache = AnswerCache(path=path)
+    cache.put('where is the pyramid?', ANSWER)
+    cache.set_corpus_version('v2')
+    assert cache.get('where is the pyramid?') is None
+    assert AnswerCache(path=path).get('where is the pyramid?') is None
+    rows = cache.db.execute('SELECT COUNT(*) FROM answers').fetchone()
+    assert rows == (0,)
+
+
+def test_fingerprint_covers_the_settings(monkeypatch):
+    base = pipeline_fingerprint()
+    assert pipeline_fingerprint() == base
+    assert pipeline_fingerprint('v2') != base
+    for key, value in (('HYBRID_FUSION', 'weighted'), ('BM25_K1', 1.2),
+                       ('QUANTIZATION', 'int8'), ('LLM_MODEL', 'other')):
+        monkeypatch.setitem(cfg, key, value)
+        assert pipeline_fingerprint() != base
+        monkeypatch.undo()
+    assert pipeline_fingerprint() == base
@@ -0,0 +1,106 @@
+"""Test the persistent bm25 inverted index."""
+from haystack import Document
+import numpy as np
+
+from rag_system.bm25_index import BM25Index, tokenize
+
+DOCS = [Document(id='pyramid', content='The Great Pyramid of Giza in Egypt',
+                 meta={'content_hash': 'a'}),
+        Document(id='gardens', content='The Hanging Gardens of Babylon',
+                 meta={'content_hash': 'b'}),
+        Document(id='lighthouse',
+                 content='The Lighthouse of Alexandria in Egypt, the Pharos',
+                 meta={'content_hash': 'c'}),
+        Document(id='colossus', content='The Colossus of Rhodes',
+                 meta={'content_hash': 'd'})]
+
+
+def okapi_scores(docs, query, k1=1.5, b=0.75):
+    """Score every document with the textbook bm25 formula."""
+    tokens = [tokenize(doc.content) for doc in docs]
+    avg_len = np.mean([len(doc_tokens) for doc_tokens in tokens])
+    scores = {}
+    for doc, doc_tokens in zip(docs, tokens):
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in tokens)
+            tf = doc_tokens.count(term)
+            idf = np.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (
+                tf + k1 * (1 - b + b * len(doc_tokens) / avg_len))
+        scores[doc.id] = score
+    return scores
+
+
+def assert_same_ranking(index, docs, query):
+    """Compare the index with scores computed from scratch."""
+    expected = {doc_id: score
+                for doc_id, score in okapi_scores(docs, query).items()
+                if score > 0}
+    doc_ids, scores = index.search(query, len(docs))
+    assert set(doc_ids) == set(expected)
+    assert np.allclose(scores, [expected[doc_id] for doc_id in doc_ids])
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_search_matches_okapi_bm25():
+    index = BM25Index()
+    index.add(DOCS)
+    assert len(index) == 4
+    assert index.search('egypt pharos', 2)[0] == ['lighthouse', 'pyramid']
+    assert_same_ranking(index, DOCS, 'egypt pharos')
+    assert index.search('unknown words', 5)[0] == []
+
+
+def test_incremental_updates_match_a_rebuilt_index():
+    index = BM25Index()
+    index.add(DOCS[:3])
+    edited = Document(id='gardens', content='The Gardens of Babylon, Iraq',
+                      meta={'content_hash': 'e'})
+    index.remove(['pyramid', 'gardens'])
+    index.add([edited, DOCS[3]])
+    current = [edited, DOCS[2], DOCS[3]]
+
+    rebuilt = BM25Index()
+    rebuilt.add(current)
+    assert len(index) == len(rebuilt)
+    assert index.total_len == rebuilt.total_len
+    for term, term_id in rebuilt.vocab.items():
+        assert index.df[index.vocab[term]] == rebuilt.df[term_id]
+    assert 'pyramid' not in index
+    assert index.content_hash('gardens') == 'e'
+    for query in ('egypt', 'gardens babylon', 'the colossus'):
+        assert_same_ranking(index, current, query)
+
+
+def test_save_load_round_trip(tmp_path):
+    index = BM25Index(k1=1.2, b=0.5)
+    index.add(DOCS)
+    index.remove(['colossus'])
+    index.save(str(tmp_path))
+
+    loaded = BM25Index.load(str(tmp_path))
+    assert (loaded.k1, loaded.b) == (1.2, 0.5)
+    assert loaded.doc_ids == ['pyramid', 'gardens', 'lighthouse']
+    assert loaded.total_len == index.total_len
+    assert np.array_equal(loaded.df, index.df)
+    for query in ('egypt', 'hanging gardens', 'colossus rhodes'):
+        doc_ids, scores = index.search(query, 3)
+        loaded_ids, loaded_scores = loaded.search(query, 3)
+        assert loaded_ids == doc_ids
+        assert np.allclose(loaded_scores, scores)
+    assert BM25Index.load(str(tmp_path / 'missing')) is None
+
+
+def test_compact_keeps_the_scores():
+    index = BM25Index()
+    index.add(DOCS[:2])
+    index.compact()
+    index.add(DOCS[2:])
+    index.remove(['gardens'])
+    before = index.search('the egypt', 4)
+    index.compact()
+    after = index.search('the egypt', 4)
+    assert after[0] == before[0]
+    assert np.allclose(after[1], before[1])
+    assert not index.delta and index.alive.all()
@@ -0,0 +1,79 @@
+"""Test the on-disk embedding cache of the ingestion."""
+import numpy as np
+
+from rag_system.embedding_cache import EmbeddingCache, embedding_key
+
+
+def test_key_ignores_whitespace_but_not_model_or_revision():
+    key = embedding_key('model', 'main', 'the  colossus\nof rhodes')
+    assert key == embedding_key('model', 'main', 'the colossus of rhodes')
+    assert key != embedding_key('model', 'v2', 'the colossus of rhodes')
+    assert key != embedding_key('other', 'main', 'the colossus of rhodes')
+
+
+def test_put_flush_and_reload(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'model')
+    assert cache.get('pharos') is None
+    cache.put('pharos', [0.1, 0.2, 0.3])
+    assert np.allclose(cache.get('pharos'), [0.1, 0.2, 0.3])
+    cache.flush()
+
+    reloaded = EmbeddingCache(str(tmp_path), 'model')
+    assert len(reloaded) == 1
+    assert np.allclose(reloaded.get('pharos'), [0.1, 0.2, 0.3])
+    assert reloaded.hits == 1
+    assert EmbeddingCache(str(tmp_path), 'model', 'v2').get('pharos') is None
+
+
+def test_flush_merges_with_earlier_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'model')
+    cache.put('pharos', [1.0, 0.0])
+    cache.flush()
+    mapped = EmbeddingCache(str(tmp_path), 'model')
+    cache.put('mausoleum', [0.0, 1.0])
+    cache.flush()
+
+    reloaded = EmbeddingCache(str(tmp_path), 'model')
+    assert len(reloaded) == 2
+    assert np.allclose(reloaded.get('pharos'), [1.0, 0.0])
+    assert np.allclose(reloaded.get('mausoleum'), [0.0, 1.0])
+    # A reader of the previous matrix keeps working after the switch
+    assert np.allclose(mapped.get('pharos'), [1.0, 0.0])
+    cache.put('colossus', [1.0, 1.0])
+    cache.flush()
+    # Only the current and the previous matrix are kept
+    assert len(list(tmp_path.glob('*/vectors-*.npy'))) == 2
+
+
+def test_flush_evicts_least_recently_used(tmp_path):
+    # Room for two rows of two float32 dimensions
+    cache = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    cache.put('pharos', [1.0, 0.0])
+    cache.put('mausoleum', [0.0, 1.0])
+    cache.put('colossus', [1.0, 1.0])
+    cache.get('pharos')
+    cache.flush()
+
+    reloaded = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    assert len(reloaded) == 2
+    assert reloaded.get('pharos') is not None
+    assert reloaded.get('mausoleum') is None
+
+
+def test_hits_persist_the_access_times(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    cache.put('pharos', [1.0, 0.0])
+    cache.put('mausoleum', [0.0, 1.0])
+    cache.flush()
+
+    # A run that only hits the cache still records the access
+    hit_only = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    hit_only.get('pharos')
+    hit_only.flush()
+
+    cache = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    cache.put('colossus', [1.0, 1.0])
+    cache.flush()
+    reloaded = EmbeddingCache(str(tmp_path), 'model', max_bytes=16)
+    assert reloaded.get('pharos') is not None
+    assert reloaded.get('mausoleum') is None
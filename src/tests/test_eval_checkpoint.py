@@ -0,0 +1,83 @@
+"""Test the checkpoint and question loading of the evaluation runner."""
+import json
+
+import pytest
+
+pytest.importorskip('datasets')
+
+from rag_system.eval_runner import EvalCheckpoint, load_eval_questions  # noqa
+from rag_system.eval_runner import question_id  # noqa
+
+
+def record(question: str, **fields):
+    """Build the result record of a question."""
+    return {'id': question_id(question), 'question': question, **fields}
+
+
+def test_resume_skips_finished_questions(tmp_path):
+    path = str(tmp_path / 'run' / 'eval.jsonl')
+    checkpoint = EvalCheckpoint(path, 'fp1')
+    checkpoint.save(record('Where is the pyramid?', answer='Giza'))
+    checkpoint.save(record('How tall is it?', error='timeout'))
+    checkpoint.close()
+
+    resumed = EvalCheckpoint(path, 'fp1')
+    # Failed questions are asked again
+    assert set(resumed.done) == {question_id('where is the  PYRAMID?')}
+    assert resumed.done[question_id('Where is the pyramid?')]['answer'] \
+        == 'Giza'
+    resumed.close()
+
+
+def test_results_of_another_fingerprint_are_run_again(tmp_path):
+    path = str(tmp_path / 'eval.jsonl')
+    checkpoint = EvalCheckpoint(path, 'fp1')
+    checkpoint.save(record('Where is the pyramid?', answer='Giza'))
+    checkpoint.close()
+    checkpoint = EvalCheckpoint(path, 'fp2')
+    assert checkpoint.done == {}
+    checkpoint.close()
+
+
+def test_fresh_run_discards_the_checkpoint(tmp_path):
+    path = str(tmp_path / 'eval.jsonl')
+    checkpoint = EvalCheckpoint(path, 'fp1')
+    checkpoint.save(record('Where is the pyramid?', answer='Giza'))
+    checkpoint.close()
+    EvalCheckpoint(path, 'fp1', resume=False).close()
+    checkpoint = EvalCheckpoint(path, 'fp1')
+    assert checkpoint.done == {}
+    checkpoint.close()
+
+
+def test_truncated_last_line_of_a_crash_is_skipped(tmp_path):
+    path = tmp_path / 'eval.jsonl'
+    finished = {**record('Where is the pyramid?', answer='Giza'),
+                'fingerprint': 'fp1'}
+    path.write_text(json.dumps(finished) + '\n{"id": "cut', encoding='utf8')
+
+    checkpoint = EvalCheckpoint(str(path), 'fp1')
+    assert list(checkpoint.done) == [finished['id']]
+    checkpoint.save(record('How tall is it?', answer='146 m'))
+    checkpoint.close()
+
+    lines = path.read_text(encoding='utf8').splitlines()
+    assert lines[1] == '{"id": "cut'
+    assert json.loads(lines[2])['answer'] == '146 m'
+    checkpoint = EvalCheckpoint(str(path), 'fp1')
+    assert len(checkpoint.done) == 2
+    checkpoint.close()
+
+
+def test_load_questions_from_files(tmp_path):
+    jsonl = tmp_path / 'questions.jsonl'
+    jsonl.write_text('{"q": "Where?", "a": "Giza"}\n\n{"q": "When?"}\n',
+                     encoding='utf8')
+    assert load_eval_questions(str(jsonl), question_field='q',
+                               answer_field='a') == \
+        [('Where?', 'Giza'), ('When?', '')]
+
+    csv_file = tmp_path / 'questions.csv'
+    csv_file.write_text('question,answer\nWhere?,Giza\nWhen?,2560 BC\n',
+                        encoding='utf8')
+    assert load_eval_questions(str(csv_file), limit=1) == [('Where?', 'Giza')]
@@ -0,0 +1,55 @@
+"""Test the fusion of the dense and bm25 branches."""
+from haystack import Document
+import pytest
+
+# Needs the haystack release with the sentence transformers embedders
+hybrid_retriever = pytest.importorskip('rag_system.hybrid_retriever',
+                                       exc_type=ImportError)
+fuse_documents = hybrid_retriever.fuse_documents
+RRF_K = hybrid_retriever.RRF_K
+
+DENSE = [Document(id='a', content='a', score=0.9),
+         Document(id='b', content='b', score=0.8),
+         Document(id='c', content='c', score=0.2)]
+SPARSE = [Document(id='c', content='c', score=12.0),
+          Document(id='d', content='d', score=3.0)]
+
+
+def test_reciprocal_rank_fusion_sums_weighted_ranks():
+    fused = fuse_documents([DENSE, SPARSE], 'reciprocal_rank_fusion',
+                           [0.5, 0.5])
+    scores = {doc.id: doc.score for doc in fused}
+    assert fused[0].id == 'c'
+    assert scores['c'] == pytest.approx(0.5 / (RRF_K + 3)
+                                        + 0.5 / (RRF_K + 1))
+    assert scores['d'] == pytest.approx(0.5 / (RRF_K + 2))
+    assert [doc.id for doc in fused] == ['c', 'a', 'b', 'd']
+
+
+def test_weighted_fusion_normalizes_every_branch():
+    fused = fuse_documents([DENSE, SPARSE], 'weighted', [0.5, 0.5])
+    scores = {doc.id: doc.score for doc in fused}
+    assert scores['a'] == pytest.approx(0.5)
+    assert scores['b'] == pytest.approx(0.5 * 0.6 / 0.7)
+    assert scores['c'] == pytest.approx(0.5)
+    assert scores['d'] == pytest.approx(0.0)
+    assert all(0 <= score <= 1 for score in scores.values())
+
+
+def test_concatenate_keeps_every_document_once_with_its_best_score():
+    fused = fuse_documents([DENSE, SPARSE], 'concatenate')
+    assert [(doc.id, doc.score) for doc in fused] == \
+        [('c', 12.0), ('d', 3.0), ('a', 0.9), ('b', 0.8)]
+
+
+def test_fusion_leaves_the_branch_documents_unchanged():
+    fuse_documents([DENSE, SPARSE], 'weighted')
+    assert [doc.score for doc in DENSE] == [0.9, 0.8, 0.2]
+
+
+def test_empty_branches_and_unknown_modes():
+    assert fuse_documents([[], []], 'weighted') == []
+    assert [doc.id for doc in fuse_documents([DENSE, []], 'weighted')] == \
+        ['a', 'b', 'c']
+    with pytest.raises(ValueError):
+        fuse_documents([DENSE, SPARSE], 'borda')
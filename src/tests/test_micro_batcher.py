@@ -0,0 +1,36 @@
+"""Test the micro batching of concurrent model calls."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag_system.micro_batcher import MicroBatcher
+
+
+def test_concurrent_items_share_batches():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items],
+                           max_batch_size=8, max_wait_ms=50)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(batcher.submit, range(8)))
+    assert results == [item * 2 for item in range(8)]
+    assert batcher.stats()['items'] == 8
+    assert batcher.stats()['batches'] < 8
+    assert batcher.submit_many([1, 2, 3]) == [2, 4, 6]
+
+
+def test_errors_reach_every_caller():
+    def fail(items):
+        raise ValueError('model failed')
+
+    batcher = MicroBatcher(fail)
+    with pytest.raises(ValueError):
+        batcher.submit(1)
+
+
+def test_missing_results_fail_instead_of_hanging():
+    batcher = MicroBatcher(lambda items: items[:1], max_wait_ms=50)
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher.submit_many, [1, 2])
+                   for _ in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
@@ -0,0 +1,51 @@
+"""Test the bounded pipeline executor of the fastapi apps."""
+import asyncio
+import threading
+
+from fastapi import HTTPException
+import pytest
+
+from rag_system.pipeline_executor import PipelineExecutor
+
+
+def test_runs_calls_and_counts_them():
+    async def scenario():
+        executor = PipelineExecutor(max_in_flight=2)
+        assert await executor.run(pow, 2, 10) == 1024
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(divmod, 1, 0)
+        return executor.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats['completed'], stats['failed']) == (1, 1)
+    assert stats['in_flight'] == 0
+
+
+def test_cancelled_request_keeps_its_slot_until_the_call_ends():
+    release = threading.Event()
+
+    async def scenario():
+        executor = PipelineExecutor(max_in_flight=1, max_queue=0,
+                                    queue_timeout=0.05)
+        request = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        await asyncio.sleep(0.01)
+        # The pipeline thread still runs, no second call may start
+        assert executor.in_flight == 1
+        with pytest.raises(HTTPException) as error:
+            await executor.run(pow, 2, 2)
+        assert error.value.status_code == 429
+
+        release.set()
+        for _ in range(100):
+            if executor.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.in_flight == 0
+        assert await executor.run(pow, 2, 2) == 4
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
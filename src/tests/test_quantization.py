@@ -0,0 +1,65 @@
+"""Test the int8 and binary codes of the embedding matrix."""
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+import numpy as np
+import pytest
+
+from rag_system.matrix_retriever import MatrixEmbeddingRetriever
+from rag_system.matrix_retriever import normalize_rows
+from rag_system.quantization import QuantizedMatrix
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(0)
+    return normalize_rows(rng.normal(size=(300, 64)).astype(np.float32))
+
+
+def test_int8_scores_approximate_the_float_scores(matrix):
+    codes = QuantizedMatrix(matrix, 'int8')
+    assert codes.codes.dtype == np.int8
+    assert codes.nbytes < matrix.nbytes / 3
+    queries = matrix[:10]
+    assert np.abs(codes.scores(queries) - queries @ matrix.T).max() < 0.02
+    assert np.array_equal(np.argmax(codes.scores(queries), axis=1),
+                          np.arange(10))
+
+
+def test_binary_scores_map_hamming_distance_to_cosine_range(matrix):
+    codes = QuantizedMatrix(matrix, 'binary')
+    assert codes.nbytes == matrix.nbytes // 32
+    scores = codes.scores(matrix[:10])
+    assert scores.shape == (10, len(matrix))
+    assert np.allclose(scores[np.arange(10), np.arange(10)], 1.0)
+    assert np.allclose(codes.scores(-matrix[:1])[0, 0], -1.0)
+    assert scores.min() >= -1 and scores.max() <= 1
+
+
+def test_scores_span_several_chunks(matrix, monkeypatch):
+    monkeypatch.setattr('rag_system.quantization.CHUNK_ROWS', 64)
+    for method in ('int8', 'binary'):
+        codes = QuantizedMatrix(matrix, method)
+        chunked = codes.scores(matrix[:3])
+        monkeypatch.setattr('rag_system.quantization.CHUNK_ROWS', 65536)
+        assert np.allclose(chunked, codes.scores(matrix[:3]))
+        monkeypatch.setattr('rag_system.quantization.CHUNK_ROWS', 64)
+
+
+def test_unknown_method_is_rejected(matrix):
+    with pytest.raises(ValueError):
+        QuantizedMatrix(matrix, 'pq')
+
+
+def test_quantized_retriever_leaves_the_store_embeddings(matrix):
+    doc_store = InMemoryDocumentStore()
+    doc_store.write_documents([Document(id=str(i), content=str(i),
+                                        embedding=row.tolist())
+                               for i, row in enumerate(matrix[:20])])
+    retriever = MatrixEmbeddingRetriever(doc_store, quantization='int8')
+    retriever.warm_up()
+    assert retriever.codes is not None
+    assert all(doc.embedding is not None
+               for doc in doc_store.filter_documents())
+    assert all(doc.embedding is None for doc in retriever.documents)
+    result = retriever.run(query_embedding=matrix[3].tolist(), top_k=1)
+    assert result["documents"][0].id == '3'
@@ -0,0 +1,49 @@
+"""Test the candidate pruning of the caching reranker."""
+from haystack import Document
+import pytest
+
+# Needs the haystack release with TransformersSimilarityRanker
+rerankers = pytest.importorskip('rag_system.rerankers',
+                                exc_type=ImportError)
+prune_candidates = rerankers.prune_candidates
+RRF_K = 60
+
+
+def scored(*scores):
+    """Build documents carrying the first-stage scores."""
+    return [Document(id=str(i), content=str(i), score=score)
+            for i, score in enumerate(scores)]
+
+
+def rrf(*ranks):
+    """Score a document found at the ranks of the branches."""
+    return sum(0.5 / (RRF_K + rank) for rank in ranks)
+
+
+def test_rrf_candidates_found_by_both_branches_stand_apart():
+    docs = scored(rrf(1, 2), rrf(2, 1), rrf(3, 4), rrf(4, 3), rrf(5, 6),
+                  rrf(6), rrf(6), rrf(7), rrf(7), rrf(8))
+    kept = prune_candidates(docs, 10, min_candidates=3, gap_factor=3)
+    assert [doc.id for doc in kept] == ['0', '1', '2', '3', '4']
+
+
+def test_pruning_ignores_the_score_scale():
+    docs = scored(0.9, 0.88, 0.86, 0.2, 0.19, 0.18)
+    scaled = scored(*(score * 1000 + 7 for score in
+                      (0.9, 0.88, 0.86, 0.2, 0.19, 0.18)))
+    for candidates in (docs, scaled):
+        kept = prune_candidates(candidates, 10, min_candidates=2,
+                                gap_factor=3)
+        assert [doc.id for doc in kept] == ['0', '1', '2']
+
+
+def test_min_candidates_cap_and_even_scores_are_kept():
+    # The large gap lies within the candidates that are always kept
+    docs = scored(0.9, 0.1, 0.09, 0.08)
+    assert len(prune_candidates(docs, 10, min_candidates=3,
+                                gap_factor=3)) == 4
+    assert len(prune_candidates(docs, 2)) == 2
+    even = scored(0.5, 0.4, 0.3, 0.2, 0.1)
+    assert len(prune_candidates(even, 10, min_candidates=1,
+                                gap_factor=3)) == 5
+    assert prune_candidates([], 10, gap_factor=3) == []
@@ -0,0 +1,60 @@
+"""Test the semantic answer cache."""
+import numpy as np
+
+from rag_system.semantic_cache import SemanticCache
+
+ANSWER = ('In Giza.', ['The Great Pyramid of Giza'])
+
+
+def rotated(angle: float):
+    """Return a unit vector at angle (radians) to the first axis."""
+    return [float(np.cos(angle)), float(np.sin(angle)), 0.0]
+
+
+def test_hit_needs_the_threshold_similarity():
+    cache = SemanticCache(threshold=0.9, risk_margin=0.02)
+    assert cache.get('where is the pyramid?', rotated(0)) is None
+    cache.put('where is the pyramid?', rotated(0), ANSWER)
+    # Unnormalized embeddings of the same direction match exactly
+    assert cache.get('pyramid location?', [5.0, 0.0, 0.0]) == ANSWER
+    assert cache.get('how tall is it?', rotated(np.arccos(0.85))) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+
+
+def test_risky_hits_and_near_misses_are_counted():
+    cache = SemanticCache(threshold=0.9, risk_margin=0.05)
+    cache.put('where is the pyramid?', rotated(0), ANSWER)
+    assert cache.get('close', rotated(np.arccos(0.92))) == ANSWER
+    assert cache.get('almost', rotated(np.arccos(0.88))) is None
+    stats = cache.stats()
+    assert stats['risky_hits'] == 1
+    assert stats['near_misses'] == 1
+    assert stats['risky_hit_rate'] == 1.0
+
+
+def test_full_cache_replaces_the_least_recently_used_row():
+    cache = SemanticCache(max_entries=2)
+    cache.put('x', [1.0, 0.0, 0.0], ('x', []))
+    cache.put('y', [0.0, 1.0, 0.0], ('y', []))
+    cache.get('x', [1.0, 0.0, 0.0])
+    cache.put('z', [0.0, 0.0, 1.0], ('z', []))
+    assert cache.get('y', [0.0, 1.0, 0.0]) is None
+    assert cache.get('x', [1.0, 0.0, 0.0]) == ('x', [])
+    assert cache.get('z', [0.0, 0.0, 1.0]) == ('z', [])
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expired_entries_are_not_served():
+    cache = SemanticCache(ttl=-1)
+    cache.put('x', [1.0, 0.0, 0.0], ANSWER)
+    assert cache.get('x', [1.0, 0.0, 0.0]) is None
+    assert cache.stats()['expired'] == 1
+
+
+def test_a_new_corpus_version_drops_the_entries():
+    cache = SemanticCache()
+    cache.put('x', [1.0, 0.0, 0.0], ANSWER)
+    cache.set_corpus_version('v2')
+    assert cache.get('x', [1.0, 0.0, 0.0]) is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,61 @@
+"""Test saving and attaching snapshots of the in-memory store."""
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+import numpy as np
+
+from rag_system.matrix_retriever import MatrixEmbeddingRetriever
+from rag_system.snapshot import attached_embeddings, content_hashes_version
+from rag_system.snapshot import corpus_version, load_snapshot
+from rag_system.snapshot import save_snapshot, snapshot_staleness
+
+DOCS = [Document(id='pyramid', content='The Great Pyramid of Giza',
+                 embedding=[3.0, 4.0, 0.0], meta={'content_hash': 'a'}),
+        Document(id='gardens', content='The Hanging Gardens of Babylon',
+                 embedding=[0.0, 0.0, 2.0], meta={'content_hash': 'b'})]
+
+
+def saved_snapshot(path):
+    """Save a snapshot of a store holding DOCS."""
+    doc_store = InMemoryDocumentStore()
+    doc_store.write_documents(DOCS)
+    save_snapshot(doc_store, str(path))
+    return str(path)
+
+
+def test_attach_maps_the_embeddings_instead_of_copying_them(tmp_path):
+    path = saved_snapshot(tmp_path / 'snapshot')
+    assert snapshot_staleness(path, with_embeddings=True) is None
+
+    doc_store = load_snapshot(path, index_bm25=False)
+    docs = doc_store.filter_documents()
+    assert [doc.id for doc in docs] == ['pyramid', 'gardens']
+    assert all(doc.embedding is None for doc in docs)
+
+    embeddings = attached_embeddings(doc_store, path)
+    assert isinstance(embeddings, np.memmap)
+    assert np.allclose(embeddings, [[0.6, 0.8, 0.0], [0.0, 0.0, 1.0]])
+
+    retriever = MatrixEmbeddingRetriever(doc_store)
+    retriever.set_embeddings(docs, embeddings, normalized=True)
+    assert retriever.matrix is embeddings
+    assert retriever.memory_bytes == 0
+    result = retriever.run(query_embedding=[0.0, 0.1, 1.0], top_k=1)
+    assert result["documents"][0].id == 'gardens'
+
+
+def test_copy_embeddings_restores_the_original_vectors(tmp_path):
+    path = saved_snapshot(tmp_path / 'snapshot')
+    doc_store = load_snapshot(path, copy_embeddings=True)
+    assert np.allclose([doc.embedding for doc in
+                        doc_store.filter_documents()],
+                       [doc.embedding for doc in DOCS])
+    assert attached_embeddings(doc_store, path) is None
+    assert doc_store.bm25_retrieval('babylon', top_k=1)[0].id == 'gardens'
+
+
+def test_corpus_version_only_depends_on_ids_and_hashes():
+    version = content_hashes_version({'gardens': 'b', 'pyramid': 'a'})
+    assert corpus_version(DOCS) == version
+    assert content_hashes_version({'pyramid': 'a'}) != version
+    assert content_hashes_version({'pyramid': 'a', 'gardens': 'c'}) \
+        != version